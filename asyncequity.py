@@ -0,0 +1,438 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+asyncequity.py
+    A non-blocking front end to the equity functions, for a process that
+    runs many tables from one event loop.  EquityService's comparehands,
+    weightedcomparehands and nhands take the same arguments as poker's and
+    return an EquityFuture at once; worker threads do the work:
+
+        service = EquityService(workers=2)
+        future = service.weightedcomparehands(mycards,enemiescards,flop)
+        future.add_done_callback(on_equity)     # or future.result(timeout)
+        ...
+        future.cancel()                         # the seat folded
+
+    Requests for the same situation (up to suit isomorphism) while one is
+    queued or running share it.  Queued requests on the same board are
+    done together: one pass over the runouts, evaluating each request's
+    hands on every runout that doesn't use one of its cards, which gives
+    exactly the results the separate calls would.  Cancelling every future
+    of a request drops it from the queue, or from its batch at the next
+    turn card if it's already running.
+
+    The callbacks run on the worker thread; an event loop should hand the
+    result over to its own thread (e.g. through a queue it polls).
+"""
+
+import threading,logging
+import poker,handstate
+from cardset import CardSet,as_cards,cards_mask,popcount,situation_key
+from combinatorics import xuniqueCombinations
+from poker_globals import *
+
+log = logging.getLogger("poker.asyncequity")
+
+class CancelledError(Exception):
+    pass
+
+class EquityFuture(object):
+    """ The pending result of one request to an EquityService. """
+
+    def __init__(self,service,job):
+        self._service = service
+        self._job = job
+        self._condition = threading.Condition()
+        self._state = 'pending'
+        self._result = self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        return self._state != 'pending'
+
+    def cancelled(self):
+        return self._state == 'cancelled'
+
+    def cancel(self):
+        """ Give up on the result.  False if it's already done. """
+        if not self._service._unsubscribe(self):
+            return False
+        self._finish('cancelled',None,None)
+        return True
+
+    def result(self,timeout=None):
+        """ Wait for the result (at most timeout seconds: then raise
+        RuntimeError) and return it, or raise the request's exception, or
+        CancelledError. """
+        self._condition.acquire()
+        try:
+            if self._state == 'pending':
+                self._condition.wait(timeout)
+            if self._state == 'pending':
+                raise RuntimeError("timed out waiting for an equity")
+        finally:
+            self._condition.release()
+        if self._state == 'cancelled':
+            raise CancelledError()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def add_done_callback(self,callback):
+        """ Call callback(future) once it's done (now, if it is). """
+        self._condition.acquire()
+        try:
+            if self._state == 'pending':
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._condition.release()
+        callback(self)
+
+    def _finish(self,state,result,exception):
+        self._condition.acquire()
+        try:
+            if self._state != 'pending':
+                return
+            (self._state,self._result,self._exception) = (state,result,exception)
+            callbacks = self._callbacks
+            self._callbacks = []
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                log.exception("equity future callback failed")
+
+class _Job:
+    """ One distinct request and the futures waiting on it. """
+
+    def __init__(self,key,batchkey,function,args):
+        self.key = key
+        self.batchkey = batchkey
+        self.function = function
+        self.args = args
+        self.futures = []
+        self.cancelled = False
+
+class EquityService:
+    """ Runs equity requests on a pool of worker threads; see above. """
+
+    def __init__(self,workers=2):
+        self.condition = threading.Condition()
+        self.pending = []
+        self.inflight = {}
+        self.running = True
+        self.threads = [threading.Thread(target=self._work,name="equity worker %d"%n) for n in range(workers)]
+        for thread in self.threads:
+            thread.setDaemon(True)
+            thread.start()
+
+    def shutdown(self,wait=True):
+        """ Stop the workers once the queue is empty (cancelling nothing). """
+        self.condition.acquire()
+        try:
+            self.running = False
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def comparehands(self,mycards,enemiescards,commoncards,force_unweighted=False,**sampling):
+        """ poker.comparehands, as a future. """
+        commoncards = as_cards(commoncards)
+        if len(commoncards) == 3 and not force_unweighted:
+            return self.weightedcomparehands(mycards,enemiescards,commoncards,**sampling)
+        if enemiescards is None or len(enemiescards) == 0:
+            return self._done(None)
+        (mycards,enemiescards) = (as_cards(mycards),poker._enemy_hands(enemiescards))
+        args = (mycards,enemiescards,commoncards)
+        if sampling:
+            key = ('sampled comparehands',repr(args),tuple(sorted(sampling.items())))
+            return self._submit(key,None,poker.comparehands,args+(True,),sampling)
+        key = ('comparehands',situation_key(mycards,enemiescards,commoncards))
+        batchkey = (CardSet(commoncards).mask,None)
+        return self._submit(key,batchkey,None,args)
+
+    def weightedcomparehands(self,mycards,enemiescards,commoncards,pokerval_db=None,turn_weight=0.75,**sampling):
+        """ poker.weightedcomparehands, as a future.  Results go in (and
+        come from) poker's weightedcomparehands cache and its equity store,
+        if it uses one. """
+        if enemiescards is None or len(enemiescards) == 0:
+            return self._done(None)
+        (mycards,enemiescards,commoncards) = (as_cards(mycards),poker._enemy_hands(enemiescards),as_cards(commoncards))
+        args = (mycards,enemiescards,commoncards)
+        if sampling:
+            key = ('sampled weightedcomparehands',repr(args),turn_weight,tuple(sorted(sampling.items())))
+            return self._submit(key,None,poker.weightedcomparehands,args+(None,turn_weight),sampling)
+        situation = situation_key(mycards,enemiescards,commoncards)
+        cached = poker.weightedcomparehands_cache.get((situation,turn_weight))
+        if cached is not None:
+            return self._done(cached)
+        if poker.equity_store is not None:
+            stored = poker.equity_store.get(situation,turn_weight)
+            if stored is not None:
+                poker.weightedcomparehands_cache[(situation,turn_weight)] = stored
+                return self._done(stored)
+        key = ('weightedcomparehands',situation,turn_weight)
+        batchkey = (CardSet(commoncards).mask,turn_weight)
+        return self._submit(key,batchkey,None,args)
+
+    def nhands(self,mycards,commoncards):
+        """ poker.nhands, as a future. """
+        (mycards,commoncards) = (as_cards(mycards),as_cards(commoncards))
+        key = ('nhands',situation_key(mycards,[],commoncards))
+        return self._submit(key,None,poker.nhands,(mycards,commoncards))
+
+    def call(self,function,*args,**kwargs):
+        """ Any other function(*args,**kwargs) on the workers, as a future
+        (not coalesced or batched). """
+        return self._submit(('call',object()),None,function,args,kwargs)
+
+    def _done(self,result):
+        future = EquityFuture(self,None)
+        future._finish('done',result,None)
+        return future
+
+    def _submit(self,key,batchkey,function,args,kwargs=None):
+        self.condition.acquire()
+        try:
+            job = self.inflight.get(key)
+            if job is None:
+                job = _Job(key,batchkey,function,(args,kwargs or {}))
+                self.inflight[key] = job
+                self.pending.append(job)
+                self.condition.notify()
+            future = EquityFuture(self,job)
+            job.futures.append(future)
+            return future
+        finally:
+            self.condition.release()
+
+    def _unsubscribe(self,future):
+        """ Take future off its job, dropping the job when nobody's left
+        waiting.  False if the future isn't pending. """
+        self.condition.acquire()
+        try:
+            job = future._job
+            if future.done() or job is None or future not in job.futures:
+                return False
+            job.futures.remove(future)
+            if not job.futures:
+                job.cancelled = True
+                if self.inflight.get(job.key) is job:
+                    del self.inflight[job.key]
+                if job in self.pending:
+                    self.pending.remove(job)
+            return True
+        finally:
+            self.condition.release()
+
+    def _next_batch(self):
+        """ The next job and every queued job on the same board, or None
+        once shut down. """
+        self.condition.acquire()
+        try:
+            while not self.pending:
+                if not self.running:
+                    return None
+                self.condition.wait()
+            first = self.pending.pop(0)
+            batch = [first]
+            if first.batchkey is not None:
+                batch += [job for job in self.pending if job.batchkey == first.batchkey]
+                self.pending = [job for job in self.pending if job.batchkey != first.batchkey]
+            return batch
+        finally:
+            self.condition.release()
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                if batch[0].batchkey is None:
+                    (args,kwargs) = batch[0].args
+                    results = [batch[0].function(*args,**kwargs)]
+                else:
+                    results = _enumerate_batch(batch,*batch[0].batchkey)
+                failure = None
+            except Exception,e:
+                log.exception("equity request failed")
+                (results,failure) = ([None]*len(batch),e)
+            for (job,result) in zip(batch,results):
+                self._complete(job,result,failure)
+
+    def _complete(self,job,result,failure):
+        self.condition.acquire()
+        try:
+            if self.inflight.get(job.key) is job:
+                del self.inflight[job.key]
+            futures = job.futures
+            job.futures = []
+        finally:
+            self.condition.release()
+        if failure is None and job.key[0] == 'weightedcomparehands' and result is not None:
+            poker.weightedcomparehands_cache[job.key[1:]] = result
+            if poker.equity_store is not None:
+                poker.equity_store.put(job.key[1],job.key[2],result)
+        for future in futures:
+            if failure is None:
+                future._finish('done',result,None)
+            else:
+                future._finish('done',None,failure)
+
+def _enumerate_batch(jobs,boardmask,turn_weight):
+    """ The equities of requests that share a board, from one pass over its
+    runouts: weightedcomparehands' turn and river blend on a flop if
+    turn_weight isn't None, otherwise comparehands'.  A request's hands are
+    only scored on the runouts that miss its cards, so each comes out just
+    as it would alone.  Cancelled requests are dropped (their result is
+    None) at the next turn card. """
+    state_pokerval = handstate.state_pokerval
+    showdown = poker._showdown
+    delta = handstate.INDEX_DELTA
+    board = handstate.add_mask(handstate.EMPTY,boardmask)
+    # per job: its card mask, hero state and enemy states
+    hands = []
+    for job in jobs:
+        (mycards,enemiescards,commoncards) = job.args[0]
+        mask = cards_mask(mycards)
+        for hiscards in enemiescards:
+            mask |= cards_mask(hiscards)
+        hands.append((mask,handstate.add_cards(board,mycards),
+                      [handstate.add_cards(board,hiscards) for hiscards in enemiescards]))
+    deck = CardSet.deck(boardmask).indices()
+    totals = [[0.,0.,0.,0.] for job in jobs]     # turn wins, turns, river wins, rivers
+    live = lambda: [n for n in range(len(jobs)) if not jobs[n].cancelled]
+
+    if turn_weight is not None:
+        for (i,turn) in enumerate(deck):
+            alive = live()
+            if not alive:
+                break
+            turnbit = 1<<turn
+            for n in alive:
+                (mask,mystate,hisstates) = hands[n]
+                if not mask & turnbit:
+                    if turn_weight > 0.0:
+                        totals[n][0] += showdown(state_pokerval,mystate,hisstates,delta[turn])
+                    totals[n][1] += 1
+            for river in deck[i+1:]:
+                bits = turnbit|(1<<river)
+                runout = delta[turn]+delta[river]
+                for n in alive:
+                    (mask,mystate,hisstates) = hands[n]
+                    if not mask & bits:
+                        totals[n][2] += showdown(state_pokerval,mystate,hisstates,runout)
+                        totals[n][3] += 1
+    else:
+        k = 5-popcount(boardmask)
+        first = None
+        for runout in xuniqueCombinations(deck,k):
+            if runout[:1] != first:
+                # a new first card: drop the cancelled requests
+                first = runout[:1]
+                alive = live()
+                if not alive:
+                    break
+            bits = sum([1<<card for card in runout])
+            runoutdelta = sum([delta[card] for card in runout])
+            for n in alive:
+                (mask,mystate,hisstates) = hands[n]
+                if not mask & bits:
+                    totals[n][2] += showdown(state_pokerval,mystate,hisstates,runoutdelta)
+                    totals[n][3] += 1
+
+    results = []
+    for (job,(turnwins,turns,riverwins,rivers)) in zip(jobs,totals):
+        if job.cancelled:
+            results.append(None)
+        elif turn_weight is not None:
+            results.append((turnwins/turns)*turn_weight + riverwins/rivers*(1.0-turn_weight))
+        else:
+            results.append(riverwins/rivers)
+    return results
+
+import unittest
+
+class Test_asyncequity(unittest.TestCase):
+
+    def setUp(self):
+        poker.clear_pokerval_cache()
+        self.service = EquityService(workers=1)
+
+    def tearDown(self):
+        self.service.shutdown()
+
+    def test_matches_poker(self):
+        flop = ["Kd","7s","2s"]
+        hands = [(["As","Ah"],[["Qh","Jh"]]),(["7h","7c"],[["Ks","Qs"],["3s","4s"]]),(["Ac","Kc"],[["2c","2h"]])]
+        futures = [self.service.weightedcomparehands(mine,his,flop) for (mine,his) in hands]
+        turn = [self.service.comparehands(mine,his,flop+["9d"]) for (mine,his) in hands]
+        river = self.service.comparehands(["As","Ah"],[["Qh","Jh"]],flop+["9d","Tc"])
+        counts = self.service.nhands(["As","Ah"],flop)
+        poker.clear_pokerval_cache()
+        for ((mine,his),future,turnfuture) in zip(hands,futures,turn):
+            self.assertAlmostEqual(future.result(30),poker.weightedcomparehands(mine,his,flop))
+            self.assertAlmostEqual(turnfuture.result(30),poker.comparehands(mine,his,flop+["9d"]))
+        self.assertEqual(river.result(30),poker.comparehands(["As","Ah"],[["Qh","Jh"]],flop+["9d","Tc"]))
+        self.assertEqual(counts.result(30),poker.nhands(["As","Ah"],flop))
+        # now it's cached
+        self.assertTrue(self.service.weightedcomparehands(*hands[0]+(flop,)).done())
+
+    def test_coalesce_and_cancel(self):
+        flop = ["Kd","7s","2s"]
+        # keep the worker busy so the rest queue up
+        self.service.comparehands(["As","Ah"],[["Qh","Jh"]],[],samples=20000,seed=1)
+        first = self.service.weightedcomparehands(["As","Ah"],[["Qh","Jh"]],flop)
+        # the same situation with the suits relabelled
+        second = self.service.weightedcomparehands(["Ac","Ah"],[["Qh","Jh"]],["Kd","7c","2c"])
+        self.assertTrue(first._job is second._job)
+        self.assertTrue(first.cancel())
+        self.assertFalse(first._job.cancelled)
+        folded = self.service.weightedcomparehands(["9c","9h"],[["Qh","Jh"]],flop)
+        self.assertTrue(folded.cancel())
+        self.assertTrue(folded._job.cancelled)
+        self.assertRaises(CancelledError,folded.result)
+        self.assertAlmostEqual(second.result(30),poker.weightedcomparehands(["As","Ah"],[["Qh","Jh"]],flop))
+        self.assertFalse(second.cancel())
+        self.assertRaises(CancelledError,first.result)
+
+    def test_equity_store(self):
+        import tempfile,os
+        poker.use_equity_store(os.path.join(tempfile.mkdtemp(),"equities.eqs"))
+        try:
+            (mine,his,flop) = (["As","Ah"],[["Qh","Jh"]],["Kd","7s","2s"])
+            situation = situation_key(as_cards(mine),poker._enemy_hands(his),as_cards(flop))
+            poker.equity_store.put(situation,0.75,0.125)
+            future = self.service.weightedcomparehands(mine,his,flop)
+            self.assertTrue(future.done())
+            self.assertTrue(future._job is None)
+            self.assertEqual(self.service.inflight,{})
+            self.assertEqual(future.result(),0.125)
+            self.assertEqual(poker.weightedcomparehands_cache.get((situation,0.75)),0.125)
+        finally:
+            poker.use_equity_store(None)
+
+if __name__ == '__main__':
+    unittest.main()
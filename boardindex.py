@@ -0,0 +1,157 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+boardindex.py
+    A per-board index of opponent hand strengths.  For a 3, 4 or 5 card
+    board, BoardIndex evaluates every 2-card holding an opponent could have
+    once and keeps the values sorted, along with, for each live card, the
+    sorted values of the holdings that use it.  How many holdings beat, tie
+    or lose to a pokerval is then a few binary searches: the counts over all
+    holdings, less the counts over the holdings that use one of the hero's
+    cards (which no opponent can hold), plus the holdings that use two of
+    them, which were taken away twice.
+
+    board_index(board) returns the cached index for a board, so all the
+    candidate hands on one board share it.
+"""
+
+from bisect import bisect_left,bisect_right
+import handstate,cache
+from cardset import CardSet,cards_mask,mask_indices
+
+class BoardIndex:
+    """ The sorted strengths of every opponent holding on one board. """
+
+    def __init__(self,board):
+        self.boardmask = cards_mask(board)
+        ncards = len(CardSet(self.boardmask))
+        if ncards < 3 or ncards > 5:
+            raise ValueError("a board index needs 3, 4 or 5 board cards, not %d"%ncards)
+        self.state = handstate.add_mask(handstate.EMPTY,self.boardmask)
+        live = CardSet.deck(self.boardmask).indices()
+        delta = handstate.INDEX_DELTA
+        state_pokerval = handstate.state_pokerval
+        values = []
+        bycard = dict([(i,[]) for i in live])
+        # holding value by its 2-card mask
+        holdings = {}
+        for (n,first) in enumerate(live):
+            state1 = self.state + delta[first]
+            for second in live[n+1:]:
+                value = state_pokerval(state1 + delta[second])
+                values.append(value)
+                bycard[first].append(value)
+                bycard[second].append(value)
+                holdings[(1<<first)|(1<<second)] = value
+        values.sort()
+        for cardvalues in bycard.values():
+            cardvalues.sort()
+        self.values = values
+        self.bycard = bycard
+        self.holdings = holdings
+
+    def pokerval(self,cards):
+        """ The pokerval of cards (a hero hand) on this board. """
+        return handstate.state_pokerval(handstate.add_mask(self.state,cards_mask(cards)))
+
+    def counts(self,pokerval,dead=0):
+        """ (higher, lower, tied): how many holdings that don't use a dead
+        card (a card mask, CardSet or card list) beat, lose to and tie
+        pokerval. """
+        dead = mask_indices(cards_mask(dead) & ~self.boardmask)
+        values = self.values
+        total = len(values)
+        higher = total - bisect_right(values,pokerval)
+        lower = bisect_left(values,pokerval)
+        for card in dead:
+            cardvalues = self.bycard[card]
+            total -= len(cardvalues)
+            higher -= len(cardvalues) - bisect_right(cardvalues,pokerval)
+            lower -= bisect_left(cardvalues,pokerval)
+        # holdings made of two dead cards were taken away twice
+        for (n,first) in enumerate(dead):
+            for second in dead[n+1:]:
+                value = self.holdings[(1<<first)|(1<<second)]
+                total += 1
+                if value > pokerval:
+                    higher += 1
+                elif value < pokerval:
+                    lower += 1
+        return (higher,lower,total-higher-lower)
+
+    def nhands(self,mycards):
+        """ (nhandshi, nhandslo, nhandsti) for mycards on this board, just
+        like poker.nhands. """
+        mask = cards_mask(mycards)
+        return self.counts(self.pokerval(mask),mask)
+
+# the indexes of recently seen boards
+board_indexes = cache.LRUCache("boardindex.board_index",maxentries=256)
+
+def board_index(board):
+    """ The (cached) BoardIndex of a board. """
+    boardmask = cards_mask(board)
+    index = board_indexes.get(boardmask)
+    if index is None:
+        index = BoardIndex(boardmask)
+        board_indexes[boardmask] = index
+    return index
+
+def hand_percentile(hole,board):
+    """ The fraction of the opponent holdings on board that hole beats,
+    counting ties as half: 1.0 is the nuts.
+
+    >>> hand_percentile(["As","Ah"],["Ad","Ac","Kd","Kc","2h"])
+    1.0
+    """
+    index = board_index(board)
+    (higher,lower,tied) = index.nhands(hole)
+    return (lower + tied/2.)/(higher+lower+tied)
+
+import unittest
+
+class Test_boardindex(unittest.TestCase):
+
+    def test_matches_enumeration(self):
+        import random
+        rand = random.Random(13)
+        deck = range(52)
+        for nboard in (3,4,5):
+            for i in range(4):
+                cards = rand.sample(deck,nboard+2)
+                board = sum([1<<c for c in cards[:nboard]])
+                mine = sum([1<<c for c in cards[nboard:]])
+                index = BoardIndex(board)
+                myval = index.pokerval(mine)
+                expected = [0,0,0]
+                live = CardSet.deck(board,mine).indices()
+                for (n,first) in enumerate(live):
+                    for second in live[n+1:]:
+                        value = handstate.state_pokerval(handstate.add_mask(index.state,(1<<first)|(1<<second)))
+                        expected[cmp(myval,value)+1] += 1
+                self.assertEqual(index.nhands(mine),(expected[0],expected[2],expected[1]))
+
+    def test_percentile(self):
+        board = ["Kd","7s","2c"]
+        self.assertTrue(hand_percentile(["Kc","Ks"],board) > hand_percentile(["As","Kc"],board) > hand_percentile(["3d","4h"],board))
+        self.assertTrue(board_index(CardSet(board)) is board_index(board))
+        self.assertRaises(ValueError,BoardIndex,["Kd","7s"])
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+    unittest.main()
@@ -0,0 +1,340 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+cache.py
+    Bounded, thread-safe caches for pokervals and equity results.
+
+    LRUCache evicts the least recently used entry; ClockCache approximates
+    that with the CLOCK algorithm (one "referenced" bit per entry and a hand
+    sweeping round them), which makes a hit a little cheaper.  Either can be
+    limited by number of entries, by estimated bytes, or both:
+
+        pokervals = LRUCache("poker.pokerval",maxentries=1<<17)
+        pokervals[key] = value
+        value = pokervals.get(key)      # None on a miss
+        print pokervals.stats()         # hits, misses, evictions, bytes, ...
+
+    Every cache registers itself by name, and all_stats() reports on all of
+    them.  The byte counts are estimates (sys.getsizeof of the key and value
+    plus a fixed per-entry overhead), good enough to bound a long-running
+    process, not an exact accounting.
+"""
+
+import sys,threading,weakref
+
+# rough bookkeeping cost of one entry: its dict slot plus the list the
+# policy keeps it in.
+ENTRY_OVERHEAD = 120
+
+_registry = weakref.WeakValueDictionary()
+
+def all_stats():
+    """ stats() of every live cache, by name. """
+    return dict([(name,cache.stats()) for (name,cache) in _registry.items()])
+
+def get_cache(name):
+    """ The live cache registered under name, or None. """
+    return _registry.get(name)
+
+def make_cache(name,policy="lru",maxentries=None,maxbytes=None):
+    """ A new LRUCache or ClockCache, by policy name. """
+    if policy == "lru":
+        return LRUCache(name,maxentries,maxbytes)
+    elif policy == "clock":
+        return ClockCache(name,maxentries,maxbytes)
+    raise ValueError("unknown cache policy: %s"%policy)
+
+def _entry_size(key,value):
+    return sys.getsizeof(key) + sys.getsizeof(value) + ENTRY_OVERHEAD
+
+class _Cache(object):
+    """ The size limits, statistics and locking shared by both policies.
+    Subclasses implement _get, _set, _evict_one and _clear, which are only
+    called with the lock held. """
+
+    def __init__(self,name,maxentries=None,maxbytes=None):
+        self.name = name
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        self.bytes = 0
+        self._clear()
+        _registry[name] = self
+
+    def get(self,key,default=None):
+        """ The cached value for key, or default; counts a hit or a miss. """
+        self.lock.acquire()
+        try:
+            value = self._get(key,self)
+            if value is self:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+        finally:
+            self.lock.release()
+
+    def __getitem__(self,key):
+        value = self.get(key,self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self,key,value):
+        self.lock.acquire()
+        try:
+            self._set(key,value)
+            self._shrink()
+        finally:
+            self.lock.release()
+
+    def __contains__(self,key):
+        """ Whether key is cached, without counting a hit or marking it used. """
+        return key in self.map
+
+    def __len__(self):
+        return len(self.map)
+
+    def _over(self):
+        return ((self.maxentries is not None and len(self.map) > self.maxentries) or
+                (self.maxbytes is not None and self.bytes > self.maxbytes))
+
+    def _shrink(self):
+        while self.map and self._over():
+            self._evict_one()
+            self.evictions += 1
+
+    def resize(self,maxentries=None,maxbytes=None):
+        """ Change the limits, evicting entries if the cache is now too big. """
+        self.lock.acquire()
+        try:
+            self.maxentries = maxentries
+            self.maxbytes = maxbytes
+            self._shrink()
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        """ Drop every entry and reset the statistics. """
+        self.lock.acquire()
+        try:
+            self._clear()
+            self.hits = self.misses = self.evictions = 0
+            self.bytes = 0
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """ A dict of hits, misses, evictions, entries, bytes (estimated),
+        hitrate and the limits. """
+        self.lock.acquire()
+        try:
+            lookups = self.hits + self.misses
+            return {'name':self.name, 'policy':self.policy,
+                    'hits':self.hits, 'misses':self.misses, 'evictions':self.evictions,
+                    'entries':len(self.map), 'bytes':self.bytes,
+                    'maxentries':self.maxentries, 'maxbytes':self.maxbytes,
+                    'hitrate':lookups and float(self.hits)/lookups or 0.0}
+        finally:
+            self.lock.release()
+
+    def __repr__(self):
+        return "<%s %s: %d entries, %d hits, %d misses>"%(self.__class__.__name__,self.name,len(self.map),self.hits,self.misses)
+
+# fields of an LRUCache link
+_PREV,_NEXT,_KEY,_VALUE,_SIZE = range(5)
+
+class LRUCache(_Cache):
+    """ Least recently used eviction: a dict of links in a circular doubly
+    linked list, most recently used just after the root. """
+    policy = "lru"
+
+    def _clear(self):
+        self.map = {}
+        self.root = root = []
+        root[:] = [root,root,None,None,0]
+
+    def _get(self,key,default):
+        link = self.map.get(key)
+        if link is None:
+            return default
+        # move the link to the front
+        (prev,next) = link[_PREV],link[_NEXT]
+        prev[_NEXT] = next
+        next[_PREV] = prev
+        root = self.root
+        first = root[_NEXT]
+        link[_PREV] = root
+        link[_NEXT] = first
+        first[_PREV] = root[_NEXT] = link
+        return link[_VALUE]
+
+    def _set(self,key,value):
+        size = _entry_size(key,value)
+        link = self.map.get(key)
+        if link is not None:
+            self._get(key,None)
+            self.bytes += size - link[_SIZE]
+            link[_VALUE] = value
+            link[_SIZE] = size
+            return
+        root = self.root
+        first = root[_NEXT]
+        link = [root,first,key,value,size]
+        first[_PREV] = root[_NEXT] = link
+        self.map[key] = link
+        self.bytes += size
+
+    def _evict_one(self):
+        root = self.root
+        last = root[_PREV]
+        prev = last[_PREV]
+        prev[_NEXT] = root
+        root[_PREV] = prev
+        del self.map[last[_KEY]]
+        self.bytes -= last[_SIZE]
+
+class ClockCache(_Cache):
+    """ CLOCK eviction: entries sit in slots round a ring with a referenced
+    bit that a hit sets; to evict, the hand sweeps round clearing set bits
+    until it finds a clear one. """
+    policy = "clock"
+
+    def _clear(self):
+        self.map = {}       # key -> slot
+        self.keys = []
+        self.values = []
+        self.sizes = []
+        self.referenced = []
+        self.free = []
+        self.hand = 0
+
+    def _get(self,key,default):
+        slot = self.map.get(key)
+        if slot is None:
+            return default
+        self.referenced[slot] = True
+        return self.values[slot]
+
+    def _set(self,key,value):
+        size = _entry_size(key,value)
+        slot = self.map.get(key)
+        if slot is not None:
+            self.bytes += size - self.sizes[slot]
+            self.values[slot] = value
+            self.sizes[slot] = size
+            self.referenced[slot] = True
+            return
+        if self.free:
+            slot = self.free.pop()
+            self.keys[slot] = key
+            self.values[slot] = value
+            self.sizes[slot] = size
+            self.referenced[slot] = False
+        else:
+            slot = len(self.keys)
+            self.keys.append(key)
+            self.values.append(value)
+            self.sizes.append(size)
+            self.referenced.append(False)
+        self.map[key] = slot
+        self.bytes += size
+
+    def _evict_one(self):
+        keys = self.keys
+        referenced = self.referenced
+        nslots = len(keys)
+        hand = self.hand
+        while True:
+            if hand >= nslots:
+                hand = 0
+            if keys[hand] is not self and not referenced[hand]:
+                break
+            referenced[hand] = False
+            hand += 1
+        del self.map[keys[hand]]
+        self.bytes -= self.sizes[hand]
+        # an empty slot holds the cache itself as its key
+        keys[hand] = self
+        self.values[hand] = None
+        self.sizes[hand] = 0
+        self.free.append(hand)
+        self.hand = hand+1
+
+import unittest
+
+class Test_cache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = LRUCache("test.lru",maxentries=3)
+        for key in "abc":
+            cache[key] = key.upper()
+        self.assertEqual(cache.get("a"),"A")     # a is now the most recent
+        cache["d"] = "D"                         # so b goes
+        self.assertFalse("b" in cache)
+        self.assertEqual(cache.get("b"),None)
+        self.assertRaises(KeyError,cache.__getitem__,"b")
+        self.assertEqual(sorted(cache.map.keys()),["a","c","d"])
+        stats = cache.stats()
+        self.assertEqual((stats['hits'],stats['misses'],stats['evictions'],stats['entries']),(1,2,1,3))
+        cache.resize(maxentries=1)
+        self.assertEqual(cache.map.keys(),["d"])
+        cache.clear()
+        self.assertEqual((len(cache),cache.stats()['hits'],cache.bytes),(0,0,0))
+
+    def test_clock(self):
+        cache = ClockCache("test.clock",maxentries=3)
+        for key in "abc":
+            cache[key] = key.upper()
+        cache.get("a")
+        cache["d"] = "D"    # the hand passes a (referenced) and takes b
+        self.assertEqual(sorted(cache.map.keys()),["a","c","d"])
+        cache["e"] = "E"    # then c
+        self.assertEqual(sorted(cache.map.keys()),["a","d","e"])
+        self.assertEqual([cache[key] for key in "ade"],["A","D","E"])
+        self.assertEqual(cache.stats()['evictions'],2)
+
+    def test_maxbytes(self):
+        for policy in ("lru","clock"):
+            cache = make_cache("test.bytes."+policy,policy,maxbytes=10*_entry_size(1000,1000))
+            for i in range(1000,1100):
+                cache[i] = i
+            self.assertEqual(len(cache),10)
+            self.assertTrue(cache.bytes <= cache.maxbytes)
+            self.assertTrue("test.bytes."+policy in all_stats())
+
+    def test_threads(self):
+        cache = LRUCache("test.threads",maxentries=50)
+        def work(offset):
+            for i in range(2000):
+                key = (i*7+offset)%120
+                if cache.get(key) is None:
+                    cache[key] = key
+        threads = [threading.Thread(target=work,args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = cache.stats()
+        self.assertEqual(stats['hits']+stats['misses'],8000)
+        self.assertEqual(len(cache),50)
+        for (key,link) in cache.map.items():
+            self.assertEqual(link[_VALUE],key)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,272 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+cardset.py
+    CardSet, a set of cards stored as one integer bitmask.  Card (rank,suit)
+    is bit ((rank-2)<<2) | (suit-1), the same numbering as
+    pokertable.card_index (2c=0, 2d=1, ... As=51), so membership, union and
+    removing dead cards are single integer operations:
+
+        deck = CardSet.deck(mycards, commoncards)   # everything still live
+        if (14,4) in deck: ...
+        for card in deck: ...                       # (rank,suit) tuples
+
+    Anywhere poker.py takes a list of cards it also takes a CardSet, and
+    as_cards turns either (or a list of strings like "As") into the list of
+    (rank,suit) tuples the rest of the library uses.
+
+    situation_key maps a hero hand, enemy hands and a board to one integer
+    that is the same for every relabelling of the suits, for caching results
+    that only depend on the situation up to suit isomorphism.
+"""
+
+import itertools
+from combinatorics import mask_to_indices as mask_indices
+from poker_globals import *
+
+NUMCARDS = 52
+FULL_MASK = (1<<NUMCARDS)-1
+
+# INDEX_CARD[i] is the (rank,suit) card with index i, CARD_BIT[card] its bit.
+INDEX_CARD = [((i>>2)+2,(i&3)+1) for i in range(NUMCARDS)]
+CARD_BIT = {}
+for (_i,_card) in enumerate(INDEX_CARD):
+    CARD_BIT[_card] = 1<<_i
+    # suit 0 is treated like suit 4, just as normalize_suits does.
+    if _card[1]==4:
+        CARD_BIT[(_card[0],0)] = 1<<_i
+
+# bit count of every 16-bit value, for popcounts of 52-bit masks.
+_POPCOUNT16 = [0]*65536
+for _i in range(1,65536):
+    _POPCOUNT16[_i] = _POPCOUNT16[_i>>1] + (_i&1)
+
+def popcount(mask):
+    """ The number of set bits in a 52-bit mask. """
+    return (_POPCOUNT16[mask & 0xffff] + _POPCOUNT16[(mask>>16) & 0xffff] +
+            _POPCOUNT16[(mask>>32) & 0xffff] + _POPCOUNT16[mask>>48])
+
+def card_bit(card):
+    """ The bit of a (rank,suit) card or a card string like "As". """
+    if type(card) is str:
+        card = (cvt_to_rank(card[0]),cvt_to_suit(card[1]))
+    try:
+        return CARD_BIT[card[0],card[1]]
+    except KeyError:
+        raise ValueError("not a card: %s"%(card,))
+
+def cards_mask(cards):
+    """ The bitmask of a CardSet, an int mask, or a sequence of (rank,suit)
+    cards or card strings. """
+    if isinstance(cards,CardSet):
+        return cards.mask
+    if type(cards) in (int,long):
+        return cards
+    mask = 0
+    for card in cards:
+        mask |= card_bit(card)
+    return mask
+
+# _PERMUTED_BITS[p][i] is the bit card index i moves to under the p'th of the
+# 24 relabellings of the suits.
+_PERMUTED_BITS = [[1 << ((i & ~3) | perm[i & 3]) for i in range(NUMCARDS)]
+                  for perm in itertools.permutations(range(4))]
+
+def situation_key(mycards,enemiescards,commoncards):
+    """ A canonical integer for a hero hand, a list of enemy hands and a
+    board (each a CardSet or a list of cards), which is equal for any two
+    situations that differ only by a relabelling of the suits, the order of
+    the cards within a hand, or the order of the enemies.  It's the smallest
+    packing of the hands' masks over all 24 suit permutations.
+
+    >>> situation_key(["As","Kd"],[["Qs","Qh"]],["2c","7s","9d"]) == situation_key(["Kh","Ac"],[["Qd","Qc"]],["2s","9h","7c"])
+    True
+    """
+    groups = [mask_indices(cards_mask(mycards)),mask_indices(cards_mask(commoncards))]
+    enemies = [mask_indices(cards_mask(hiscards)) for hiscards in enemiescards]
+    best = None
+    for bits in _PERMUTED_BITS:
+        key = len(enemies)
+        for hand in sorted([sum([bits[i] for i in hand]) for hand in enemies],reverse=True):
+            key = (key << NUMCARDS) | hand
+        for group in groups:
+            key = (key << NUMCARDS) | sum([bits[i] for i in group])
+        if best is None or key < best:
+            best = key
+    return best
+
+class CardSet(object):
+    """ An immutable set of cards backed by a 52-bit integer. """
+    __slots__ = ('mask',)
+
+    def __init__(self,cards=0):
+        self.mask = cards_mask(cards)
+        if self.mask & ~FULL_MASK:
+            raise ValueError("not a 52-card mask: %x"%self.mask)
+
+    @classmethod
+    def deck(cls,*dead):
+        """ Every card not in any of dead, each a CardSet or list of cards. """
+        mask = FULL_MASK
+        for cards in dead:
+            mask &= ~cards_mask(cards)
+        return cls(mask)
+
+    def __contains__(self,card):
+        return (self.mask & card_bit(card)) != 0
+
+    def __len__(self):
+        return popcount(self.mask)
+
+    def __nonzero__(self):
+        return self.mask != 0
+
+    def __iter__(self):
+        mask = self.mask
+        while mask:
+            low = mask & -mask
+            yield INDEX_CARD[low.bit_length()-1]
+            mask ^= low
+
+    def indices(self):
+        """ The card indices (pokertable.card_index) in the set, in order. """
+        return mask_indices(self.mask)
+
+    def cards(self):
+        """ The cards as a list of (rank,suit) tuples, 2c first. """
+        return list(self)
+
+    def strings(self):
+        """ The cards as strings like "As", in the format cvt_to_cards reads. """
+        return [cvt_to_rankstring(rank)+cvt_to_suitstring(suit) for (rank,suit) in self]
+
+    def __or__(self,other):
+        return CardSet(self.mask | cards_mask(other))
+    __ror__ = __or__
+    union = __or__
+
+    def __and__(self,other):
+        return CardSet(self.mask & cards_mask(other))
+    __rand__ = __and__
+    intersection = __and__
+
+    def __sub__(self,other):
+        return CardSet(self.mask & ~cards_mask(other))
+    difference = __sub__
+
+    def add(self,card):
+        """ A new CardSet with card added. """
+        return CardSet(self.mask | card_bit(card))
+
+    def remove(self,card):
+        """ A new CardSet without card. """
+        return CardSet(self.mask & ~card_bit(card))
+
+    def isdisjoint(self,other):
+        return (self.mask & cards_mask(other)) == 0
+
+    def __eq__(self,other):
+        if isinstance(other,CardSet):
+            return self.mask == other.mask
+        return NotImplemented
+
+    def __ne__(self,other):
+        if isinstance(other,CardSet):
+            return self.mask != other.mask
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.mask)
+
+    def __repr__(self):
+        return "CardSet(%s)"%(self.strings(),)
+
+    def __str__(self):
+        return format_cards(self.cards())
+
+def as_cards(cards):
+    """ A list of (rank,suit) tuples from a CardSet, a list of card strings
+    like "As", or a list of cards (which is copied, with each card made a
+    tuple).
+
+    >>> as_cards(CardSet(["Kd","As"]))
+    [(13, 2), (14, 4)]
+    >>> as_cards(["Kd","As"])
+    [(13, 2), (14, 4)]
+    """
+    if isinstance(cards,CardSet):
+        return cards.cards()
+    if cards is None:
+        return []
+    result = []
+    for card in cards:
+        if type(card) is str:
+            result.append((cvt_to_rank(card[0]),cvt_to_suit(card[1])))
+        else:
+            result.append((card[0],card[1]))
+    return result
+
+import unittest
+
+class Test_cardset(unittest.TestCase):
+
+    def test_set_operations(self):
+        hand = CardSet(["As","Kd"])
+        self.assertEqual(len(hand),2)
+        self.assertTrue((14,4) in hand)
+        self.assertTrue("Kd" in hand)
+        self.assertFalse((13,1) in hand)
+        self.assertEqual(hand | [(2,1)],CardSet([(2,1),(14,4),(13,2)]))
+        self.assertEqual(hand - ["As"],CardSet(["Kd"]))
+        self.assertEqual(hand & CardSet(["Kd","Qd"]),CardSet(["Kd"]))
+        self.assertEqual(hand.add("2c").remove("As"),CardSet(["2c","Kd"]))
+        self.assertTrue(hand.isdisjoint(["Ac"]))
+        self.assertEqual(CardSet((14,0) for i in range(1)),CardSet(["As"]))
+
+    def test_deck(self):
+        deck = CardSet.deck(["As","Kd"],CardSet(["2c"]))
+        self.assertEqual(len(deck),49)
+        self.assertFalse("As" in deck)
+        self.assertEqual(len(CardSet.deck()),52)
+        self.assertEqual(list(CardSet.deck()),[(val,suit) for val in range(2,15) for suit in range(1,5)])
+        self.assertEqual(CardSet.deck().indices(),range(52))
+
+    def test_situation_key(self):
+        mine = cvt_to_cards(["Td","8h"])
+        his = [cvt_to_cards(["5c","7c"]),cvt_to_cards(["Ts","2d"])]
+        board = cvt_to_cards(["4d","6h","Tc"])
+        key = situation_key(mine,his,board)
+        for perm in itertools.permutations(range(1,5)):
+            relabel = lambda cards: [(rank,perm[suit-1]) for (rank,suit) in cards]
+            self.assertEqual(situation_key(relabel(mine)[::-1],[relabel(hand) for hand in his[::-1]],CardSet(relabel(board))),key)
+        self.assertNotEqual(situation_key(mine,his[:1],board),key)
+        self.assertNotEqual(situation_key(mine,his,cvt_to_cards(["4d","6d","Tc"])),key)
+
+    def test_conversions(self):
+        strings = ["2c","Th","Ks","Ad"]
+        cards = cvt_to_cards(strings)
+        self.assertEqual(CardSet(strings),CardSet(cards))
+        self.assertEqual(CardSet(cards).cards(),sorted(cards))
+        self.assertEqual(sorted(CardSet(cards).strings()),sorted(strings))
+        self.assertEqual(CardSet(CardSet(cards).mask),CardSet(cards))
+        self.assertEqual(as_cards([[10,3],(2,1)]),[(10,3),(2,1)])
+        self.assertRaises(ValueError,CardSet,[(15,1)])
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+    unittest.main()
@@ -0,0 +1,187 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+combinatorics.py
+    Combinations of cards: enumeration, ranking and unranking.
+
+    Ranks use the combinatorial number system: the k-subset c0 < c1 < ... of
+    range(n) has colex rank C(c0,1) + C(c1,2) + ..., which numbers the subsets
+    0..C(n,k)-1 in colexicographic order and doesn't depend on n.  That lets a
+    sequence of combinations be started at any rank, or split into contiguous
+    chunks for workers.
+
+    xuniqueCombinations is the drop-in replacement for the old probstat /
+    recursive generator that poker_globals used to define.
+"""
+
+import itertools
+
+MAXN = 52
+
+# CHOOSE[n][k] == n choose k, for 0 <= k,n <= MAXN.
+CHOOSE = [[0]*(MAXN+1) for n in range(MAXN+1)]
+for n in range(MAXN+1):
+    CHOOSE[n][0] = 1
+    for k in range(1,n+1):
+        CHOOSE[n][k] = CHOOSE[n-1][k-1] + CHOOSE[n-1][k]
+
+def choose(n,k):
+    """ n choose k. """
+    if k<0 or k>n:
+        return 0
+    if n<=MAXN:
+        return CHOOSE[n][k]
+    result = 1
+    for i in range(min(k,n-k)):
+        result = result*(n-i)//(i+1)
+    return result
+
+def xuniqueCombinations(items,n):
+    """ Yield every n-item combination of items, as a list, in lexicographic
+    order of position (the order the old recursive generator used). """
+    return itertools.imap(list,itertools.combinations(items,n))
+
+def rank(indices):
+    """ The colex rank of a set of distinct non-negative ints.
+
+    >>> rank([0,1,2]), rank([0,1,3]), rank([3,2,1])
+    (0, 1, 3)
+    """
+    result = 0
+    k = 1
+    for c in sorted(indices):
+        result += CHOOSE[c][k]
+        k += 1
+    return result
+
+def unrank(r,k):
+    """ Inverse of rank: the sorted k-subset with colex rank r.
+
+    >>> unrank(3,3)
+    [1, 2, 3]
+    """
+    indices = [0]*k
+    for i in range(k,0,-1):
+        c = i-1
+        while CHOOSE[c+1][i] <= r:
+            c += 1
+        indices[i-1] = c
+        r -= CHOOSE[c][i]
+    return indices
+
+def combinations(n,k,start=0,stop=None):
+    """ Yield the k-subsets of range(n) with colex ranks start..stop-1 (all of
+    them by default), in order, as sorted lists.  The same list object is
+    reused (mutated) between yields, so copy it if you need to keep it. """
+    total = CHOOSE[n][k]
+    if stop is None or stop > total:
+        stop = total
+    if start >= stop:
+        return
+    if k==0:
+        yield []
+        return
+    c = unrank(start,k)
+    remaining = stop-start
+    while True:
+        yield c
+        remaining -= 1
+        if remaining == 0:
+            return
+        i = 0
+        while i<k-1 and c[i]+1==c[i+1]:
+            c[i] = i
+            i += 1
+        c[i] += 1
+
+def masks(n,k,start=0,stop=None):
+    """ Like combinations, but yield each subset as an int with bit c set for
+    each member c.  Colex order is numeric order of the masks, so each one
+    follows from the last by Gosper's hack, without building any lists.
+
+    >>> [bin(mask) for mask in masks(4,2)]
+    ['0b11', '0b101', '0b110', '0b1001', '0b1010', '0b1100']
+    """
+    total = CHOOSE[n][k]
+    if stop is None or stop > total:
+        stop = total
+    if start >= stop:
+        return
+    mask = 0
+    for c in unrank(start,k):
+        mask |= 1<<c
+    if k==0:
+        yield 0
+        return
+    for i in xrange(stop-start):
+        yield mask
+        low = mask & -mask
+        ripple = mask + low
+        mask = (((ripple ^ mask) >> 2) // low) | ripple
+
+def chunks(n,k,nchunks):
+    """ Split the C(n,k) k-subsets of range(n) into nchunks contiguous (start,
+    stop) rank ranges of (nearly) equal size, for handing out to workers.
+
+    >>> chunks(6,3,3)
+    [(0, 6), (6, 13), (13, 20)]
+    """
+    total = CHOOSE[n][k]
+    bounds = [total*i//nchunks for i in range(nchunks+1)]
+    return zip(bounds[:-1],bounds[1:])
+
+def mask_to_indices(mask):
+    """ The sorted members of a bitmask subset. """
+    indices = []
+    while mask:
+        low = mask & -mask
+        indices.append(low.bit_length()-1)
+        mask ^= low
+    return indices
+
+import unittest
+
+class Test_combinatorics(unittest.TestCase):
+
+    def test_rank_order(self):
+        for (n,k) in ((5,3),(10,4),(7,7),(52,1),(6,0)):
+            subsets = [list(c) for c in combinations(n,k)]
+            self.assertEqual(len(subsets),CHOOSE[n][k])
+            self.assertEqual([rank(c) for c in subsets],range(CHOOSE[n][k]))
+            self.assertEqual([unrank(r,k) for r in range(CHOOSE[n][k])],subsets)
+            self.assertEqual([mask_to_indices(m) for m in masks(n,k)],subsets)
+        for r in (0,1,17,123456,CHOOSE[52][7]-1):
+            self.assertEqual(rank(unrank(r,7)),r)
+
+    def test_start_stop(self):
+        everything = [list(c) for c in combinations(10,4)]
+        self.assertEqual([list(c) for c in combinations(10,4,start=100)],everything[100:])
+        self.assertEqual([list(c) for c in combinations(10,4,start=7,stop=50)],everything[7:50])
+        self.assertEqual([mask_to_indices(m) for m in masks(10,4,7,50)],everything[7:50])
+        pieces = []
+        for (start,stop) in chunks(10,4,7):
+            pieces.extend([list(c) for c in combinations(10,4,start,stop)])
+        self.assertEqual(pieces,everything)
+
+    def test_xuniqueCombinations(self):
+        self.assertEqual(list(xuniqueCombinations(['a','b','c'],2)),[['a','b'],['a','c'],['b','c']])
+        self.assertEqual(choose(60,3),34220)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+    unittest.main()
@@ -17,39 +17,36 @@ THEbot, a Texas Hold'em poker software library.
 
 database_generator.py
     Execute this script to regenerate the precomputed databases of poker
-    hands and their respective values: pokervals?.shelf for 5, 6, and 7 hands.
+    hands and their respective values: the flat pokervals?.tbl tables for
+    5, 6, and 7 card hands, and with --preflop the preflop equity table
+    preflop.tbl (see preflop.py).  regenerate_database builds the keyed
+    pokervals?.rec files instead, which nothing in poker.py needs any more
+    but which can be passed to getpokerval as its pokerval_db.
 """
 
-import poker,pickle,sys,shelve,anydbm,time,logging
+import poker,pickle,sys,time,logging,os,array,random,itertools,Queue
+import pokertable,handeval,handstate,combinatorics,cache
 from poker_globals import *
 
-global pokerval_cache,pokerval_cachehits,pokerval_cachemisses,weightedcomparehands_cache,weightedcomparehands_cachehits
-
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
 
+# the generator's own cache of calculate_pokerval results, bounded so a
+# full 7-card run can't grow it without limit.
+pokerval_cache = cache.LRUCache("database_generator.pokerval",maxentries=1<<18)
+
 def _clear_pokerval_cache():
-    global pokerval_cache,pokerval_cachehits,pokerval_cachemisses,weightedcomparehands_cache,weightedcomparehands_cachehits
-    pokerval_cache={}
-    weightedcomparehands_cache={}
-    pokerval_cachehits=0
-    pokerval_cachemisses=0
-    weightedcomparehands_cachehits=0
+    pokerval_cache.clear()
 
 def calculate_pokerval(_cards):
     """ Calculate/retrieve a pokerval from a set of 5 or more cards. Also return
-    the 'index' used for db storage. """
-    global pokerval_cache,pokerval_cachehits,pokerval_cachemisses
-    cards = poker.normalize_cards(_cards)
+    the 'index' used for db storage, the handstate.hand_key of the cards. """
+    cards = sorted(_cards)
     try:
-        index = poker.make_stringindex(cards)
-        try:
-            pokerval = pokerval_cache[index]
-            pokerval_cachehits+=1
+        index = handstate.hand_key(cards)
+        pokerval = pokerval_cache.get(index)
+        if pokerval is not None:
             return index, pokerval
-        except KeyError:
-            pokerval_cachemisses+=1
-            pass
 
         pokerval = 0
         if len(cards) == 5:
@@ -63,71 +60,521 @@ def calculate_pokerval(_cards):
             
         pokerval_cache[index] = pokerval
     except KeyError:
-        errstr = "Hand not in database: %s %s, <%s>, %s"%(format_cards(_cards),format_cards(cards),index,reverse_stringindex(index))
+        errstr = "Hand not in database: %s, <%x>, %s"%(format_cards(_cards),index,format_cards(handstate.key_cards(index)))
         raise KeyError(errstr)
     except:
         raise
 
     return index,pokerval
 
-def regenerate_database():
-    """ Go thru each possible hand and make a new db with the data items. """
-    deck = []
-    for val in range(2,15):
-        for suit in range(1,5):
-            deck.append((val,suit))
-    
-    possiblehands = {
-        5: (2598960, 160537),
-        6: (20358520, 1250964),
-        7: (133784560,  210080),
-    }
-    
-    allCombinations = sum([y[0] for (x,y) in possiblehands.iteritems()])
+def enumerate_hands(numcards,start=0):
+    """ Pipeline stage 1: every possible numcards-card hand, as a sorted list
+    of cards, in colex rank order from rank start on. """
+    index_card = pokertable.index_card
+    for indices in combinatorics.combinations(52,numcards,start):
+        yield [index_card(c) for c in indices]
+
+def canonical_hands(hands):
+    """ Pipeline stage 2: pair each hand with its canonical database index
+    (its handstate.hand_key). """
+    hand_key = handstate.hand_key
+    for cards in hands:
+        yield hand_key(cards),cards
+
+def unique_hands(indexed_hands):
+    """ Pipeline stage 3: keep only the hand that is its index's
+    representative (handstate.key_cards), so each index goes on to be
+    evaluated exactly once, without remembering which have been seen. """
+    key_cards = handstate.key_cards
+    for (index,cards) in indexed_hands:
+        if cards == key_cards(index):
+            yield index,cards
+
+def evaluated_hands(indexed_hands):
+    """ Pipeline stage 4: attach each hand's pokerval. """
+    for (index,cards) in indexed_hands:
+        yield calculate_pokerval(cards)
+
+RECORD_CHECKPOINT_EVERY = 1<<22
+
+def regenerate_database(sizes=(5,6,7)):
+    """ Go thru each possible hand and write a keyed pokervals?.rec file
+    (see pokertable.RecordWriter) with one record per database index.
+
+    This is a streaming pipeline: enumeration feeds canonicalization, which
+    feeds deduplication by index, so only the unique hands are evaluated, and
+    the records go to sorted runs on disk that are merged, in large
+    sequential writes, when each size is done.  Progress is checkpointed
+    every RECORD_CHECKPOINT_EVERY hands, so a killed run resumes where it
+    left off.  sizes picks which files to build. """
+    allCombinations = sum([combinatorics.CHOOSE[52][numcards] for numcards in sizes])
     
-    print """Generating all 5, 6, and 7 card hands.  It takes a while
+    print """Generating all %s card hands.  It takes a while
 (there are %d possible combinations) so find something else to do for a bit.
-If you kill the process at any time, no problem, you can resume it where it left off 
+If you kill the process at any time, no problem, you can resume it where it left off
 just by rerunning this method.
     
 Let's begin...
-    """ % allCombinations
+    """ % (", ".join([str(x) for x in sizes]), allCombinations)
     
     start_time_all = time.clock()
-    for numcards in range(5, 8):
-        i = 0
-        
+    for numcards in sizes:
+        filename = "pokervals"+str(numcards)+".rec"
+        total = combinatorics.CHOOSE[52][numcards]
+        # a .rec file only appears once it has been completely written
+        if os.path.exists(filename):
+            print "Your %d-card database %s is already complete." % (numcards, filename)
+            continue
+
         _clear_pokerval_cache()
         start_time = time.clock()
-        db = shelve.open("pokervals"+str(numcards)+".shelf",protocol=2)
-        try:
-            num_computed = db["num_computed"]
-        except KeyError:
-            num_computed = 0
-        (total, uniqueindices) = possiblehands[numcards]
-        
-        if len(db) != uniqueindices + 1: # +1 cause we store the counter in the database too, for restarting.
-            print "Generating all "+str(total)+" possible "+str(numcards)+" card hands... "
-            for cards in xuniqueCombinations(deck, numcards):
-                i=i+1
-                
-                # enable skipping ahead if we ran halfway and terminated this process.
-                if i<num_computed:  
-                    continue
-                    
-                (idx,pokerval) = calculate_pokerval(cards)
-                db[idx] = pokerval
-                if i%100000 == 0:
-                    now = time.clock()
-                    print "%d%% of %d-card hands complete.  %d processed, %d unique, %.2fm elapsed (%.2fm total)." % (i*100.0/total, numcards, i, len(db), (now - start_time)/60.0, (now - start_time_all)/60.0)
-                    
-                    s = format_cards(cards) + ' val: '
-                    print "\tLast Hand: ", s + format_pokerval(pokerval)
-                    
-                    db["num_computed"] = i
-            print len(db)
+        print "Generating all "+str(total)+" possible "+str(numcards)+" card hands... "
+        writer = pokertable.RecordWriter(filename,numcards)
+        if writer.done:
+            print "Resuming %d-card hands: %d of %d already processed." % (numcards, writer.done, total)
+        hands = _count(enumerate_hands(numcards,writer.done),writer.done)
+        next_checkpoint = writer.done + RECORD_CHECKPOINT_EVERY
+        for (idx,pokerval) in evaluated_hands(unique_hands(canonical_hands(hands))):
+            writer.add(idx,pokerval)
+            # every hand enumerated so far has been added or dropped
+            if hands.count >= next_checkpoint:
+                writer.checkpoint(hands.count)
+                next_checkpoint = hands.count + RECORD_CHECKPOINT_EVERY
+                now = time.clock()
+                print "%d%% of %d-card hands complete.  %d processed, %d unique, %.2fm elapsed (%.2fm total)." % (hands.count*100.0/total, numcards, hands.count, len(writer), (now - start_time)/60.0, (now - start_time_all)/60.0)
+        writer.close()
         
-        print "Your %d-card database is complete!  It has %d complete hands." % (numcards, len(db))
+        print "Your %d-card database is complete!  It has %d complete hands." % (numcards, len(writer))
+
+class _count:
+    """ Passes an iterator through, counting the items (from start). """
+    def __init__(self,iterable,start=0):
+        self.iterator = iter(iterable)
+        self.count = start
+    def __iter__(self):
+        return self
+    def next(self):
+        item = self.iterator.next()
+        self.count += 1
+        return item
+
+def regenerate_tables(sizes=(5,6,7),rank_classes=False):
+    """ Write the flat pokervals?.tbl tables that getpokerval memory-maps, by
+    brute force.  Every possible hand is written, in colex rank
+    order, so the file is a dense array that needs no keys.  With 
+    rank_classes, 16-bit rank classes are stored instead of 32-bit pokervals,
+    which halves the size of the tables. """
+    start_time_all = time.clock()
+    for numcards in sizes:
+        filename = pokertable.table_filename(numcards)
+        table = pokertable.open_table(numcards,filename)
+        if table is not None:
+            ok = table.verify()
+            table.close()
+            if ok:
+                print "Your %d-card table %s is already complete." % (numcards, filename)
+                continue
+            print "%s failed its checksum or is in the wrong format, regenerating it." % filename
+
+        _clear_pokerval_cache()
+        total = combinatorics.CHOOSE[52][numcards]
+        print "Writing all "+str(total)+" possible "+str(numcards)+" card hands to "+filename+"... "
+        start_time = time.clock()
+        if rank_classes:
+            writer = pokertable.TableWriter(filename,numcards,itemsize=2,flags=pokertable.TABLE_FLAG_RANK_CLASS)
+        else:
+            writer = pokertable.TableWriter(filename,numcards)
+        i = 0
+        for indices in combinatorics.combinations(52,numcards):
+            cards = [pokertable.index_card(c) for c in indices]
+            (idx,pokerval) = calculate_pokerval(cards)
+            if rank_classes:
+                writer.append(handeval.RANK_CLASS[pokerval])
+            else:
+                writer.append(pokerval)
+            i=i+1
+            if i%1000000 == 0:
+                now = time.clock()
+                print "%d%% of %d-card hands complete.  %d processed, %.2fm elapsed (%.2fm total)." % (i*100.0/total, numcards, i, (now - start_time)/60.0, (now - start_time_all)/60.0)
+        writer.close()
+
+        table = pokertable.open_table(numcards,filename)
+        if table is None or not table.verify():
+            raise pokertable.TableError("%s failed verification after writing!"%filename)
+        table.close()
+        print "Your %d-card table is complete!  It has %d hands." % (numcards, total)
         
+def derive_table(subvalues,numcards,writer,start=0,stop=None):
+    """ Write the numcards-card table given the (numcards-1)-card one, as an
+    array indexed by colex rank.  Every hand's value is the max of the values
+    of its numcards sub-hands, which are found by successor indexing rather
+    than by evaluating anything:
+
+    Take a hand c0 < c1 < ... < ck (k = numcards-1).  Its colex rank is
+    c0 + R, where R depends only on c1..ck, so for fixed c1..ck the hands with
+    c0 = 0..c1-1 are one contiguous run of the table.  Across that run, the
+    sub-hand without c0 is fixed, and the sub-hand without cj (j>0) has colex
+    rank c0 + K_j for a constant K_j.  So the whole run is the elementwise max
+    of one constant and k contiguous slices of the smaller table.
+
+    start and stop select a range of colex ranks of c1..ck, so the work can be
+    split up; writer.extend is called once per c1..ck, even when the run is
+    empty. """
+    choose = combinatorics.CHOOSE
+    k = numcards-1
+    if stop is None:
+        stop = choose[52][k]
+    repeat = itertools.repeat
+    typecode = subvalues.typecode
+    for upper in combinatorics.combinations(52,k,start,stop):
+        c1 = upper[0]
+        if c1 == 0:
+            writer.extend(())
+            continue
+        # the sub-hand without c0 is upper itself, one position lower
+        without_c0 = 0
+        for (i,c) in enumerate(upper):
+            without_c0 += choose[c][i+1]
+        # K_j: cards below cj keep their position (c0 takes position 0),
+        # cards above cj drop down one.
+        slices = [repeat(subvalues[without_c0],c1)]
+        below = 0
+        above = without_c0
+        for (j,c) in enumerate(upper):
+            above -= choose[c][j+1]
+            K = below + above
+            slices.append(subvalues[K:K+c1])
+            below += choose[c][j+2]
+        writer.extend(array.array(typecode,map(max,*slices)))
+
+def evaluate_table(rank_classes,writer,start=0,stop=None):
+    """ Write the 5-card table (or the part of it from colex rank start up to
+    stop) by evaluating every hand with handeval. """
+    if stop is None:
+        stop = combinatorics.CHOOSE[52][5]
+    for indices in combinatorics.combinations(52,5,start,stop):
+        pokerval = handeval.evaluate5([pokertable.index_card(c) for c in indices])
+        if rank_classes:
+            writer.append(handeval.RANK_CLASS[pokerval])
+        else:
+            writer.append(pokerval)
+
+def derive_tables(sizes=(5,6,7),rank_classes=False,samples=20000,processes=1):
+    """ A much faster way to build the flat tables than regenerate_tables: only
+    the 5-card table is evaluated (with handeval), and each larger table is
+    derived from the one below it by derive_table.  Every table is then
+    checked against calculate_pokerval on a random sample of hands.
+
+    With processes > 1 each table is built in shards by a process pool (see
+    generate_shards), which also makes an interrupted run resumable. """
+    if processes > 1:
+        return _derive_tables_parallel(sizes,rank_classes,samples,processes)
+    start_time_all = time.clock()
+    if rank_classes:
+        (itemsize,flags,typecode) = (2,pokertable.TABLE_FLAG_RANK_CLASS,'H')
+    else:
+        (itemsize,flags,typecode) = (4,0,'I')
+
+    values = None
+    for numcards in range(5,max(sizes)+1):
+        filename = pokertable.table_filename(numcards)
+        start_time = time.clock()
+        # the values are kept in memory only as the source of the next table
+        keep_values = numcards < max(sizes)
+        table = pokertable.open_table(numcards,filename)
+        if table is not None and table.flags == flags and table.verify():
+            print "Your %d-card table %s is already complete." % (numcards, filename)
+            if keep_values:
+                values = table.values()
+            table.close()
+            continue
+        if table is not None:
+            table.close()
+
+        if numcards in sizes:
+            writer = pokertable.TableWriter(filename,numcards,itemsize=itemsize,flags=flags)
+        else:
+            # only needed as a stepping stone to a bigger table
+            writer = _ArrayWriter(typecode)
+        if numcards == 5:
+            evaluate_table(rank_classes,writer)
+        else:
+            derive_table(values,numcards,writer)
+
+        if numcards in sizes:
+            writer.close()
+            table = pokertable.open_table(numcards,filename)
+            if table is None or not table.verify():
+                raise pokertable.TableError("%s failed verification after writing!"%filename)
+            if keep_values:
+                values = table.values()
+            table.close()
+        else:
+            values = writer.values
+        now = time.clock()
+        print "Your %d-card table is complete!  %.2fm elapsed (%.2fm total)." % (numcards, (now - start_time)/60.0, (now - start_time_all)/60.0)
+
+        if numcards in sizes and samples:
+            check_table(numcards,samples)
+
+def check_table(numcards,samples):
+    """ Compare samples random hands from the numcards-card table against
+    calculate_pokerval.  Raises ValueError on the first mismatch. """
+    table = pokertable.open_table(numcards)
+    deck = [pokertable.index_card(c) for c in range(52)]
+    _clear_pokerval_cache()
+    try:
+        for i in xrange(samples):
+            cards = random.sample(deck,numcards)
+            (idx,pokerval) = calculate_pokerval(cards)
+            if table.lookup(cards) != pokerval:
+                raise ValueError("%d-card table disagrees with calculate_pokerval on %s: %s vs %s"
+                    %(numcards,format_cards(cards),format_pokerval(table.lookup(cards)),format_pokerval(pokerval)))
+    finally:
+        table.close()
+    print "Checked %d random %d-card hands against calculate_pokerval." % (samples, numcards)
+
+SHARDS = 128
+CHECKPOINT_EVERY = 20000
+
+def _shard_filename(filename,shard):
+    return "%s.shard%03d"%(filename,shard)
+
+def _read_checkpoint(shardname,start,stop):
+    """ How many units of the shard are done, and how many bytes of output
+    they wrote, according to the shard's checkpoint file. """
+    try:
+        f = open(shardname+".ckpt")
+        try:
+            (ckpt_start,ckpt_stop,done,nbytes) = [int(x) for x in f.read().split()]
+        finally:
+            f.close()
+    except (IOError,ValueError):
+        return (0,0)
+    if (ckpt_start,ckpt_stop) != (start,stop):
+        # left over from a run that split the work differently
+        return (0,0)
+    return (done,nbytes)
+
+class _ShardWriter:
+    """ Appends one shard's output to its file, and every CHECKPOINT_EVERY
+    units (hands for the 5-card table, c1..ck runs for derived tables)
+    flushes it and records the position in the shard's checkpoint file. """
+
+    def __init__(self,shardname,start,stop,done,nbytes,typecode,progress):
+        self.shardname = shardname
+        self.start = start
+        self.stop = stop
+        self.done = done
+        self.typecode = typecode
+        self.progress = progress
+        if os.path.exists(shardname):
+            self.f = open(shardname,'r+b')
+        else:
+            self.f = open(shardname,'wb')
+        # anything after the last checkpoint is redone, so throw it away
+        self.f.truncate(nbytes)
+        self.f.seek(nbytes)
+        self.nbytes = nbytes
+        self.buffer = array.array(typecode)
+        self.units = 0
+
+    def append(self,value):
+        self.buffer.append(value)
+        self.units += 1
+        if self.units >= CHECKPOINT_EVERY:
+            self.checkpoint()
+
+    def extend(self,values):
+        self.buffer.extend(values)
+        self.units += 1
+        if self.units >= CHECKPOINT_EVERY:
+            self.checkpoint()
+
+    def checkpoint(self):
+        if pokertable._byteswap_needed:
+            self.buffer.byteswap()
+        data = self.buffer.tostring()
+        self.f.write(data)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.nbytes += len(data)
+        self.done += self.units
+        f = open(self.shardname+".ckpt.tmp",'w')
+        f.write("%d %d %d %d"%(self.start,self.stop,self.done,self.nbytes))
+        f.close()
+        if os.path.exists(self.shardname+".ckpt"):
+            os.remove(self.shardname+".ckpt")
+        os.rename(self.shardname+".ckpt.tmp",self.shardname+".ckpt")
+        if self.progress is not None:
+            self.progress.put(len(self.buffer))
+        self.buffer = array.array(self.typecode)
+        self.units = 0
+
+    def close(self):
+        self.checkpoint()
+        self.f.close()
+
+_subvalues = None
+_progress = None
+
+def _shard_worker_init(progress,subnumcards,subfilename):
+    """ Pool initializer.  On platforms that fork, the smaller table was
+    loaded by the parent before the pool started and is shared; otherwise each
+    worker loads its own copy. """
+    global _subvalues,_progress
+    _progress = progress
+    if subfilename is not None and _subvalues is None:
+        table = pokertable.open_table(subnumcards,subfilename)
+        _subvalues = table.values()
+        table.close()
+
+def _generate_shard(job):
+    """ Build (or finish building) one shard of a table. """
+    (numcards,filename,shard,start,stop,rank_classes,typecode) = job
+    shardname = _shard_filename(filename,shard)
+    (done,nbytes) = _read_checkpoint(shardname,start,stop)
+    if done == stop-start:
+        return shard
+    writer = _ShardWriter(shardname,start,stop,done,nbytes,typecode,_progress)
+    if numcards == 5:
+        evaluate_table(rank_classes,writer,start+done,stop)
+    else:
+        derive_table(_subvalues,numcards,writer,start+done,stop)
+    writer.close()
+    return shard
+
+def generate_shards(numcards,rank_classes,processes,subvalues=None,shards=SHARDS):
+    """ Build the numcards-card table with a pool of processes, and merge the
+    result into its .tbl file.
+
+    The work (5-card hands, or the c1..ck runs of derive_table) is split into
+    shards of consecutive colex ranks.  Each shard is written to its own file
+    and checkpointed as it goes, so a killed run picks up each shard exactly
+    where its last checkpoint left it, without re-iterating finished work.
+    Progress is reported for all the workers together. """
+    global _subvalues
+    import multiprocessing
+    filename = pokertable.table_filename(numcards)
+    if rank_classes:
+        (itemsize,flags,typecode) = (2,pokertable.TABLE_FLAG_RANK_CLASS,'H')
+    else:
+        (itemsize,flags,typecode) = (4,0,'I')
+    if numcards == 5:
+        unitsize = 5
+        subfilename = None
+    else:
+        unitsize = numcards-1
+        subfilename = pokertable.table_filename(numcards-1)
+    jobs = [(numcards,filename,shard,start,stop,rank_classes,typecode)
+            for (shard,(start,stop)) in enumerate(combinatorics.chunks(52,unitsize,shards))]
+
+    total = combinatorics.CHOOSE[52][numcards]
+    written = 0
+    for (numcards,filename,shard,start,stop,rank_classes,typecode) in jobs:
+        written += _read_checkpoint(_shard_filename(filename,shard),start,stop)[1]//itemsize
+    if written:
+        print "Resuming %d-card hands: %d of %d already written." % (numcards, written, total)
+
+    _subvalues = subvalues
+    progress = multiprocessing.Queue()
+    pool = multiprocessing.Pool(processes,_shard_worker_init,(progress,numcards-1,subfilename))
+    try:
+        results = pool.map_async(_generate_shard,jobs)
+        start_time = time.time()
+        resumed = written
+        last_report = start_time
+        while not results.ready() or not progress.empty():
+            try:
+                written += progress.get(timeout=1)
+            except Queue.Empty:
+                pass
+            now = time.time()
+            if now-last_report >= 10 and written > resumed:
+                rate = (written-resumed)/(now-start_time)
+                print "%d%% of %d-card hands complete.  %d written, %d hands/s, ETA %.2fm." % (written*100.0/total, numcards, written, rate, (total-written)/rate/60.0)
+                last_report = now
+        results.get()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _subvalues = None
+
+    # merge the shards, in order, into the final table
+    writer = pokertable.TableWriter(filename,numcards,itemsize=itemsize,flags=flags)
+    for shard in range(shards):
+        f = open(_shard_filename(filename,shard),'rb')
+        while True:
+            data = f.read(1<<22)
+            if not data:
+                break
+            values = array.array(typecode,data)
+            if pokertable._byteswap_needed:
+                values.byteswap()
+            writer.extend(values)
+        f.close()
+    writer.close()
+    for shard in range(shards):
+        os.remove(_shard_filename(filename,shard))
+        os.remove(_shard_filename(filename,shard)+".ckpt")
+
+def _derive_tables_parallel(sizes,rank_classes,samples,processes):
+    """ derive_tables, with every table built by generate_shards.  Each table
+    up to the largest size is written to disk, since the next one is built
+    from the file. """
+    start_time_all = time.clock()
+    flags = rank_classes and pokertable.TABLE_FLAG_RANK_CLASS or 0
+    values = None
+    for numcards in range(5,max(sizes)+1):
+        filename = pokertable.table_filename(numcards)
+        start_time = time.time()
+        table = pokertable.open_table(numcards,filename)
+        if table is None or table.flags != flags or not table.verify():
+            if table is not None:
+                table.close()
+            generate_shards(numcards,rank_classes,processes,values)
+            table = pokertable.open_table(numcards,filename)
+            if table is None or not table.verify():
+                raise pokertable.TableError("%s failed verification after writing!"%filename)
+            print "Your %d-card table is complete!  %.2fm elapsed." % (numcards, (time.time() - start_time)/60.0)
+            if numcards in sizes and samples:
+                check_table(numcards,samples)
+        else:
+            print "Your %d-card table %s is already complete." % (numcards, filename)
+        if numcards < max(sizes):
+            values = table.values()
+        table.close()
+
+class _ArrayWriter:
+    """ Stands in for a TableWriter when a table is only kept in memory. """
+    def __init__(self,typecode):
+        self.values = array.array(typecode)
+    def append(self,value):
+        self.values.append(value)
+    def extend(self,values):
+        self.values.extend(values)
+
 if __name__ == '__main__':
-    regenerate_database()
\ No newline at end of file
+    import optparse,multiprocessing
+    parser = optparse.OptionParser()
+    parser.add_option("--rank-classes",action="store_true",default=False,
+        help="store 16-bit rank classes instead of 32-bit pokervals")
+    parser.add_option("--brute-force",action="store_true",default=False,
+        help="evaluate every hand instead of deriving the 6 and 7 card tables")
+    parser.add_option("--processes",type="int",default=multiprocessing.cpu_count(),
+        help="worker processes to build the tables with (default: one per cpu)")
+    parser.add_option("--preflop",action="store_true",default=False,
+        help="build the preflop equity table (preflop.tbl) instead")
+    parser.add_option("--preflop-samples",type="int",default=None,
+        help="estimate each preflop matchup from this many random boards instead of all of them")
+    (options,args) = parser.parse_args()
+    if options.preflop:
+        import preflop
+        preflop.generate_preflop_table(processes=options.processes,samples=options.preflop_samples)
+    elif options.brute_force:
+        regenerate_tables(rank_classes=options.rank_classes)
+    else:
+        derive_tables(rank_classes=options.rank_classes,processes=options.processes)
\ No newline at end of file
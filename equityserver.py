@@ -0,0 +1,414 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+equityserver.py
+    A long-lived equity server, so short-lived bot processes don't each pay
+    for opening the tables and warming the caches.  One server process
+    keeps them loaded and answers getpokerval, nhands, comparehands,
+    weightedcomparehands and range_equity queries over a Unix-domain socket
+    (or localhost TCP), through an asyncequity.EquityService worker pool:
+
+        python equityserver.py --socket=equityserver.sock
+        (or poker.serve(...) from a program)
+
+        client = EquityClient("equityserver.sock")
+        client.weightedcomparehands(mycards,enemiescards,flop)
+
+    EquityClient's methods have the same signatures as poker's.  It's
+    thread-safe, and requests from several threads are pipelined on the one
+    connection: each carries an id, the server works on them concurrently
+    and answers in whatever order they finish.
+
+    Protocol (little-endian).  Every message is a header, then its body:
+
+        header      body length (uint32), request id (uint32), code (uint8)
+                    (the code is the operation in a request, and OK or
+                    ERROR in a response)
+        cards       count (uint8), then a card index (uint8) per card
+        hands       count (uint8), then cards per hand
+        range       count (uint16), then (combo id uint16, weight float32)
+
+        GETPOKERVAL     cards                           -> pokerval (uint32)
+        NHANDS          cards, cards                    -> 3 x uint32
+        COMPAREHANDS    cards, hands, cards, uint8 flag -> equity (double)
+        WEIGHTED...     cards, hands, cards, double     -> equity (double)
+        RANGE_EQUITY    range, range, cards             -> equity (double),
+                                                           count (uint16),
+                                                           (combo id uint16,
+                                                            equity double)...
+
+    An ERROR response's body is the error message.  A None result (no
+    enemies, say) is an OK response with an empty body.
+"""
+
+import os,socket,struct,threading,SocketServer,logging
+import poker,handstate,pokertable,rangeequity,asyncequity
+from cardset import INDEX_CARD,as_cards
+from poker_globals import *
+
+log = logging.getLogger("poker.equityserver")
+
+DEFAULT_ADDRESS = "equityserver.sock"
+
+HEADER = struct.Struct('<IIB')
+(GETPOKERVAL,NHANDS,COMPAREHANDS,WEIGHTEDCOMPAREHANDS,RANGE_EQUITY) = range(1,6)
+(OK,ERROR) = (0,1)
+
+class ServerError(Exception):
+    """ The server couldn't answer a request. """
+    pass
+
+# encoding
+
+def _pack_cards(cards):
+    indices = [pokertable.card_index(card) for card in as_cards(cards)]
+    return struct.pack('<B%dB'%len(indices),len(indices),*indices)
+
+def _pack_hands(hands):
+    return struct.pack('<B',len(hands)) + ''.join([_pack_cards(hand) for hand in hands])
+
+def _pack_range(hands):
+    hands = rangeequity.as_range(hands)
+    return struct.pack('<H',len(hands)) + ''.join([struct.pack('<Hf',id,weight) for (id,weight) in sorted(hands.items())])
+
+class _Reader:
+    """ Unpacks a message body. """
+    def __init__(self,data):
+        self.data = data
+        self.pos = 0
+    def unpack(self,format):
+        values = struct.unpack_from('<'+format,self.data,self.pos)
+        self.pos += struct.calcsize('<'+format)
+        return values
+    def cards(self):
+        (count,) = self.unpack('B')
+        return [INDEX_CARD[index] for index in self.unpack('%dB'%count)]
+    def hands(self):
+        (count,) = self.unpack('B')
+        return [self.cards() for i in range(count)]
+    def range(self):
+        (count,) = self.unpack('H')
+        return dict([self.unpack('Hf') for i in range(count)])
+
+# the server
+
+def _decode_request(service,code,body):
+    """ Start the work a request asks for: an EquityFuture, and how to pack
+    its result. """
+    reader = _Reader(body)
+    if code == GETPOKERVAL:
+        return service.call(poker.getpokerval,reader.cards()),lambda value: struct.pack('<I',value)
+    elif code == NHANDS:
+        (mycards,commoncards) = (reader.cards(),reader.cards())
+        return service.nhands(mycards,commoncards),lambda counts: struct.pack('<3I',*counts)
+    elif code == COMPAREHANDS:
+        (mycards,enemiescards,commoncards) = (reader.cards(),reader.hands(),reader.cards())
+        (force_unweighted,) = reader.unpack('B')
+        return (service.comparehands(mycards,enemiescards,commoncards,bool(force_unweighted)),
+                lambda equity: struct.pack('<d',equity))
+    elif code == WEIGHTEDCOMPAREHANDS:
+        (mycards,enemiescards,commoncards) = (reader.cards(),reader.hands(),reader.cards())
+        (turn_weight,) = reader.unpack('d')
+        return (service.weightedcomparehands(mycards,enemiescards,commoncards,turn_weight=turn_weight),
+                lambda equity: struct.pack('<d',equity))
+    elif code == RANGE_EQUITY:
+        (heroes,villains,commoncards) = (reader.range(),reader.range(),reader.cards())
+        def pack((equity,combos)):
+            return (struct.pack('<dH',equity,len(combos)) +
+                    ''.join([struct.pack('<Hd',id,value) for (id,value) in sorted(combos.items())]))
+        return service.call(rangeequity.range_equity,heroes,villains,commoncards),pack
+    raise ValueError("unknown request code %d"%code)
+
+def _recv_exactly(sock,size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+class _Handler(SocketServer.BaseRequestHandler):
+    """ One client connection: read requests and start each as soon as it
+    arrives; the answers go back as they finish. """
+
+    def handle(self):
+        sendlock = threading.Lock()
+        def send(requestid,code,body):
+            sendlock.acquire()
+            try:
+                self.request.sendall(HEADER.pack(len(body),requestid,code)+body)
+            except socket.error:
+                pass        # the client went away
+            finally:
+                sendlock.release()
+        # the requests still being worked on
+        futures = set()
+        while True:
+            header = _recv_exactly(self.request,HEADER.size)
+            if header is None:
+                break
+            (length,requestid,code) = HEADER.unpack(header)
+            body = _recv_exactly(self.request,length)
+            if body is None:
+                break
+            try:
+                (future,pack) = _decode_request(self.server.service,code,body)
+            except Exception,e:
+                send(requestid,ERROR,str(e))
+                continue
+            def answer(future,requestid=requestid,pack=pack):
+                futures.discard(future)
+                if future.cancelled():
+                    return
+                try:
+                    result = future.result()
+                    send(requestid,OK,result is not None and pack(result) or '')
+                except Exception,e:
+                    send(requestid,ERROR,"%s: %s"%(e.__class__.__name__,e))
+            futures.add(future)
+            future.add_done_callback(answer)
+        # nobody's left to answer
+        for future in list(futures):
+            future.cancel()
+
+class _UnixServer(SocketServer.ThreadingMixIn,SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+class _TCPServer(SocketServer.ThreadingMixIn,SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def make_server(address=DEFAULT_ADDRESS,workers=2,equity_store=None):
+    """ A server on address (a Unix socket path, or a (host,port) pair),
+    with the tables opened and the evaluator tables built.  Call its
+    serve_forever(), and shutdown() from another thread to stop it. """
+    handstate.build_tables()
+    poker._open_tables()
+    if equity_store:
+        poker.use_equity_store(equity_store)
+    if type(address) is str:
+        if os.path.exists(address):
+            os.remove(address)
+        server = _UnixServer(address,_Handler)
+    else:
+        server = _TCPServer(address,_Handler)
+    server.service = asyncequity.EquityService(workers)
+    log.info("equity server listening on %s"%(address,))
+    return server
+
+# the client
+
+class _Pending:
+    def __init__(self):
+        self.event = threading.Event()
+        self.code = self.body = None
+
+class EquityClient:
+    """ A connection to an equity server, with poker's signatures. """
+
+    def __init__(self,address=DEFAULT_ADDRESS,timeout=None):
+        if type(address) is str:
+            self.sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.nextid = 0
+        self.reader = threading.Thread(target=self._read,name="equity client reader")
+        self.reader.setDaemon(True)
+        self.reader.start()
+
+    def close(self):
+        self.sock.shutdown(socket.SHUT_RDWR)
+        self.sock.close()
+
+    def _read(self):
+        while True:
+            header = _recv_exactly(self.sock,HEADER.size)
+            body = header is not None and _recv_exactly(self.sock,HEADER.unpack(header)[0])
+            self.lock.acquire()
+            try:
+                if header is None or body is None:
+                    # connection closed: fail everything still waiting
+                    for pending in self.pending.values():
+                        (pending.code,pending.body) = (ERROR,"connection to the equity server closed")
+                        pending.event.set()
+                    self.pending = {}
+                    return
+                (length,requestid,code) = HEADER.unpack(header)
+                pending = self.pending.pop(requestid,None)
+            finally:
+                self.lock.release()
+            if pending is not None:
+                (pending.code,pending.body) = (code,body)
+                pending.event.set()
+
+    def _request(self,code,body):
+        pending = _Pending()
+        self.lock.acquire()
+        try:
+            requestid = self.nextid
+            self.nextid = (self.nextid+1) & 0xffffffff
+            self.pending[requestid] = pending
+            self.sock.sendall(HEADER.pack(len(body),requestid,code)+body)
+        finally:
+            self.lock.release()
+        pending.event.wait(self.timeout)
+        if not pending.event.isSet():
+            # forget it, so a late answer isn't matched to it
+            self.lock.acquire()
+            try:
+                self.pending.pop(requestid,None)
+            finally:
+                self.lock.release()
+            if not pending.event.isSet():
+                raise ServerError("no answer from the equity server")
+        if pending.code == ERROR:
+            raise ServerError(pending.body)
+        if not pending.body:
+            return None
+        return _Reader(pending.body)
+
+    def _value(self,code,body,format):
+        """ The request's result unpacked by format (a single value if
+        that's all there is), or None if the server's answer was None. """
+        reader = self._request(code,body)
+        if reader is None:
+            return None
+        values = reader.unpack(format)
+        if len(values) == 1:
+            return values[0]
+        return values
+
+    def getpokerval(self,_cards,pokerval_db=None):
+        return self._value(GETPOKERVAL,_pack_cards(_cards),'I')
+
+    def nhands(self,mycards,commoncards):
+        return self._value(NHANDS,_pack_cards(mycards)+_pack_cards(commoncards),'3I')
+
+    def comparehands(self,mycards,enemiescards,commoncards,force_unweighted=False):
+        if enemiescards is None or len(enemiescards) == 0:
+            return None
+        body = (_pack_cards(mycards)+_pack_hands(poker._enemy_hands(enemiescards))+
+                _pack_cards(commoncards)+struct.pack('<B',force_unweighted))
+        return self._value(COMPAREHANDS,body,'d')
+
+    def weightedcomparehands(self,mycards,enemiescards,commoncards,pokerval_db=None,turn_weight=0.75):
+        if enemiescards is None or len(enemiescards) == 0:
+            return None
+        body = (_pack_cards(mycards)+_pack_hands(poker._enemy_hands(enemiescards))+
+                _pack_cards(commoncards)+struct.pack('<d',turn_weight))
+        return self._value(WEIGHTEDCOMPAREHANDS,body,'d')
+
+    def range_equity(self,herorange,villainrange,commoncards=None):
+        reader = self._request(RANGE_EQUITY,_pack_range(herorange)+_pack_range(villainrange)+_pack_cards(commoncards or []))
+        if reader is None:
+            return None
+        (equity,count) = reader.unpack('dH')
+        return (equity,dict([reader.unpack('Hd') for i in range(count)]))
+
+import unittest
+
+class Test_equityserver(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.address = os.path.join(tempfile.mkdtemp(),DEFAULT_ADDRESS)
+        self.server = make_server(self.address,workers=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.client = EquityClient(self.address,timeout=60)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.service.shutdown()
+
+    def test_queries(self):
+        client = self.client
+        mine = cvt_to_cards(["As","Ah"])
+        his = cvt_to_cards(["Qh","Jh"])
+        flop = cvt_to_cards(["Kd","7s","2s"])
+        self.assertEqual(client.getpokerval(mine+flop),poker.getpokerval(mine+flop))
+        self.assertEqual(client.nhands(mine,flop),poker.nhands(mine,flop))
+        self.assertEqual(client.comparehands(mine,his,flop+cvt_to_cards(["9d"])),poker.comparehands(mine,his,flop+cvt_to_cards(["9d"])))
+        self.assertEqual(client.weightedcomparehands(mine,[his],flop,turn_weight=0.5),poker.weightedcomparehands(mine,[his],flop,turn_weight=0.5))
+        self.assertEqual(client.comparehands(mine,[],flop),None)
+        (equity,combos) = client.range_equity("AA",{"QhJh":1.0,"KsKc":0.5},flop)
+        self.assertEqual((equity,combos),rangeequity.range_equity("AA",{"QhJh":1.0,"KsKc":0.5},flop))
+        self.assertRaises(ServerError,client._request,99,'')
+        # None results come back as None, as they do from poker
+        self.assertEqual(poker.getpokerval(mine+flop[:2]),None)
+        self.assertEqual(client.getpokerval(mine+flop[:2]),None)
+        self.assertRaises(ServerError,client.nhands,mine,flop[:1])
+
+    def test_timeout(self):
+        client = EquityClient(self.address,timeout=0.001)
+        # preflop comparehands takes far longer than a millisecond
+        self.assertRaises(ServerError,client.comparehands,cvt_to_cards(["As","Ah"]),cvt_to_cards(["Kd","Kc"]),[])
+        self.assertEqual(client.pending,{})
+        client.close()
+
+    def test_pipelined(self):
+        # several threads share the connection
+        flop = cvt_to_cards(["Kd","7s","2s"])
+        heroes = [cvt_to_cards(hand) for hand in (["As","Ah"],["7h","7c"],["3s","4s"],["Ac","Qc"])]
+        his = cvt_to_cards(["Qh","Jh"])
+        results = {}
+        def ask(n):
+            results[n] = self.client.weightedcomparehands(heroes[n],[his],flop)
+        threads = [threading.Thread(target=ask,args=(n,)) for n in range(len(heroes))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for (n,hero) in enumerate(heroes):
+            self.assertAlmostEqual(results[n],poker.weightedcomparehands(hero,[his],flop))
+
+if __name__ == '__main__':
+    import optparse
+    parser = optparse.OptionParser(usage="%prog [options]: serve equity queries until interrupted")
+    parser.add_option("--socket",default=None,
+        help="Unix socket path to listen on (default: %s)"%DEFAULT_ADDRESS)
+    parser.add_option("--port",type="int",default=None,
+        help="listen on this localhost TCP port instead")
+    parser.add_option("--workers",type="int",default=2,
+        help="worker threads (default: 2)")
+    parser.add_option("--equity-store",default=None,
+        help="share weightedcomparehands results through this equity store file")
+    parser.add_option("--test",action="store_true",default=False,
+        help="run the unit tests")
+    (options,args) = parser.parse_args()
+    if options.test:
+        import sys
+        unittest.main(argv=sys.argv[:1])
+    else:
+        logging.basicConfig(level=logging.INFO)
+        if options.port is not None:
+            address = ("127.0.0.1",options.port)
+        else:
+            address = options.socket or DEFAULT_ADDRESS
+        server = make_server(address,options.workers,options.equity_store)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,317 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+equitystore.py
+    A persistent equity cache that any number of processes can share.  It's
+    an append-only file of (situation key, turn_weight, equity) records; each
+    process keeps an in-memory index of the records and catches up on the
+    ones other processes have appended by reading from where it left off.
+
+    File layout (all little-endian):
+
+        32 byte header: magic, version, fingerprint
+        records: keylen (uint16), key, turn_weight (double), equity (double),
+                 crc32 of the key and the two doubles
+
+    The key is cardset.situation_key, as bytes.  Appends are made under an
+    exclusive fcntl lock, in a single write; readers take no lock and stop at
+    the first record that isn't all there yet.  A writer holding the lock
+    knows nobody else is mid-append, so it cuts off any partial record a
+    crashed process left behind before adding its own.
+
+    The fingerprint identifies the evaluator the equities were computed
+    with (weightedcomparehands uses handstate, not the pokerval tables, so
+    regenerating or converting those doesn't change it).  A file is never
+    started over once it has a header, since other processes may still be
+    filling it: a store whose fingerprint doesn't match the file's is
+    stale, and only misses (get() finds nothing and put() writes nothing).
+    Delete the file, or use another, to start afresh.
+"""
+
+import os,struct,zlib,binascii,threading,logging
+
+log = logging.getLogger("poker.equitystore")
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    log.info("No fcntl: the equity store won't lock, so only share it between readers.")
+
+STORE_MAGIC = 'THEBOTEQ'
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct('<8sHxxI20x')
+KEYLEN = struct.Struct('<H')
+VALUES = struct.Struct('<ddI')
+DEFAULT_FILENAME = "equities.eqs"
+
+# bump when a change to handstate, the evaluator or weightedcomparehands
+# changes the equities it computes
+EVALUATOR_VERSION = 1
+
+def evaluator_fingerprint():
+    """ The 32-bit fingerprint of EVALUATOR_VERSION that stores are stamped
+    with by default. """
+    return zlib.crc32("evaluator %d"%EVALUATOR_VERSION) & 0xffffffff
+
+def _key_bytes(key):
+    hexkey = '%x'%key
+    if len(hexkey)%2:
+        hexkey = '0'+hexkey
+    return binascii.unhexlify(hexkey)
+
+def _bytes_key(data):
+    return long(binascii.hexlify(data),16)
+
+class EquityStore:
+    """ An equity cache file shared between processes.  get() and put() take
+    a situation key (cardset.situation_key) and a turn_weight. """
+
+    def __init__(self,filename=DEFAULT_FILENAME,fingerprint=None):
+        self.filename = filename
+        if fingerprint is None:
+            fingerprint = evaluator_fingerprint()
+        self.fingerprint = fingerprint
+        self.index = {}
+        self.offset = STORE_HEADER.size
+        self.hits = self.misses = 0
+        self.stale = False
+        # fcntl locks belong to the open file, so they don't keep this
+        # process's own threads apart: mutex does, around every use of the
+        # shared file position, index and offset
+        self.mutex = threading.RLock()
+        # 'a+' creates the file if it's missing without truncating it, and
+        # every write appends
+        self.f = open(filename,'a+b')
+        self._lock()
+        try:
+            if self._header_missing():
+                self._reset()
+            elif not self._header_ok():
+                log.warning("%s was written by another evaluator; not using it"%filename)
+                self.stale = True
+            self.refresh()
+        finally:
+            self._unlock()
+
+    def _lock(self):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(),fcntl.LOCK_EX)
+
+    def _unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(),fcntl.LOCK_UN)
+
+    def _header_ok(self):
+        self.f.seek(0)
+        header = self.f.read(STORE_HEADER.size)
+        if len(header) != STORE_HEADER.size:
+            return False
+        return STORE_HEADER.unpack(header) == (STORE_MAGIC,STORE_VERSION,self.fingerprint)
+
+    def _header_missing(self):
+        """ True if the file is too short to have a header: it's new, or its
+        creator died before writing one. """
+        self.f.seek(0,2)
+        return self.f.tell() < STORE_HEADER.size
+
+    def _reset(self):
+        """ Start the file over with our header; call with the lock held,
+        and only when _header_missing. """
+        self.f.truncate(0)
+        self.f.write(STORE_HEADER.pack(STORE_MAGIC,STORE_VERSION,self.fingerprint))
+        self.f.flush()
+        self.index = {}
+        self.offset = STORE_HEADER.size
+
+    def refresh(self):
+        """ Read the records appended since the last refresh.  Returns True
+        if the file ends in a partial or corrupt record (which only a
+        crashed writer leaves behind once the lock is free). """
+        self.mutex.acquire()
+        try:
+            return self._refresh()
+        finally:
+            self.mutex.release()
+
+    def _refresh(self):
+        if self.stale or not self._header_ok():
+            # nothing in it is ours
+            self.index = {}
+            self.offset = STORE_HEADER.size
+            return False
+        self.f.seek(0,2)
+        size = self.f.tell()
+        if size < self.offset:
+            # truncated and started over by another process
+            self.index = {}
+            self.offset = STORE_HEADER.size
+        self.f.seek(self.offset)
+        data = self.f.read(size-self.offset)
+        pos = 0
+        while pos+KEYLEN.size <= len(data):
+            (keylen,) = KEYLEN.unpack_from(data,pos)
+            end = pos+KEYLEN.size+keylen+VALUES.size
+            if end > len(data):
+                break
+            keydata = data[pos+KEYLEN.size:pos+KEYLEN.size+keylen]
+            (turn_weight,equity,crc) = VALUES.unpack_from(data,end-VALUES.size)
+            if zlib.crc32(data[pos+KEYLEN.size:end-4]) & 0xffffffff != crc:
+                break
+            self.index[(_bytes_key(keydata),turn_weight)] = equity
+            pos = end
+        self.offset += pos
+        return pos != len(data)
+
+    def get(self,key,turn_weight,default=None):
+        """ The stored equity, or default.  On a miss, first catch up on
+        records other processes have added.  A stale store always misses. """
+        self.mutex.acquire()
+        try:
+            equity = self.index.get((key,turn_weight))
+            if equity is None:
+                self._refresh()
+                equity = self.index.get((key,turn_weight))
+                if equity is None:
+                    self.misses += 1
+                    return default
+            self.hits += 1
+            return equity
+        finally:
+            self.mutex.release()
+
+    def put(self,key,turn_weight,equity):
+        """ Append a record (unless some process already has, or the store
+        is stale). """
+        if self.stale:
+            return
+        keydata = _key_bytes(key)
+        body = keydata + VALUES.pack(turn_weight,equity,0)[:-4]
+        record = KEYLEN.pack(len(keydata)) + body + struct.pack('<I',zlib.crc32(body) & 0xffffffff)
+        self.mutex.acquire()
+        self._lock()
+        try:
+            if self._header_missing():
+                self._reset()
+            if self._refresh():
+                log.warning("%s: dropping a partial record at offset %d"%(self.filename,self.offset))
+                self.f.truncate(self.offset)
+            if (key,turn_weight) in self.index:
+                return
+            self.f.seek(0,2)
+            self.f.write(record)
+            self.f.flush()
+            self.index[(key,turn_weight)] = equity
+            self.offset += len(record)
+        finally:
+            self._unlock()
+            self.mutex.release()
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        self.mutex.acquire()
+        try:
+            self.f.close()
+        finally:
+            self.mutex.release()
+
+import unittest
+
+def _append_many(filename,start):
+    store = EquityStore(filename,fingerprint=1)
+    for i in range(start,start+200):
+        store.put(i<<60,0.75,i/1000.)
+    store.close()
+
+class Test_equitystore(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.filename = os.path.join(tempfile.mkdtemp(),DEFAULT_FILENAME)
+
+    def test_shared(self):
+        writer = EquityStore(self.filename,fingerprint=1)
+        reader = EquityStore(self.filename,fingerprint=1)
+        writer.put(12345,0.75,0.5)
+        writer.put(1<<200,0.75,0.25)
+        self.assertEqual(reader.get(12345,0.75),0.5)
+        self.assertEqual(reader.get(1<<200,0.75),0.25)
+        self.assertEqual(reader.get(12345,0.5),None)
+        writer.close()
+        reader.close()
+        # a new process starts warm
+        store = EquityStore(self.filename,fingerprint=1)
+        self.assertEqual(len(store),2)
+        store.close()
+
+    def test_fingerprint(self):
+        store = EquityStore(self.filename,fingerprint=1)
+        store.put(7,0.75,0.5)
+        other = EquityStore(self.filename,fingerprint=2)
+        self.assertTrue(other.stale)
+        self.assertEqual(other.get(7,0.75),None)
+        other.put(8,0.75,0.125)
+        self.assertEqual(other.get(8,0.75),None)
+        # the stale process doesn't wipe out the records of the other one
+        store.put(9,0.75,0.25)
+        self.assertEqual(len(EquityStore(self.filename,fingerprint=1)),2)
+        self.assertEqual(store.get(8,0.75),None)
+
+    def test_partial_record(self):
+        store = EquityStore(self.filename,fingerprint=1)
+        store.put(7,0.75,0.5)
+        f = open(self.filename,'ab')
+        f.write('\x05\x00abc')      # a writer died part way through
+        f.close()
+        store.put(8,0.75,0.125)
+        store.close()
+        store = EquityStore(self.filename,fingerprint=1)
+        self.assertEqual((store.get(7,0.75),store.get(8,0.75)),(0.5,0.125))
+
+    def test_threads(self):
+        store = EquityStore(self.filename,fingerprint=1)
+        other = EquityStore(self.filename,fingerprint=1)
+        def work(start):
+            for i in range(start,start+300):
+                store.put(i,0.75,i/1000.)
+                store.get(i+1,0.75)
+                other.get(i-1,0.75)
+        threads = [threading.Thread(target=work,args=(n*300,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        store.close()
+        store = EquityStore(self.filename,fingerprint=1)
+        self.assertEqual(len(store),1200)
+        self.assertEqual([store.get(i,0.75) for i in (0,599,1199)],[0.0,0.599,1.199])
+
+    def test_processes(self):
+        import multiprocessing
+        processes = [multiprocessing.Process(target=_append_many,args=(self.filename,n*200)) for n in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        store = EquityStore(self.filename,fingerprint=1)
+        self.assertEqual(len(store),600)
+        self.assertEqual(store.get(599<<60,0.75),0.599)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+handeval.py
+    A database-free 5-card evaluator.  It returns the same pokervals as
+    CalculatingHand, but with three small tables computed at import time:
+
+        FLUSH5[rankmask]    value of 5 suited cards with those ranks
+        UNIQUE5[rankmask]   value of 5 unsuited, distinct ranks (straight or
+                            high card)
+        PAIRED[product]     value of a hand with a repeated rank, keyed by the
+                            product of the ranks' primes, which is unique for
+                            every multiset of ranks
+
+    rankmask has bit rank-2 set for each rank in the hand.
+
+    It also defines the rank class encoding of pokervals (see POKERVALS).
+"""
+
+from poker_globals import *
+
+PRIME = [0,0,2,3,5,7,11,13,17,19,23,29,31,37,41]
+RANKBIT = [0,0] + [1<<(rank-2) for rank in range(2,15)]
+
+def _kicker_value(ranks):
+    """ Pack 5 ranks, highest first, into the low 20 bits of a pokerval. """
+    return (ranks[0]<<16) | (ranks[1]<<12) | (ranks[2]<<8) | (ranks[3]<<4) | ranks[4]
+
+def _distinct_value(ranks,flush):
+    """ The pokerval of 5 distinct ranks, highest first. """
+    if ranks == [14,5,4,3,2]:
+        straight = True
+        ranks = [5,4,3,2,1]
+    else:
+        straight = (ranks[0]-ranks[4]==4)
+    value = _kicker_value(ranks)
+    if straight and flush:
+        return STRAIGHTFLUSH | value
+    elif flush:
+        return FLUSH | value
+    elif straight:
+        return STRAIGHT | value
+    return value
+
+def _paired_value(ranks):
+    """ The pokerval of 5 ranks, highest first, with at least one repeat. """
+    counts = {}
+    for rank in ranks:
+        counts[rank] = counts.get(rank,0)+1
+    # most copies first, then highest rank: e.g. 7 7 7 K K, or Q Q 9 9 4
+    groups = sorted([(count,rank) for (rank,count) in counts.items()],reverse=True)
+    ordered = []
+    for (count,rank) in groups:
+        ordered.extend([rank]*count)
+    shape = [count for (count,rank) in groups]
+    if shape == [4,1]:
+        return FOUROFAKIND | _kicker_value(ordered)
+    elif shape == [3,2]:
+        return FULLHOUSE | _kicker_value(ordered)
+    elif shape == [3,1,1]:
+        return THREEOFAKIND | _kicker_value(ordered)
+    elif shape == [2,2,1]:
+        return TWOPAIR | _kicker_value(ordered)
+    elif shape == [2,1,1,1]:
+        return ONEPAIR | _kicker_value(ordered)
+    raise ValueError("not a paired hand: %s"%ranks)
+
+def _build_tables():
+    flush5 = [0]*8192
+    unique5 = [0]*8192
+    paired = {}
+    ranks = range(14,1,-1)
+    for fiveranks in xuniqueCombinations(ranks,5):
+        fiveranks = list(fiveranks)
+        mask = 0
+        for rank in fiveranks:
+            mask |= RANKBIT[rank]
+        flush5[mask] = _distinct_value(fiveranks,True)
+        unique5[mask] = _distinct_value(fiveranks,False)
+
+    def multisets(numcards,maxrank):
+        if numcards==0:
+            yield []
+            return
+        for rank in range(maxrank,1,-1):
+            for count in range(1,min(4,numcards)+1):
+                for rest in multisets(numcards-count,rank-1):
+                    yield [rank]*count + rest
+    for fiveranks in multisets(5,14):
+        if len(set(fiveranks)) < 5:
+            product = 1
+            for rank in fiveranks:
+                product *= PRIME[rank]
+            paired[product] = _paired_value(fiveranks)
+    return flush5,unique5,paired
+
+FLUSH5,UNIQUE5,PAIRED = _build_tables()
+
+def evaluate5(cards):
+    """ The pokerval of exactly 5 (rank,suit) cards.
+
+    >>> evaluate5([(14,1),(2,1),(3,1),(4,1),(5,1)]) == STRAIGHTFLUSH + 0x54321
+    True
+    >>> evaluate5([(9,1),(9,2),(4,3),(4,4),(9,3)]) == FULLHOUSE + 0x99944
+    True
+    """
+    (r1,s1),(r2,s2),(r3,s3),(r4,s4),(r5,s5) = cards
+    if s1==s2==s3==s4==s5:
+        return FLUSH5[RANKBIT[r1]|RANKBIT[r2]|RANKBIT[r3]|RANKBIT[r4]|RANKBIT[r5]]
+    value = UNIQUE5[RANKBIT[r1]|RANKBIT[r2]|RANKBIT[r3]|RANKBIT[r4]|RANKBIT[r5]]
+    if value:
+        return value
+    return PAIRED[PRIME[r1]*PRIME[r2]*PRIME[r3]*PRIME[r4]*PRIME[r5]]
+
+# Rank classes: there are only 7462 distinct 5-card pokervals, so each one
+# can be replaced by its position in sorted order, a dense 16-bit number that
+# compares exactly like the pokerval it stands for.  POKERVALS[rank_class] is
+# the pokerval, and RANK_CLASS[pokerval] the rank class.
+POKERVALS = sorted(set(FLUSH5 + UNIQUE5 + PAIRED.values()) - set([0]))
+NUM_RANK_CLASSES = len(POKERVALS)
+RANK_CLASS = dict([(pokerval,rank_class) for (rank_class,pokerval) in enumerate(POKERVALS)])
+
+def pokerval_to_rank_class(pokerval):
+    """ The dense rank class, 0..7461, of a pokerval.
+
+    >>> pokerval_to_rank_class(0x75432), pokerval_to_rank_class(STRAIGHTFLUSH + 0xedcba)
+    (0, 7461)
+    """
+    return RANK_CLASS[pokerval]
+
+def rank_class_to_pokerval(rank_class):
+    """ The pokerval a rank class stands for. """
+    return POKERVALS[rank_class]
@@ -0,0 +1,167 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+handrange.py
+    Hand range notation, compiled to bitsets over the 1,326 combo ids of
+    rangeequity (bit id set = combo id is in the range):
+
+        bits = compile_range("TT+, AKs, A5s-A2s, KQo")
+        if bits >> pocket.id & 1: ...
+        both = compile_range("QQ+") | compile_range("AK")
+
+    A range is a comma separated list of terms:
+
+        AA, AKs, AKo, AK        a pair, or two ranks suited, offsuit or both
+        Kx, xxs, Kxo            x matches any rank, as in Pocket comparisons
+        TT+, ATs+, KJ+          a pair and every higher pair; or the first
+                                rank with the second rank and up (below it)
+        TT-77, A5s-A2s          pairs, or the same first rank, between the two
+        AsKd                    one combo
+
+    The first rank is the pocket's higher card, the second its lower one.
+    Compiled ranges are cached, so matching a pattern a second time is a
+    cache lookup and a bit test.
+"""
+
+import re
+import cache
+from rangeequity import NUM_COMBOS,combo_id,combo_cards
+from poker_globals import *
+
+ALL_COMBOS = (1<<NUM_COMBOS)-1
+
+# (high rank, low rank, suited) of every combo id
+_COMBO_RANKS = []
+for _id in range(NUM_COMBOS):
+    ((_high,_highsuit),(_low,_lowsuit)) = combo_cards(_id)
+    _COMBO_RANKS.append((_high,_low,_highsuit==_lowsuit))
+
+_RANK_CHARS = "23456789TJQKAX"
+_TERM = re.compile(r'^([2-9TJQKAX])([2-9TJQKAX])([SO]?)(\+?)$')
+_SPAN = re.compile(r'^([2-9TJQKA])([2-9TJQKA])([SO]?)-([2-9TJQKA])([2-9TJQKA])([SO]?)$')
+_COMBO = re.compile(r'^[2-9TJQKA][CDHS][2-9TJQKA][CDHS]$')
+
+compiled_ranges = cache.LRUCache("handrange.compile_range",maxentries=4096)
+
+def _rank(char):
+    if char == 'X':
+        return None
+    return cvt_to_rank(char)
+
+def _matching(highs,lows,suitedness):
+    """ The bits of the combos whose high rank is in highs and low rank in
+    lows (None for any), suited ('S'), offsuit ('O') or either (''). """
+    bits = 0
+    for (id,(high,low,suited)) in enumerate(_COMBO_RANKS):
+        if highs is not None and high not in highs:
+            continue
+        if lows is not None and low not in lows:
+            continue
+        if suitedness == 'S' and not suited or suitedness == 'O' and suited:
+            continue
+        bits |= 1<<id
+    return bits
+
+def _compile_term(term):
+    if _COMBO.match(term):
+        return 1<<combo_id(term[0]+term[1].lower()+term[2]+term[3].lower())
+    match = _TERM.match(term)
+    if match:
+        (high,low,suitedness,plus) = match.groups()
+        (high,low) = (_rank(high),_rank(low))
+        if not plus:
+            return _matching(high and [high],low and [low],suitedness)
+        if high is None or low is None:
+            raise ValueError("a + range needs two ranks: %s"%term)
+        if high == low:
+            ranks = range(high,15)
+            return sum([_matching([rank],[rank],suitedness) for rank in ranks])
+        return _matching([high],range(low,high),suitedness)
+    match = _SPAN.match(term)
+    if match:
+        (high1,low1,suited1,high2,low2,suited2) = match.groups()
+        (high1,low1,high2,low2) = [cvt_to_rank(char) for char in (high1,low1,high2,low2)]
+        if suited1 != suited2:
+            raise ValueError("the two ends of a range must both be suited or offsuit: %s"%term)
+        if high1 == low1 and high2 == low2:
+            ranks = range(min(high1,high2),max(high1,high2)+1)
+            return sum([_matching([rank],[rank],suited1) for rank in ranks])
+        if high1 == high2:
+            return _matching([high1],range(min(low1,low2),max(low1,low2)+1),suited1)
+        raise ValueError("a - range needs pairs or one first rank: %s"%term)
+    raise ValueError("not a hand range: %s"%term)
+
+def compile_range(notation):
+    """ The bitset of the combos a range (see above) covers.  Raises
+    ValueError for notation it doesn't understand.
+
+    >>> range_size(compile_range("TT+, AKs")), range_size(compile_range("xx"))
+    (34, 1326)
+    """
+    bits = compiled_ranges.get(notation)
+    if bits is None:
+        bits = 0
+        for term in notation.upper().split(','):
+            term = term.strip()
+            if term:
+                bits |= _compile_term(term)
+        compiled_ranges[notation] = bits
+    return bits
+
+def range_ids(bits):
+    """ The combo ids in a range bitset, in order. """
+    ids = []
+    base = 0
+    while bits:
+        word = bits & 0xffffffff
+        while word:
+            low = word & -word
+            ids.append(base + low.bit_length() - 1)
+            word ^= low
+        bits >>= 32
+        base += 32
+    return ids
+
+def range_size(bits):
+    """ How many combos a range bitset covers. """
+    return bin(bits).count('1')
+
+import unittest
+
+class Test_handrange(unittest.TestCase):
+
+    def test_terms(self):
+        self.assertEqual(range_size(compile_range("AA")),6)
+        self.assertEqual(range_size(compile_range("AKs")),4)
+        self.assertEqual(range_size(compile_range("AKo")),12)
+        self.assertEqual(compile_range("AK"),compile_range("AKs,AKo"))
+        self.assertEqual(range_size(compile_range("TT+")),30)
+        self.assertEqual(compile_range("TT+"),compile_range("AA-TT"))
+        self.assertEqual(compile_range("A5s-A2s"),compile_range("A2s,A3s,A4s,A5s"))
+        self.assertEqual(compile_range("KJ+"),compile_range("KJ,KQ"))
+        self.assertEqual(range_size(compile_range("xxs")),4*78)
+        self.assertEqual(range_size(compile_range("Kx")),4*4*11+6)
+        self.assertEqual(range_ids(compile_range("AhAs")),[combo_id(["As","Ah"])])
+        self.assertEqual(range_ids(compile_range("2c2d, AhAs")),[0,1325])
+        self.assertEqual(compile_range("xx"),ALL_COMBOS)
+        for bad in ("AKx+","AZ","TT-AKs","A5s-A2o","xT+"):
+            self.assertRaises(ValueError,compile_range,bad)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+    unittest.main()
@@ -0,0 +1,193 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+handstate.py
+    An incremental, card-by-card hand evaluator.  A partial hand is a single
+    integer "state", and adding a card to it is one addition of that card's
+    precomputed delta:
+
+        board = add_cards(EMPTY, commoncards)      # once per flop
+        mine = add_cards(board, mycards)
+        for card in deck:
+            pokerval = state_pokerval(mine + CARD_DELTA[card])
+
+    A state packs three fields, all of which are updated by the same add:
+
+        bits 0-51    one bit per card, 13 bits per suit (for flushes)
+        bits 52-67   one 4-bit counter per suit, starting at 3, so bit 3 of
+                     the counter is set once the suit has 5 or more cards
+        bits 68-     the sum of 5**(rank-2) over the cards: a unique key for
+                     the multiset of ranks, since no rank appears 5 times
+
+    state_pokerval looks the 5, 6 or 7 card value up in one of two small
+    tables built on first use: FLUSH, indexed by a suit's 13-bit rank mask,
+    and NONFLUSH, keyed by the rank key.  The values are identical to
+    CalculatingHand's best-five-card pokervals.
+"""
+
+import handeval
+
+SUITCOUNT_SHIFT = 52
+RANKKEY_SHIFT = 68
+FLUSH_CHECK = 0x8888 << SUITCOUNT_SHIFT
+# (flush bit of the suit's counter, shift of the suit's 13 card bits)
+_SUITS = [(8 << (SUITCOUNT_SHIFT + suit*4), suit*13) for suit in range(4)]
+
+EMPTY = 0x3333 << SUITCOUNT_SHIFT
+
+RANK_KEY = [0,0] + [5**(rank-2) for rank in range(2,15)]
+
+def _make_deltas():
+    deltas = {}
+    for rank in range(2,15):
+        for suit in range(1,5):
+            deltas[(rank,suit)] = ((1 << ((suit-1)*13 + rank-2)) +
+                                   (1 << (SUITCOUNT_SHIFT + (suit-1)*4)) +
+                                   (RANK_KEY[rank] << RANKKEY_SHIFT))
+        # suit 0 is treated like suit 4, just as normalize_suits does.
+        deltas[(rank,0)] = deltas[(rank,4)]
+    return deltas
+
+# CARD_DELTA[(rank,suit)] is added to a state to put that card in the hand.
+CARD_DELTA = _make_deltas()
+# INDEX_DELTA[i] is the delta of the card with pokertable.card_index i.
+INDEX_DELTA = [CARD_DELTA[((i>>2)+2,(i&3)+1)] for i in range(52)]
+
+FLUSH = None
+NONFLUSH = None
+
+def add_card(state,card):
+    """ Return state with one more (rank,suit) card in it. """
+    return state + CARD_DELTA[card[0],card[1]]
+
+def add_cards(state,cards):
+    """ Return state with all of cards added to it. """
+    for card in cards:
+        state += CARD_DELTA[card[0],card[1]]
+    return state
+
+def state_pokerval(state):
+    """ The pokerval of the best 5-card hand in a 5, 6 or 7 card state. """
+    if NONFLUSH is None:
+        build_tables()
+    if state & FLUSH_CHECK:
+        for (flushbit,shift) in _SUITS:
+            if state & flushbit:
+                return FLUSH[(state >> shift) & 0x1fff]
+    return NONFLUSH[state >> RANKKEY_SHIFT]
+
+def add_mask(state,mask):
+    """ Return state with every card of a card-index bitmask (such as
+    CardSet.mask) added to it. """
+    while mask:
+        low = mask & -mask
+        state += INDEX_DELTA[low.bit_length()-1]
+        mask ^= low
+    return state
+
+def pokerval(cards):
+    """ The pokerval of a list of 5, 6 or 7 (rank,suit) cards. """
+    return state_pokerval(add_cards(EMPTY,cards))
+
+def state_key(state):
+    """ A canonical integer key for the hand in a state: the rank key shifted
+    up 13 bits, plus the rank mask of the flush suit if there is one.  Two
+    hands get the same key exactly when normalize_cards would make them the
+    same hand, i.e. when they differ only in suits that can't matter, so the
+    key can stand in for the old normalize_cards + make_stringindex string.
+    It also determines the number of cards (the sum of the rank key's base
+    5 digits). """
+    key = (state >> RANKKEY_SHIFT) << 13
+    if state & FLUSH_CHECK:
+        for (flushbit,shift) in _SUITS:
+            if state & flushbit:
+                return key | ((state >> shift) & 0x1fff)
+    return key
+
+def hand_key(cards):
+    """ state_key of a list of (rank,suit) cards, in one pass over them. """
+    return state_key(add_cards(EMPTY,cards))
+
+def key_cards(key):
+    """ A representative hand for a state_key, as a sorted list of
+    (rank,suit) cards: the flush ranks in suit 1, the other cards dealt
+    round the remaining suits. """
+    flushmask = key & 0x1fff
+    rankkey = key >> 13
+    cards = []
+    suit = 1
+    for rank in range(2,15):
+        count = (rankkey // RANK_KEY[rank]) % 5
+        if flushmask & (1 << (rank-2)):
+            cards.append((rank,1))
+            count -= 1
+        for i in range(count):
+            suit = suit % 3 + 2 if flushmask else suit % 4 + 1
+            cards.append((rank,suit))
+    cards.sort()
+    return cards
+
+def _rank_multisets(numcards,minrank=2):
+    """ Yield every multiset of numcards ranks (each used at most 4 times) as
+    a sorted list. """
+    if numcards==0:
+        yield []
+        return
+    for rank in range(minrank,15):
+        for count in range(1,min(4,numcards)+1):
+            for rest in _rank_multisets(numcards-count,rank+1):
+                yield [rank]*count + rest
+
+def build_tables():
+    """ Fill FLUSH and NONFLUSH.  Only the 5-card entries are evaluated, by
+    handeval; every 6 and 7 card entry is the max of the entries with one
+    card fewer. """
+    global FLUSH, NONFLUSH
+
+    flush = [0]*8192
+    bycount = [[] for i in range(14)]
+    for mask in range(8192):
+        bycount[bin(mask).count('1')].append(mask)
+    for mask in bycount[5]:
+        cards = [(rank,1) for rank in range(2,15) if mask & (1<<(rank-2))]
+        flush[mask] = handeval.evaluate5(cards)
+    for numcards in range(6,8):
+        for mask in bycount[numcards]:
+            best = 0
+            bits = mask
+            while bits:
+                bit = bits & -bits
+                best = max(best,flush[mask ^ bit])
+                bits ^= bit
+            flush[mask] = best
+
+    nonflush = {}
+    for ranks in _rank_multisets(5):
+        # spread the suits so that no five cards share one; a rank's copies
+        # are adjacent in the sorted list, so they get distinct suits.
+        cards = [(rank,(i%4)+1) for (i,rank) in enumerate(ranks)]
+        nonflush[sum([RANK_KEY[rank] for rank in ranks])] = handeval.evaluate5(cards)
+    for numcards in range(6,8):
+        for ranks in _rank_multisets(numcards):
+            key = sum([RANK_KEY[rank] for rank in ranks])
+            best = 0
+            for rank in set(ranks):
+                best = max(best,nonflush[key - RANK_KEY[rank]])
+            nonflush[key] = best
+
+    FLUSH = flush
+    NONFLUSH = nonflush
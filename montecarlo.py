@@ -0,0 +1,285 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+montecarlo.py
+    Monte Carlo estimates of equity over random runouts, for when
+    enumerating every runout (1.7 million boards preflop) is too slow.
+
+    sample_equity draws runouts of k cards from the live cards, scores each
+    with a trial function, and stops after a fixed number of samples or once
+    the standard error is small enough (sample_equities does the same for a
+    trial that scores several seats at once).  It returns an EquityEstimate, which
+    is a float (the estimate) that also carries its standard error,
+    confidence interval and sample count.  The runs are reproducible: the
+    same seed gives the same runouts.
+
+    AnytimeSampler works through every runout in a random order for as
+    long as a deadline allows, with an unbiased estimate at any point.
+
+    Two variance reduction options:
+
+        'antithetic'   each runout is paired with its mirror image, the cards
+                       at the opposite end of the (rank ordered) deck, and
+                       the pair's mean is one sample
+        'stratified'   the first runout card is stratified: every live card
+                       gets the same number of samples, and the estimate is
+                       the mean of the per-card means
+"""
+
+import random,math,time
+import combinatorics
+
+VARIANCE_REDUCTIONS = (None,'antithetic','stratified')
+
+# how many samples a target_stderr run takes before it believes its own
+# variance estimate, and the most it will take without a samples budget
+MIN_SAMPLES = 200
+MAX_SAMPLES = 1000000
+
+class EquityEstimate(float):
+    """ An equity estimate.  It is the estimated equity as a float, with:
+
+        stderr      the standard error of the estimate
+        low,high    the confidence interval, clipped to [0,1]
+        confidence  the interval's confidence level
+        samples     how many runouts were evaluated
+    """
+
+    def __new__(cls,equity,stderr=0.0,samples=0,confidence=0.95):
+        self = float.__new__(cls,equity)
+        self.stderr = stderr
+        self.samples = samples
+        self.confidence = confidence
+        halfwidth = z_score(confidence)*stderr
+        self.low = max(0.0,equity-halfwidth)
+        self.high = min(1.0,equity+halfwidth)
+        return self
+
+    def __repr__(self):
+        return "EquityEstimate(%f, %.0f%% in [%f, %f], %d samples)"%(self,self.confidence*100,self.low,self.high,self.samples)
+
+def z_score(confidence):
+    """ The two-sided normal quantile for a confidence level, e.g. 1.96 for
+    0.95. """
+    # invert erf by bisection; erf(z/sqrt(2)) is the two-sided coverage
+    (lo,hi) = (0.0,10.0)
+    for i in range(60):
+        mid = (lo+hi)/2
+        if math.erf(mid/math.sqrt(2)) < confidence:
+            lo = mid
+        else:
+            hi = mid
+    return (lo+hi)/2
+
+class _Running:
+    """ Welford's running mean and variance. """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+    def add(self,x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(x - self.mean)
+    def variance(self):
+        if self.n < 2:
+            return 0.0
+        return self.m2/(self.n-1)
+
+def sample_equity(trial,items,k,samples=None,target_stderr=None,seed=None,
+                  variance_reduction=None,confidence=0.95):
+    """ Estimate the mean of trial(runout) over every k-item runout drawn
+    from items (the live cards, as anything trial understands; they should
+    be in rank order for 'antithetic' to help).  runout is a list of k
+    distinct items; trial returns the equity of that runout, 0 to 1.
+
+    Stop after samples runouts, or once the standard error is at most
+    target_stderr, whichever comes first; at least one of them must be
+    given. """
+    return sample_equities(lambda runout: (trial(runout),),items,k,samples,target_stderr,
+                           seed,variance_reduction,confidence)[0]
+
+def sample_equities(trial,items,k,samples=None,target_stderr=None,seed=None,
+                    variance_reduction=None,confidence=0.95):
+    """ sample_equity for a trial that returns a tuple of equities (one per
+    seat, say) from each runout: returns a list of EquityEstimates, and a
+    target_stderr run goes on until every one of them is that close. """
+    if samples is None and target_stderr is None:
+        raise ValueError("sample_equity needs a samples budget or a target_stderr")
+    if variance_reduction not in VARIANCE_REDUCTIONS:
+        raise ValueError("unknown variance reduction: %s"%variance_reduction)
+    if samples is None:
+        samples = MAX_SAMPLES
+    rand = random.Random(seed)
+    n = len(items)
+
+    def done(count,stderr):
+        if count >= samples:
+            return True
+        return target_stderr is not None and count >= MIN_SAMPLES and stderr <= target_stderr
+
+    if variance_reduction == 'stratified':
+        strata = None
+        rests = [items[:s]+items[s+1:] for s in range(n)]
+        count = 0
+        while True:
+            for s in range(n):
+                values = trial([items[s]] + rand.sample(rests[s],k-1))
+                if strata is None:
+                    strata = [[_Running() for value in values] for i in range(n)]
+                for (running,value) in zip(strata[s],values):
+                    running.add(value)
+            count += n
+            means = [sum([stratum[j].mean for stratum in strata])/n for j in range(len(strata[0]))]
+            stderrs = [math.sqrt(sum([stratum[j].variance()/stratum[j].n for stratum in strata]))/n for j in range(len(means))]
+            if strata[0][0].n >= 2 and done(count,max(stderrs)):
+                return [EquityEstimate(mean,stderr,count,confidence) for (mean,stderr) in zip(means,stderrs)]
+
+    runnings = None
+    count = 0
+    while True:
+        if variance_reduction == 'antithetic':
+            positions = rand.sample(xrange(n),k)
+            values = [(a+b)/2. for (a,b) in zip(trial([items[p] for p in positions]),trial([items[n-1-p] for p in positions]))]
+            count += 2
+        else:
+            values = trial(rand.sample(items,k))
+            count += 1
+        if runnings is None:
+            runnings = [_Running() for value in values]
+        for (running,value) in zip(runnings,values):
+            running.add(value)
+        stderrs = [math.sqrt(running.variance()/running.n) for running in runnings]
+        if runnings[0].n >= 2 and done(count,max(stderrs)):
+            return [EquityEstimate(running.mean,stderr,count,confidence) for (running,stderr) in zip(runnings,stderrs)]
+
+class AnytimeSampler:
+    """ Evaluates trial on every k-item runout of items in a uniformly
+    random order, as much of it as time allows: after any number of
+    runouts, the ones done so far are a simple random sample (without
+    replacement) of all of them, so the mean is unbiased, and once every
+    runout has been done it is exact.  run() can be called again to carry
+    on where the last call stopped. """
+
+    # runouts between looks at the clock
+    BATCH = 32
+
+    def __init__(self,trial,items,k,seed=None):
+        self.trial = trial
+        self.items = items
+        self.k = k
+        self.total = combinatorics.choose(len(items),k)
+        self.rand = random.Random(seed)
+        self.running = _Running()
+        # a Fisher-Yates shuffle of the runout ranks, done lazily: swapped
+        # holds the positions that have been swapped away from the identity
+        self.swapped = {}
+
+    def done(self):
+        """ Whether every runout has been evaluated. """
+        return self.running.n >= self.total
+
+    def _next_runout(self):
+        (i,swapped) = (self.running.n,self.swapped)
+        j = self.rand.randrange(i,self.total)
+        r = swapped.get(j,j)
+        swapped[j] = swapped.pop(i,i)
+        items = self.items
+        return [items[c] for c in combinatorics.unrank(r,self.k)]
+
+    def run(self,deadline=None,samples=None):
+        """ Evaluate runouts until time.time() reaches deadline, samples more
+        have been done, or there are none left. """
+        if samples is not None:
+            samples += self.running.n
+        trial = self.trial
+        running = self.running
+        while not self.done():
+            for i in xrange(self.BATCH):
+                if self.done() or samples is not None and running.n >= samples:
+                    return
+                running.add(trial(self._next_runout()))
+            if deadline is not None and time.time() >= deadline:
+                return
+
+    def estimate(self,confidence=0.95):
+        """ The EquityEstimate so far; its standard error includes the
+        finite population correction, so it reaches 0 when done. """
+        running = self.running
+        if running.n < 1:
+            return EquityEstimate(0.5,0.5,0,confidence)
+        if self.done():
+            return EquityEstimate(running.mean,0.0,running.n,confidence)
+        stderr = math.sqrt(running.variance()/running.n*(1.0-float(running.n)/self.total))
+        return EquityEstimate(running.mean,stderr,running.n,confidence)
+
+import unittest
+
+class Test_montecarlo(unittest.TestCase):
+
+    def test_estimate(self):
+        # the chance that two cards of 10 include the 0
+        trial = lambda runout: float(0 in runout)
+        for variance_reduction in VARIANCE_REDUCTIONS:
+            estimate = sample_equity(trial,range(10),2,samples=20000,seed=1,variance_reduction=variance_reduction)
+            self.assertTrue(abs(estimate-0.2) < 4*estimate.stderr,(variance_reduction,estimate))
+            self.assertTrue(estimate.low < 0.2 < estimate.high or abs(estimate-0.2) < 4*estimate.stderr)
+            self.assertTrue(estimate.samples >= 20000)
+            again = sample_equity(trial,range(10),2,samples=20000,seed=1,variance_reduction=variance_reduction)
+            self.assertEqual((float(again),again.stderr),(float(estimate),estimate.stderr))
+
+    def test_target_stderr(self):
+        trial = lambda runout: float(sum(runout) > 9)
+        estimate = sample_equity(trial,range(10),2,target_stderr=0.01,seed=2)
+        self.assertTrue(estimate.stderr <= 0.01)
+        self.assertTrue(MIN_SAMPLES <= estimate.samples < MAX_SAMPLES)
+        self.assertRaises(ValueError,sample_equity,trial,range(10),2)
+
+    def test_vector(self):
+        # the chances that two cards of 10 include the 0, and the 1
+        trial = lambda runout: (float(0 in runout),float(1 in runout))
+        for variance_reduction in VARIANCE_REDUCTIONS:
+            estimates = sample_equities(trial,range(10),2,target_stderr=0.01,seed=3,variance_reduction=variance_reduction)
+            self.assertEqual(len(estimates),2)
+            for estimate in estimates:
+                self.assertTrue(estimate.stderr <= 0.01)
+                self.assertTrue(abs(estimate-0.2) < 4*estimate.stderr,(variance_reduction,estimate))
+
+    def test_anytime(self):
+        seen = []
+        def trial(runout):
+            seen.append(tuple(runout))
+            return float(0 in runout)
+        sampler = AnytimeSampler(trial,range(10),2,seed=6)
+        sampler.run(samples=20)
+        partial = sampler.estimate()
+        self.assertEqual(partial.samples,20)
+        self.assertTrue(partial.stderr > 0)
+        sampler.run(deadline=time.time()+10)
+        self.assertTrue(sampler.done())
+        # every runout exactly once, so the estimate is exact
+        self.assertEqual(len(set(seen)),45)
+        self.assertAlmostEqual(sampler.estimate(),0.2)
+        self.assertEqual((sampler.estimate().stderr,sampler.estimate().samples),(0.0,45))
+
+    def test_z_score(self):
+        self.assertAlmostEqual(z_score(0.95),1.959964,5)
+        self.assertAlmostEqual(z_score(0.99),2.575829,5)
+
+if __name__ == '__main__':
+    unittest.main()
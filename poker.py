@@ -29,10 +29,14 @@ if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
 
 from poker_globals import *
+import pokertable,handstate,handeval,cache,equitystore,montecarlo
+from cardset import CardSet,as_cards,situation_key
+from boardindex import board_index,hand_percentile
+from rangeequity import NUM_COMBOS,combo_id,combo_cards
+from handrange import compile_range,range_ids
 
-global pokervals6_db, pokervals7_db
-pokervals6_db = None
-pokervals7_db = None
+global pokerval_tables
+pokerval_tables = None
 
 def getpokerval(_cards,pokerval_db=None):
     """ Calculate the best hand possible from a list of cards via database lookup. 
@@ -64,8 +68,13 @@ def getpokerval(_cards,pokerval_db=None):
         2^7 to 2^4 is the 2nd value
         2^3 to 2^0 is the low value
         
+    If database_generator.py has written the flat pokervals?.tbl tables, the
+    value is read straight out of the memory-mapped table; otherwise it is
+    computed by the handstate evaluator and cached.
+
     An example of _cards might be Ac 2c 3c 4c 5c 8c 10d, which would look
-    like this: [(14,1),(2,1),(3,1),(4,1),(5,1),(8,1),(10,2)]
+    like this: [(14,1),(2,1),(3,1),(4,1),(5,1),(8,1),(10,2)].  A CardSet
+    works too, and is looked up straight from its bitmask.
 
     >>> getpokerval([(14,1),(2,1),(3,1),(4,1),(5,1),(8,1),(10,2)]) == STRAIGHTFLUSH + 0x54321
     True
@@ -74,49 +83,51 @@ def getpokerval(_cards,pokerval_db=None):
     >>> format_pokerval(getpokerval([(10,2),(8,1),(3,1),(4,1),(5,1),(6,1),(14,1)]))
     '00010000 0xe8654 FLUSH'
     """
+    if isinstance(_cards,CardSet):
+        mask = _cards.mask
+        _cards = _cards.cards()
+    else:
+        mask = None
     if len(_cards)<5:
         return None
+
+    if pokerval_db is None:
+        if pokerval_tables is None:
+            _open_tables()
+        table = pokerval_tables.get(len(_cards))
+        if table is not None:
+            if mask is not None:
+                return table.lookup_mask(mask)
+            return table.lookup(_cards)
         
-    global pokerval_cache,pokerval_cachehits,pokerval_cachemisses
-    cards = normalize_cards(_cards)
+    if len(_cards)>7:
+        raise ValueError("What did you call this with? : %s, len=%d"%(format_cards(_cards),len(_cards)))
+    if mask is not None:
+        state = handstate.add_mask(handstate.EMPTY,mask)
+    else:
+        state = handstate.add_cards(handstate.EMPTY,_cards)
+    # one integer stands for every suit-equivalent version of the hand
+    key = handstate.state_key(state)
 
-    try:
-        index = make_stringindex(cards)
-        if pokerval_db is not None and len(index)==7:
-            return pokerval_db[index]
-        else:
-            try:
-                pokerval = pokerval_cache[index]
-                pokerval_cachehits+=1
-                return pokerval
-            except KeyError:
-                pokerval_cachemisses+=1
-                pass
-
-            if pokervals6_db is None:
-                _open_dbs()
-            if len(index)==5:
-                pokerval = Hand(cards).getpokerval()
-            elif len(index)==6:
-                pokerval = pokervals6_db[index]
-            elif len(index)==7:
-                pokerval = pokervals7_db[index]
-            else:
-                raise ValueError("What did you call this with? : index=%s, len=%d"%(index,len(index)))
-
-            pokerval_cache[index] = pokerval
-    except KeyError:
-        errstr = "hand not in database: %s %s, <%s>, %s"%(format_cards(_cards),format_cards(cards),index,reverse_stringindex(index))
-        raise KeyError(errstr)
-    except:
-        raise
-    log.debug("[pokerval] %s=%s"%(format_cards(cards),format_pokerval(pokerval)))
+    if pokerval_db is not None and len(_cards)==7:
+        try:
+            return pokerval_db[key]
+        except KeyError:
+            raise KeyError("hand not in database: %s, <%x>, %s"%(format_cards(_cards),key,format_cards(handstate.key_cards(key))))
+    pokerval = pokerval_cache.get(key)
+    if pokerval is not None:
+        return pokerval
+
+    pokerval = handstate.state_pokerval(state)
+    pokerval_cache[key] = pokerval
+    log.debug("[pokerval] %s=%s"%(format_cards(_cards),format_pokerval(pokerval)))
     return pokerval
 
 def normalize_cards(in_cards):
     """ Normalize a hand by sorting it and tweaking suits in ways that don't 
     affect it's poker value, for the purpose of increasing cache hits and shrinking
-    database sizes. """
+    database sizes.  (getpokerval and the databases now use the integer
+    handstate.hand_key instead, which is computed in one pass.) """
     cards = sorted(in_cards)
     cards = normalize_suits(cards)
     cards.sort()
@@ -143,6 +154,11 @@ except ImportError:
     log.info("Download the 'psyco' Python module for some instant speedups.")
     pass
 
+try:
+    from pokerbatch import getpokerval_batch, showdown_counts
+except ImportError:
+    log.info("Install numpy for the batch evaluation API (pokerbatch.py).")
+
 try:
     psyco.bind(_make_char)    
     psyco.bind(make_stringindex)
@@ -161,35 +177,48 @@ def reverse_stringindex(index):
     return cards
 
 class Pocket:
-    """ A set of two cards.  May be compared to other pockets or strings like "KQo" or "AJ". """
+    """ A set of two cards.  May be compared to other pockets or strings like "KQo" or "AJ"
+    (any handrange notation, in fact, like "TT+, A5s-A2s").  Every pocket has an id, its
+    rangeequity combo id, and pocket(id) returns the interned Pocket for it. """
     def __init__(self,c1,c2=None):
         if c2 is None:
             self.cards = c1
         else:
             self.cards = [c1,c2]
         self.cards.sort(reverse=True)
+        self.id = combo_id(self.cards)
     def __eq__(self,other):
         if isinstance(other,Pocket):
-            return self.cards == other.cards
+            return self.id == other.id
         elif type(other) is str:
-            if other[0] not in ('x','X') and cvt_to_rank(other[0]) != self.cards[0][0]:
-                return False
-            if other[1] not in ('x','X') and cvt_to_rank(other[1]) != self.cards[1][0]:
+            try:
+                return bool(compile_range(other) >> self.id & 1)
+            except ValueError:
                 return False
-            if len(other)==3:
-                if other[-1] in ("o","O"): # check suit for inequality
-                    return self.cards[0][1] != self.cards[1][1]
-                elif other[-1] in ("s","S"): # check suit for equality
-                    return self.cards[0][1] == self.cards[1][1]
-            else:
-                return True
         else:
             return False
     def __ne__(self,other):
         return not self.__eq__(other)
+    def __hash__(self):
+        return self.id
     def __str__(self):
         return "cards: %s"%(str(self.cards))
 
+# the 1,326 pockets, by id
+POCKETS = [Pocket(combo_cards(_id)) for _id in range(NUM_COMBOS)]
+
+def pocket(hand):
+    """ The interned Pocket of a combo id or two cards (anything
+    rangeequity.combo_id takes). """
+    return POCKETS[combo_id(hand)]
+
+def range_pockets(notation):
+    """ The interned Pockets in a range, given as handrange notation or a
+    compiled bitset. """
+    if type(notation) is str:
+        notation = compile_range(notation)
+    return [POCKETS[id] for id in range_ids(notation)]
+
 
 class CalculatingHand:
     """ This class represents one poker hand of five cards.  The getpokerval
@@ -345,12 +374,7 @@ class CalculatingHand:
 
 class Hand:
     """ This class represents a 5-card poker hand. The
-    pokerval is looked up from the pokervals5.shelf database."""
-
-    pokervals = None
-    def readinpokervals(self):
-        if Hand.pokervals is None:
-            Hand.pokervals = shelve.open('pokervals5.shelf','r')
+    pokerval is computed by handeval, without any database."""
 
     def __init__(self,cards,junk=None):
         self.sethand(cards)
@@ -371,17 +395,13 @@ class Hand:
                 self.cards.append((card[0], card[1]))
             else:
                 raise ArgumentError("illegal card being inserted into hand: %s, %s!" % (card,h_in))
-        self.cards = normalize_cards(self.cards)
+        self.cards.sort()
 
-        self.readinpokervals()
-        
         try:
-            index = make_stringindex(self.cards)
-            self.pokerval = Hand.pokervals[index]
-        except KeyError:
+            self.pokerval = handeval.evaluate5(self.cards)
+        except (KeyError,IndexError):
             self.pokerval = 0
-            raise ValueError("dammit, that hand is illegal/couldn't find that index: %s, %x"%(format_cards(self.cards),calchandint(self.cards)))
-            #raise
+            raise ValueError("dammit, that hand is illegal: %s, %x"%(format_cards(self.cards),calchandint(self.cards)))
 
     def getpokerval(self):
         return self.pokerval
@@ -403,31 +423,63 @@ def getbesthand(cards):
 
     return bestpokerhand
 
-def _open_dbs():
-    global pokervals6_db, pokervals7_db
-    import bsddb
-    pokervals6_db = shelve.BsdDbShelf(bsddb.hashopen('pokervals6.shelf','r'))
-    pokervals7_db = shelve.BsdDbShelf(bsddb.hashopen('pokervals7.shelf','r'))
+def _open_tables():
+    global pokerval_tables
+    pokerval_tables = {}
+    for numcards in (5,6,7):
+        table = pokertable.open_table(numcards)
+        if table is not None:
+            pokerval_tables[numcards] = table
 
 def _close_dbs():
-    global pokervals6_db, pokervals7_db
-    if pokervals6_db is not None:
-        pokervals6_db.close()
-        pokervals6_db = None
-    if pokervals7_db is not None:
-        pokervals7_db.close()
-        pokervals7_db = None
+    global pokerval_tables
+    if pokerval_tables is not None:
+        for table in pokerval_tables.values():
+            table.close()
+        pokerval_tables = None
     
-global pokerval_cache,pokerval_cachehits,pokerval_cachemisses,weightedcomparehands_cache,weightedcomparehands_cachehits
+# Bounded caches (see cache.py); resize() them to trade memory for hits.
+# A pokerval entry is about 180 bytes, so the pokerval cache tops out
+# around 24MB.
+pokerval_cache = cache.LRUCache("poker.pokerval",maxentries=1<<17)
+weightedcomparehands_cache = cache.LRUCache("poker.weightedcomparehands",maxentries=1<<15)
 
 def clear_pokerval_cache():
-    global pokerval_cache,pokerval_cachehits,pokerval_cachemisses,weightedcomparehands_cache,weightedcomparehands_cachehits
-    pokerval_cache={}
-    weightedcomparehands_cache={}
-    pokerval_cachehits=0
-    pokerval_cachemisses=0
-    weightedcomparehands_cachehits=0
-clear_pokerval_cache()
+    """ Empty the pokerval and weightedcomparehands caches and reset their
+    statistics. """
+    pokerval_cache.clear()
+    weightedcomparehands_cache.clear()
+
+# the persistent weightedcomparehands results shared with other processes,
+# if use_equity_store has been called.
+equity_store = None
+
+def use_equity_store(filename=equitystore.DEFAULT_FILENAME):
+    """ Look weightedcomparehands results up in (and add them to) the
+    persistent, process-shared equity file filename, so that restarts and
+    other workers start warm.  None stops using it. """
+    global equity_store
+    if equity_store is not None:
+        equity_store.close()
+        equity_store = None
+    if filename is not None:
+        equity_store = equitystore.EquityStore(filename)
+
+def serve(address=None,workers=2,equity_store=None):
+    """ Run an equity server (equityserver.py) on address, a Unix socket
+    path or a (host,port) pair, until interrupted: one warm process that
+    any number of bots query with an equityserver.EquityClient. """
+    import equityserver
+    server = equityserver.make_server(address or equityserver.DEFAULT_ADDRESS,workers,equity_store)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def cache_stats():
+    """ The stats() of the pokerval and weightedcomparehands caches. """
+    return {'pokerval':pokerval_cache.stats(),
+            'weightedcomparehands':weightedcomparehands_cache.stats()}
 
 def isstraight(_cards):
     """ is a bunch of cards a straight? """
@@ -447,25 +499,16 @@ def isbetterhand(cards,enemy_pokerval):
     return False
 
 def whowins(mycards,enemiescards,commoncards,potentialcommoncards=None):
-    allmycards = copy.copy(mycards)
-    allmycards.extend(commoncards)
-    if potentialcommoncards is not None:
-        allmycards.extend(potentialcommoncards)
+    if potentialcommoncards is None:
+        potentialcommoncards = []
+    if len(mycards)+len(commoncards)+len(potentialcommoncards)!=7:
+        raise "calling whowins wrong!  len of commoncards+potentialcommoncards must be 7! common=%s potential=%s mycards=%s"%(commoncards,potentialcommoncards,mycards)
 
-    if len(allmycards)!=7:
-        raise "calling whowins wrong!  len of commoncards+potentialcommoncards must be 7! common=%s potential=%s allmycards=%s"%(commoncards,potentialcommoncards,allmycards)
-
-    mybest = getpokerval(allmycards)
+    board = handstate.add_cards(handstate.add_cards(handstate.EMPTY,commoncards),potentialcommoncards)
+    mybest = handstate.state_pokerval(handstate.add_cards(board,mycards))
     hisbest = 0
     for hiscards in enemiescards:
-        allhiscards = copy.copy(hiscards)
-        allhiscards.extend(commoncards)
-        if potentialcommoncards is not None:
-            allhiscards.extend(potentialcommoncards)
-    
-        #~ mybest = getbesthand(allmycards).getpokerval()
-        #~ hisbest = getbesthand(allhiscards).getpokerval()
-        hisbest = max(hisbest,getpokerval(allhiscards))
+        hisbest = max(hisbest,handstate.state_pokerval(handstate.add_cards(board,hiscards)))
     if mybest > hisbest:
         winner = 1
         winnertxt = "WIN"
@@ -479,6 +522,93 @@ def whowins(mycards,enemiescards,commoncards,potentialcommoncards=None):
     log.debug("potentials: %s %s\n\tme  %s\n\thim %s"%(format_cards(potentialcommoncards), winnertxt, format_pokerval(mybest),format_pokerval(hisbest)))
     return winner
 
+def _enemy_hands(enemiescards):
+    """ enemiescards as a list of hands, each a list of (rank,suit) tuples.
+    A single hand (a list of cards or a CardSet) is accepted as well. """
+    if isinstance(enemiescards,CardSet):
+        return [enemiescards.cards()]
+    first = enemiescards[0]
+    if type(first) is str or (not isinstance(first,CardSet) and type(first[0]) is int):
+        enemiescards = [enemiescards,]
+    return [as_cards(hiscards) for hiscards in enemiescards]
+
+def _showdown(state_pokerval,mystate,hisstates,delta):
+    """ 1, .5 or 0 as my state beats, ties or loses to the best of his
+    states, once the cards in delta have been added to all of them. """
+    mybest = state_pokerval(mystate+delta)
+    hisbest = 0
+    for hisstate in hisstates:
+        hisval = state_pokerval(hisstate+delta)
+        if hisval > hisbest:
+            hisbest = hisval
+    if mybest > hisbest:
+        return 1.
+    elif mybest < hisbest:
+        return 0.
+    return .5
+
+def _multiway_showdown(state_pokerval,states,delta):
+    """ Each state's share of the pot once the cards in delta have been
+    added to all of them: 1 for the winner, 1/k each for a k-way split. """
+    values = [state_pokerval(state+delta) for state in states]
+    best = max(values)
+    nbest = values.count(best)
+    share = 1./nbest
+    return [value == best and share or 0. for value in values]
+
+def multiway_equity(hands,commoncards,samples=None,target_stderr=None,seed=None,
+                    variance_reduction=None,confidence=0.95):
+    """ Every seat's showdown chances, from one pass over the runouts of 0
+    to 5 common cards.  hands is a list of each seat's hole cards (lists of
+    cards, strings or CardSets).  Returns a list with one tuple per seat:
+
+        (equity, win, tie, lose)
+
+    where win, tie and lose are the fractions of runouts the seat wins
+    outright, splits and loses, and equity is its share of the pot, with
+    a k-way split worth 1/k; the seats' equities sum to 1.
+
+    Every runout is enumerated, unless samples or target_stderr is given,
+    as for comparehands; then each equity is a montecarlo.EquityEstimate
+    and target_stderr applies to all of them. """
+    hands = [as_cards(hand) for hand in hands]
+    commoncards = as_cards(commoncards)
+    if len(hands) < 2:
+        raise ValueError("a showdown needs at least 2 hands, not %d"%len(hands))
+    if len(commoncards) > 5:
+        raise ValueError("too many common cards: %s"%format_cards(commoncards))
+    board = handstate.add_cards(handstate.EMPTY,commoncards)
+    states = [handstate.add_cards(board,hand) for hand in hands]
+    state_pokerval = handstate.state_pokerval
+    deltas = [handstate.INDEX_DELTA[i] for i in CardSet.deck(commoncards,*hands).indices()]
+    nseats = len(hands)
+    k = 5-len(commoncards)
+
+    def trial(runout):
+        # every seat's share, then whether each won outright, then whether
+        # each split
+        shares = _multiway_showdown(state_pokerval,states,sum(runout))
+        return (shares + [float(share == 1.) for share in shares] +
+                [float(0. < share < 1.) for share in shares])
+
+    if samples is not None or target_stderr is not None:
+        # the estimates are already means
+        means = montecarlo.sample_equities(trial,deltas,k,samples,target_stderr,
+                                           seed,variance_reduction,confidence)
+    else:
+        totals = [0.]*(3*nseats)
+        count = 0
+        for runout in xuniqueCombinations(deltas,k):
+            for (n,value) in enumerate(trial(runout)):
+                totals[n] += value
+            count += 1
+        means = [total/count for total in totals]
+    result = []
+    for seat in range(nseats):
+        (win,tie) = float(means[nseats+seat]),float(means[2*nseats+seat])
+        result.append((means[seat],win,tie,1.-win-tie))
+    return result
+
 # counts the possible combination of hands that we win lose or tie against in a showdown right now
 def nhands(mycards,commoncards):
     """ How many hands are higher than/lower than/tied with mine in a
@@ -487,34 +617,15 @@ def nhands(mycards,commoncards):
     global log
     #log.debug("nhands: %s  common %s"%(format_cards(mycards),format_cards(commoncards)))
 
-    nhandshi,nhandslo,nhandsti = 0,0,0
-    total_cnt = 0
-
-    allmycards = copy.copy(mycards)
-    allmycards.extend(commoncards)
-
-    if len(allmycards)<5 or len(allmycards)>7:
+    mymask = CardSet(mycards).mask
+    boardmask = CardSet(commoncards).mask
+    numcards = len(CardSet(mymask|boardmask))
+    if numcards<5 or numcards>7:
         raise "calling nhands wrong!  len of mycards+commoncards must be between 5 and 7 inclusive! common=%s allmycards=%s"%(commoncards,mycards)
 
-    mybest = getpokerval(allmycards)
-    # make deck excluding known cards
-    deck = []
-    for val in range(2,15):
-        for suit in range(1,5):
-            if (((val, suit) not in mycards) and
-                ((val, suit) not in commoncards)):
-                deck.append((val,suit))
-
-    for potentialoppcards in xuniqueCombinations(deck,2):
-        alloppcards = copy.copy(potentialoppcards)
-        alloppcards.extend(commoncards)
-        oppbest = getpokerval(alloppcards)
-        if oppbest>mybest: nhandshi += 1
-        elif oppbest<mybest: nhandslo += 1
-        elif oppbest==mybest: nhandsti += 1
-        else: raise "error in nhands! potentialoppcards=%s mycards=%s commoncards=%s"%(potentialoppcards,mycards,commoncards)
-
-    return (nhandshi, nhandslo, nhandsti)
+    # every opponent holding on this board is evaluated and sorted once, and
+    # shared by all the hands asked about on it
+    return board_index(boardmask).nhands(mymask)
 
 def prwinnow(nhandshi,nhandslo,nhandsti,nopponentsplaying=1):
     """ Calculates odds that we can win a showdown right now against a provided 
@@ -524,55 +635,56 @@ def prwinnow(nhandshi,nhandslo,nhandsti,nopponentsplaying=1):
         raise "Invalid call of prwinnow, nhands:%d"%(nhands)
     return pow(float(nhandslo)/nhands,nopponentsplaying)
 
-def comparehands(mycards,enemiescards,commoncards,force_unweighted=False):
+def comparehands(mycards,enemiescards,commoncards,force_unweighted=False,
+                 samples=None,target_stderr=None,seed=None,variance_reduction=None,confidence=0.95):
     """ Are my 2 cards better than his 2 (estimated) cards
-    given 3, 4, or 5 common cards? Return the expected win %
-    (money_made / total_wagered) """
+    given 0 to 5 common cards? Return the expected win %
+    (money_made / total_wagered) 
+
+    Every runout is enumerated, unless samples or target_stderr is given:
+    then runouts are sampled (see montecarlo.sample_equity, which takes the
+    other keyword arguments) until samples have been evaluated or the
+    standard error is down to target_stderr, and the result is a
+    montecarlo.EquityEstimate, a float with its confidence interval. """
+    sampling = samples is not None or target_stderr is not None
     
     if len(commoncards)==3 and not force_unweighted:
-        return weightedcomparehands(mycards,enemiescards,commoncards)
+        return weightedcomparehands(mycards,enemiescards,commoncards,samples=samples,target_stderr=target_stderr,
+                                    seed=seed,variance_reduction=variance_reduction,confidence=confidence)
 
     if enemiescards is None or len(enemiescards)==0:
         return None
 
-    if type(enemiescards[0][0]) is int:
-        enemiescards = [enemiescards,]
+    mycards = as_cards(mycards)
+    commoncards = as_cards(commoncards)
+    enemiescards = _enemy_hands(enemiescards)
 
     #~ log.info("comparehands: %s vs. %s common %s"%(format_cards(mycards),str([format_cards(hiscards) for hiscards in enemiescards]),format_cards(commoncards)))
 
-    for e in enemiescards:
-        for (i,c) in enumerate(e):
-            e[i]=(c[0],c[1]) # make sure it's a tuple
-            
     money = 0
     total_cnt = 0
 
     if len(commoncards)==5:
-        return whowins(mycards,enemiescards,commoncards)
+        winner = whowins(mycards,enemiescards,commoncards)
+        if sampling:
+            return montecarlo.EquityEstimate(winner,0.0,1,confidence)
+        return winner
     elif len(commoncards)<5:
-        # make deck
-        deck = []
-        for val in range(2,15):
-            for suit in range(1,5):
-                if (((val, suit) not in mycards) and
-                    ((val, suit) not in commoncards)):
-                    throwout=False
-                    for hiscards in enemiescards:
-                        if (val,suit) in hiscards:
-                            throwout=True
-                            break
-                    if not throwout:
-                        deck.append((val,suit))
-
-        #print mycards,hiscards,commoncards
-        for potentialcommoncards in xuniqueCombinations(deck,5-len(commoncards)):
-            winner = whowins(mycards,enemiescards,commoncards,potentialcommoncards)
-            #~ log.info("comparehands: %s v. %s common %s+%s result: %f"%(format_cards(mycards),
-                #~ str([format_cards(hiscards) for hiscards in enemiescards]), 
-                #~ format_cards(commoncards),
-                #~ format_cards(potentialcommoncards),
-                #~ winner))
-            money += winner
+        deck = CardSet.deck(mycards,commoncards,*enemiescards)
+
+        # the board is added to every hand once; each runout is then just
+        # one more delta on top of those states.
+        board = handstate.add_cards(handstate.EMPTY,commoncards)
+        mystate = handstate.add_cards(board,mycards)
+        hisstates = [handstate.add_cards(board,hiscards) for hiscards in enemiescards]
+        state_pokerval = handstate.state_pokerval
+        deltas = [handstate.INDEX_DELTA[i] for i in deck.indices()]
+        if sampling:
+            trial = lambda runout: _showdown(state_pokerval,mystate,hisstates,sum(runout))
+            return montecarlo.sample_equity(trial,deltas,5-len(commoncards),samples,target_stderr,
+                                            seed,variance_reduction,confidence)
+        for potentialcommoncards in xuniqueCombinations(deltas,5-len(commoncards)):
+            money += _showdown(state_pokerval,mystate,hisstates,sum(potentialcommoncards))
             total_cnt += 1
         log.debug("comparehands: %s v. %s common %s result: %f"%(format_cards(mycards),
             str([format_cards(hiscards) for hiscards in enemiescards]), 
@@ -582,98 +694,177 @@ def comparehands(mycards,enemiescards,commoncards,force_unweighted=False):
     else:
         raise "too many common cards!",commoncards
 
-def weightedcomparehands(mycards,enemiescards,commoncards,pokerval_db=None,turn_weight=0.75):
+def weightedcomparehands(mycards,enemiescards,commoncards,pokerval_db=None,turn_weight=0.75,
+                         samples=None,target_stderr=None,seed=None,variance_reduction=None,confidence=0.95):
     """ Are my 2 cards better than his 2 (estimated) cards
     given 3 common cards? Return the expected win %
-    (money_made / total_wagered) """
+    (money_made / total_wagered) 
+    
+    pokerval_db is accepted for compatibility but no longer consulted: the
+    runouts are evaluated incrementally with handstate.
+
+    With samples or target_stderr, sample (turn, river) runouts instead of
+    enumerating them, as comparehands does, and return a
+    montecarlo.EquityEstimate.  Sampled results aren't cached. """
     #log.info("comparehands: %s vs. %s common %s"%(format_cards(mycards),format_cards(enemiescards),format_cards(commoncards)))
 
     # check to see if it's a single enemy, then make it a list...
     if enemiescards is None or len(enemiescards)==0:
         return None
 
-    global weightedcomparehands_cache,weightedcomparehands_cachehits
-
-    if type(enemiescards[0][0]) is int:
-        enemiescards = [enemiescards,]
+    mycards = as_cards(mycards)
+    commoncards = as_cards(commoncards)
+    enemiescards = _enemy_hands(enemiescards)
 
     log.debug("[weightedcomparehands] %s vs. %s common %s"%(format_cards(mycards),str([format_cards(hiscards) for hiscards in enemiescards]),format_cards(commoncards)))
 
-    weightedcomparehands_cache_index = pickle.dumps((mycards,enemiescards,commoncards),2)
-    try:
-        winpct = weightedcomparehands_cache[weightedcomparehands_cache_index]
-        weightedcomparehands_cachehits+=1
-        return winpct
-    except KeyError:
-        pass
+    if samples is not None or target_stderr is not None:
+        return _sample_weightedcomparehands(mycards,enemiescards,commoncards,turn_weight,
+                                            samples,target_stderr,seed,variance_reduction,confidence)
 
-    for e in enemiescards:
-        for (i,c) in enumerate(e):
-            e[i]=(c[0],c[1]) # make sure it's a tuple
+    # suit-isomorphic situations (and the same one with the hands in another
+    # order) share a cache entry
+    situation = situation_key(mycards,enemiescards,commoncards)
+    weightedcomparehands_cache_index = (situation,turn_weight)
+    winpct = weightedcomparehands_cache.get(weightedcomparehands_cache_index)
+    if winpct is not None:
+        return winpct
+    if equity_store is not None:
+        winpct = equity_store.get(situation,turn_weight)
+        if winpct is not None:
+            weightedcomparehands_cache[weightedcomparehands_cache_index] = winpct
+            return winpct
 
     #print "comparehands: %s vs. %s common %s"%(str(mycards),str(enemiescards),str(commoncards))
 
-    # make deck
-    deck = []
-    for val in range(2,15):
-        for suit in range(1,5):
-            if (((val, suit) not in mycards) and
-                ((val, suit) not in commoncards)):
-                throwout=False
-                for hiscards in enemiescards:
-                    if (val,suit) in hiscards:
-                        throwout=True
-                        break
-                if not throwout:
-                    deck.append((val,suit))
-                    
+    deck = CardSet.deck(mycards,commoncards,*enemiescards)
+
     winsatturn = winsatriver = wins = 0.
     total_turn_cnt = total_cnt = 0.
 
-    for (i,potentialfirstcard) in enumerate(deck):
+    # evaluate incrementally: the flop goes into every hand's state once, and
+    # each turn and river card is one addition on top of it.
+    board = handstate.add_cards(handstate.EMPTY,commoncards)
+    mystate = handstate.add_cards(board,mycards)
+    hisstates = [handstate.add_cards(board,hiscards) for hiscards in enemiescards]
+    state_pokerval = handstate.state_pokerval
+    deltas = [handstate.INDEX_DELTA[i] for i in deck.indices()]
+
+    for (i,firstdelta) in enumerate(deltas):
 
         if turn_weight>0.0:
-            mybest6 = getpokerval(mycards + commoncards + [potentialfirstcard],pokerval_db)
-            hisbest6 = max([getpokerval(hiscards + commoncards + [potentialfirstcard],pokerval_db) for hiscards in enemiescards])
-    
-            if mybest6 > hisbest6:
-                winner6 = 1.
-            elif mybest6 < hisbest6:
-                winner6 = 0.
-            else:
-                winner6 = .5
-            #print "potentials: %s %d\nme  %s\nhim %s"%(str((potentialfirstcard,None)), winner6, getbesthand(allmycards),getbesthand(allhiscards))
-            winsatturn += winner6
+            winsatturn += _showdown(state_pokerval,mystate,hisstates,firstdelta)
         total_turn_cnt += 1
 
-        for (j,potentialsecondcard) in enumerate(deck[i+1:]):
-            #print len(deck), len(deck[i+1:])
-            mybest = getpokerval(mycards + commoncards + [potentialfirstcard,potentialsecondcard],pokerval_db)
-            theirbest = max([getpokerval(hiscards + commoncards + [potentialfirstcard,potentialsecondcard],pokerval_db) for hiscards in enemiescards])
-
-            if mybest > theirbest:
-                winner = 1.
-            elif mybest < theirbest:
-                winner = 0.
-            else:
-                winner = .5
-
-            #print "potentials: %s %d\nme  %s\nhim %s"%(str((potentialfirstcard,potentialsecondcard)), winner, getbesthand(allmycards),getbesthand(allhiscards))
-            winsatriver += winner
+        my6 = mystate+firstdelta
+        his6 = [hisstate+firstdelta for hisstate in hisstates]
+        for seconddelta in deltas[i+1:]:
+            winsatriver += _showdown(state_pokerval,my6,his6,seconddelta)
             total_cnt += 1
 
     winpct = (float(winsatturn)/total_turn_cnt)*turn_weight + (float(winsatriver)/total_cnt*(1.0-turn_weight))
     #print "winpct: on turn %f, on river %f, blended %f"%(float(winsatturn)/total_turn_cnt,float(winsatriver)/total_cnt,winpct)
     weightedcomparehands_cache[weightedcomparehands_cache_index] = winpct
+    if equity_store is not None:
+        equity_store.put(situation,turn_weight,winpct)
     return winpct
 
+def _sample_weightedcomparehands(mycards,enemiescards,commoncards,turn_weight,
+                                 samples,target_stderr,seed,variance_reduction,confidence):
+    """ The sampled version of weightedcomparehands: each sample is a turn
+    and river, scored as turn_weight * (result on the turn) + (1-turn_weight)
+    * (result on the river), whose mean is the blend weightedcomparehands
+    computes exactly. """
+    deck = CardSet.deck(mycards,commoncards,*enemiescards)
+    board = handstate.add_cards(handstate.EMPTY,commoncards)
+    mystate = handstate.add_cards(board,mycards)
+    hisstates = [handstate.add_cards(board,hiscards) for hiscards in enemiescards]
+    state_pokerval = handstate.state_pokerval
+    deltas = [handstate.INDEX_DELTA[i] for i in deck.indices()]
+    def trial(runout):
+        (turn,river) = runout
+        result = (1.0-turn_weight)*_showdown(state_pokerval,mystate,hisstates,turn+river)
+        if turn_weight>0.0:
+            result += turn_weight*_showdown(state_pokerval,mystate,hisstates,turn)
+        return result
+    return montecarlo.sample_equity(trial,deltas,2,samples,target_stderr,seed,variance_reduction,confidence)
+
+class AnytimeEquity:
+    """ The equity of mycards vs. enemiescards, refined for as long as the
+    caller can wait.  The runouts are evaluated in a random order (see
+    montecarlo.AnytimeSampler), so the estimate is unbiased whenever it's
+    read, and exact once they're all done.  On a flop the result blends
+    the turn and the river by turn_weight, as weightedcomparehands does
+    (comparehands' default); otherwise it is comparehands' equity.
+
+        anytime = AnytimeEquity(mycards,enemiescards,commoncards)
+        estimate = anytime.refine(time.time()+0.2,target_stderr=0.01)
+        if estimate.status == WAIT: ...     # not precise enough yet; call
+                                            # refine again next cycle
+    """
+
+    def __init__(self,mycards,enemiescards,commoncards,turn_weight=0.75,seed=None):
+        mycards = as_cards(mycards)
+        commoncards = as_cards(commoncards)
+        enemiescards = _enemy_hands(enemiescards)
+        if len(commoncards) > 5:
+            raise ValueError("too many common cards: %s"%format_cards(commoncards))
+        deck = CardSet.deck(mycards,commoncards,*enemiescards)
+        board = handstate.add_cards(handstate.EMPTY,commoncards)
+        mystate = handstate.add_cards(board,mycards)
+        hisstates = [handstate.add_cards(board,hiscards) for hiscards in enemiescards]
+        state_pokerval = handstate.state_pokerval
+        deltas = [handstate.INDEX_DELTA[i] for i in deck.indices()]
+        if len(commoncards) == 3:
+            def trial(runout):
+                # a (turn,river) pair in either order stands for both turns
+                (first,second) = runout
+                result = (1.0-turn_weight)*_showdown(state_pokerval,mystate,hisstates,first+second)
+                if turn_weight > 0.0:
+                    result += turn_weight*(_showdown(state_pokerval,mystate,hisstates,first) +
+                                           _showdown(state_pokerval,mystate,hisstates,second))/2
+                return result
+        else:
+            trial = lambda runout: _showdown(state_pokerval,mystate,hisstates,sum(runout))
+        self.sampler = montecarlo.AnytimeSampler(trial,deltas,5-len(commoncards),seed)
+
+    def refine(self,deadline=None,target_stderr=None,confidence=0.95):
+        """ Work until time.time() reaches deadline (or the standard error
+        is down to target_stderr, or every runout is done), then return the
+        montecarlo.EquityEstimate so far.  Its status is WAIT if
+        target_stderr was asked for and not reached, else None. """
+        sampler = self.sampler
+        if target_stderr is None:
+            sampler.run(deadline)
+        else:
+            # look at the error every few hundred runouts
+            while not sampler.done() and (deadline is None or time.time() < deadline):
+                sampler.run(deadline,samples=montecarlo.MIN_SAMPLES)
+                if sampler.estimate(confidence).stderr <= target_stderr:
+                    break
+        estimate = sampler.estimate(confidence)
+        if target_stderr is not None and estimate.stderr > target_stderr:
+            estimate.status = WAIT
+        else:
+            estimate.status = None
+        return estimate
+
+def anytime_equity(mycards,enemiescards,commoncards,timeout,target_stderr=None,
+                   turn_weight=0.75,seed=None,confidence=0.95):
+    """ The best equity estimate (a montecarlo.EquityEstimate, with a status
+    of WAIT if target_stderr isn't met yet) that timeout seconds allow; see
+    AnytimeEquity to carry on refining it later. """
+    anytime = AnytimeEquity(mycards,enemiescards,commoncards,turn_weight,seed)
+    return anytime.refine(time.time()+timeout,target_stderr,confidence)
+
 def prbeat(enemy_pokerval, hand):
     """ Calculate the odds that, given your current 'hand', you'll beat
     a given pokerval.
 
-    'hand' is a list of 2-tuples (rank,suit)
+    'hand' is a list of 2-tuples (rank,suit), or a CardSet
 
     """
+    hand = as_cards(hand)
     print "poker.prbeat: me: %s vs. %s"%(str(hand),format_pokerval(enemy_pokerval))
     if len(hand)<5:
         print """I can do this, but I don't think you want me to.
@@ -681,18 +872,12 @@ It'll take forever.  If you do, though, just remove this
 return below.  There's 18424 possibilities just for 4 cards..."""
         return None
 
-    # make deck
-    deck = []
-    for val in range(14,1,-1):
-        for suit in range(1,5):
-            if (val, suit) not in hand:
-                deck.append((val,suit))
+    deck = CardSet.deck(hand).cards()
 
     winner_cnt = 0
     total_cnt = 0
     for extra_cards in xuniqueCombinations(deck,7-len(hand)):
-        possiblecards = copy.copy(hand)
-        possiblecards.extend(extra_cards)
+        possiblecards = hand + extra_cards
         #print hand,extra_cards,possiblecards
         #print enemy_pokerval, possiblehand.getbesthand().pokerval
         if isbetterhand(possiblecards,enemy_pokerval):
@@ -825,6 +1010,48 @@ class Test_getpokerval(unittest.TestCase):
         self.assertEqual(getpokerval([(14,1),(2,2),(3,3),(4,4),(5,1),(8,2),(7,1)]),STRAIGHT + 0x54321)
         self.assertEqual(getpokerval([(14,1),(2,2),(3,3),(5,4),(5,1),(6,2),(7,1)]),ONEPAIR + 0x55e76)
 
+class Test_handstate(unittest.TestCase):
+
+    def test_incremental(self):
+        board = handstate.add_cards(handstate.EMPTY,cvt_to_cards(["Kd","7d","2d"]))
+        mine = handstate.add_cards(board,cvt_to_cards(["Ad","Kc"]))
+        self.assertEqual(handstate.state_pokerval(mine),ONEPAIR + 0xdde72)
+        turn = handstate.add_card(mine,(13,3))
+        self.assertEqual(handstate.state_pokerval(turn),THREEOFAKIND + 0xddde7)
+        river = handstate.add_card(turn,(13,4))
+        self.assertEqual(handstate.state_pokerval(river),FOUROFAKIND + 0xdddde)
+
+    def test_matches_calculatinghand(self):
+        import random
+        deck = [(val,suit) for val in range(2,15) for suit in range(1,5)]
+        rand = random.Random(7)
+        for numcards in (5,6,7):
+            for i in range(200):
+                cards = rand.sample(deck,numcards)
+                best = max([CalculatingHand(five).getpokerval() for five in xuniqueCombinations(cards,5)])
+                self.assertEqual(handstate.pokerval(cards),best)
+
+    def test_hand_key(self):
+        import random
+        deck = [(val,suit) for val in range(2,15) for suit in range(1,5)]
+        rand = random.Random(11)
+        keys = {}
+        indexes = {}
+        for numcards in (5,6,7):
+            for i in range(3000):
+                cards = rand.sample(deck,numcards)
+                key = handstate.hand_key(cards)
+                index = make_stringindex(normalize_cards(cards))
+                # the key partitions hands exactly like the old string index
+                self.assertEqual(keys.setdefault(key,index),index)
+                self.assertEqual(indexes.setdefault(index,key),key)
+                representative = handstate.key_cards(key)
+                self.assertEqual(len(representative),numcards)
+                self.assertEqual(handstate.hand_key(representative),key)
+                self.assertEqual(handstate.pokerval(representative),handstate.pokerval(cards))
+        self.assertEqual(handstate.hand_key(cvt_to_cards(["As","Kd","7s","7h","2c"])),
+                         handstate.hand_key(cvt_to_cards(["Ah","Kc","7d","7s","2c"])))
+
 class Test_pokerModule(unittest.TestCase):
     def setUp(self):
         clear_pokerval_cache()
@@ -847,6 +1074,15 @@ class Test_pokerModule(unittest.TestCase):
         print weightedcomparehands([(12,1),(13,3)],[(3,1),(5,2)],[(3,2),(9,3),(12,2)])
         print "took %f seconds"%(time.clock()-start_time)
                     
+    def test_hand(self):
+        import random
+        deck = [(val,suit) for val in range(2,15) for suit in range(1,5)]
+        rand = random.Random(5)
+        for i in range(2000):
+            cards = rand.sample(deck,5)
+            self.assertEqual(Hand(cards).getpokerval(),CalculatingHand(cards).getpokerval())
+        self.assertEqual(getbesthand(cvt_to_cards(["As","Ks","Qs","Js","Ts","2c","3d"])).getpokerval(),STRAIGHTFLUSH + 0xedcba)
+
     def test_calchandint(self):
         self.assertEqual(calchandint([(5,2),(6,2),(7,2),(5,3),(2,2)]), 341951816)
 
@@ -903,6 +1139,107 @@ class Test_pokerModule(unittest.TestCase):
                 [(4, 2), (6, 3), (10, 1)]
                 ))
 
+    def test_cardsets(self):
+        mine = cvt_to_cards(["Td","8h"])
+        his = cvt_to_cards(["5c","7c"])
+        board = cvt_to_cards(["4d","6h","Tc"])
+        self.assertEqual(weightedcomparehands(CardSet(mine),CardSet(his),CardSet(board)),weightedcomparehands(mine,his,board))
+        self.assertEqual(comparehands(CardSet(mine),[CardSet(his)],board+["Ks"],True),comparehands(mine,[his],board+[(13,4)],True))
+        self.assertEqual(nhands(CardSet(mine),CardSet(board)),nhands(mine,board))
+        self.assertEqual(getpokerval(CardSet(mine+board)),getpokerval(mine+board))
+        # nhands against every opponent holding, the slow way
+        deck = [card for card in CardSet.deck(mine,board)]
+        expected = [0,0,0]
+        mybest = getpokerval(mine+board)
+        for theirs in xuniqueCombinations(deck,2):
+            oppbest = getpokerval(theirs+board)
+            expected[cmp(mybest,oppbest)+1] += 1
+        self.assertEqual(nhands(mine,board),(expected[0],expected[2],expected[1]))
+
+    def test_weightedcomparehands_cache(self):
+        first = weightedcomparehands(cvt_to_cards(["Td","8h"]),[cvt_to_cards(["5c","7c"])],cvt_to_cards(["4d","6h","Tc"]))
+        hits = cache_stats()['weightedcomparehands']['hits']
+        # the same spot with hearts and spades swapped, clubs and diamonds swapped, cards reordered
+        again = weightedcomparehands([[8,4],[10,1]],[["7d","5d"]],cvt_to_cards(["6s","4c","Td"]))
+        self.assertEqual(cache_stats()['weightedcomparehands']['hits'],hits+1)
+        self.assertEqual(again,first)
+        self.assertEqual(again,weightedcomparehands(cvt_to_cards(["Td","8h"]),[cvt_to_cards(["5c","7c"])],cvt_to_cards(["4d","6h","Tc"]),turn_weight=0.75))
+        self.assertNotEqual(weightedcomparehands(cvt_to_cards(["Td","8h"]),[cvt_to_cards(["5c","7c"])],cvt_to_cards(["4d","6h","Tc"]),turn_weight=0.5),first)
+
+    def test_equity_store(self):
+        import tempfile,os
+        filename = os.path.join(tempfile.mkdtemp(),"equities.eqs")
+        use_equity_store(filename)
+        try:
+            first = weightedcomparehands(cvt_to_cards(["Td","8h"]),[cvt_to_cards(["5c","7c"])],cvt_to_cards(["4d","6h","Tc"]))
+            clear_pokerval_cache()
+            # a fresh process: nothing in memory, but the store has it
+            use_equity_store(filename)
+            self.assertEqual(len(equity_store),1)
+            self.assertEqual(weightedcomparehands(cvt_to_cards(["Td","8h"]),[cvt_to_cards(["5c","7c"])],cvt_to_cards(["4d","6h","Tc"])),first)
+            self.assertEqual(equity_store.hits,1)
+        finally:
+            use_equity_store(None)
+
+    def test_sampling(self):
+        mine = cvt_to_cards(["Td","8h"])
+        his = [cvt_to_cards(["5c","7c"])]
+        board = cvt_to_cards(["4d","6h","Tc"])
+        exact = weightedcomparehands(mine,his,board)
+        for variance_reduction in (None,'antithetic','stratified'):
+            estimate = weightedcomparehands(mine,his,board,samples=3000,seed=3,variance_reduction=variance_reduction)
+            self.assertTrue(abs(estimate-exact) < 4*estimate.stderr,(variance_reduction,estimate,exact))
+            self.assertTrue(estimate.samples >= 3000)
+        turn = board+[(2,1)]
+        exact = comparehands(mine,his,turn)
+        estimate = comparehands(mine,his,turn,target_stderr=0.02,seed=4)
+        self.assertTrue(estimate.stderr <= 0.02 and abs(estimate-exact) < 4*estimate.stderr)
+        # preflop, where enumerating is far too slow
+        estimate = comparehands(cvt_to_cards(["As","Ah"]),[cvt_to_cards(["Kd","Kc"])],[],samples=2000,seed=5)
+        # (enumerating every board gives 0.812555)
+        self.assertTrue(abs(estimate-0.812555) < 4*estimate.stderr,estimate)
+        self.assertEqual(comparehands(mine,his,turn+[(2,2)],samples=10),comparehands(mine,his,turn+[(2,2)]))
+
+    def test_multiway(self):
+        hands = [["As","Ah"],["Kd","Kc"],["7s","2d"]]
+        board = ["Ac","Kh","2h","2s"]
+        result = multiway_equity(hands,board)
+        self.assertAlmostEqual(sum([seat[0] for seat in result]),1.0)
+        # heads up, seat 0's equity is comparehands
+        (mine,his) = multiway_equity(hands[:2],board)
+        self.assertAlmostEqual(mine[0],comparehands(hands[0],[hands[1]],board))
+        self.assertAlmostEqual(mine[1],his[3])
+        # a three-way chop on the river
+        chop = multiway_equity([["2c","3d"],["2d","3h"],["4c","5d"]],["As","Ks","Qs","Js","Ts"])
+        self.assertEqual(chop,[(1/3.,0.,1.,0.)]*3)
+        # 7 2 only wins with the last 2, for four of a kind
+        self.assertAlmostEqual(result[2][1],1/42.)
+        sampled = multiway_equity(hands,["Ac","Kh","2h"],samples=2000,seed=4)
+        exact = multiway_equity(hands,["Ac","Kh","2h"])
+        for (estimate,seat) in zip(sampled,exact):
+            self.assertTrue(abs(estimate[0]-seat[0]) < 4*estimate[0].stderr+1e-9)
+        self.assertRaises(ValueError,multiway_equity,hands[:1],board)
+
+    def test_anytime(self):
+        mine = ["As","Ah"]
+        his = ["Kd","Kc"]
+        # runs to completion: exact
+        river = AnytimeEquity(mine,his,["2c","7d","9h","Ts"])
+        estimate = river.refine(time.time()+10)
+        self.assertAlmostEqual(estimate,comparehands(mine,his,["2c","7d","9h","Ts"]))
+        self.assertEqual((estimate.stderr,estimate.status),(0.0,None))
+        flop = AnytimeEquity(mine,his,["2c","7d","9h"],seed=3)
+        estimate = flop.refine(time.time()+10)
+        self.assertAlmostEqual(estimate,weightedcomparehands(mine,his,["2c","7d","9h"]))
+        # preflop can't finish in time; a tiny target error can't be met
+        estimate = anytime_equity(mine,his,[],0.05,target_stderr=1e-6,seed=4)
+        self.assertEqual(estimate.status,WAIT)
+        self.assertTrue(0 < estimate.samples < 1712304)
+        self.assertTrue(estimate.low < 0.812555 < estimate.high or abs(estimate-0.812555) < 5*estimate.stderr)
+        estimate = anytime_equity(mine,his,[],5,target_stderr=0.02,seed=4)
+        self.assertEqual(estimate.status,None)
+        self.assertTrue(estimate.stderr <= 0.02)
+
     def test_pocket(self):
         p1 = Pocket((5,1),(7,2))
         p2 = Pocket((7,2),(5,1))
@@ -934,7 +1271,17 @@ class Test_pokerModule(unittest.TestCase):
         if p3 == "Kxo": print "fail16"
         if p1 == "Kx": print "fail17"
         if p3 != "Kx": print "fail18"
-    
+
+        self.assertEqual(p1.id,p2.id)
+        self.assertTrue(pocket(p3.cards) is POCKETS[p3.id])
+        self.assertEqual(p3,"TT+, KQs, A5s-A2s")
+        self.assertNotEqual(p1,"TT+, KQs, A5s-A2s")
+        self.assertEqual(p1,"77-55, 7x")
+        self.assertEqual(p1,"7d5c")
+        self.assertTrue(p3 in range_pockets("KQs"))
+        self.assertEqual(len(range_pockets("AKs, QQ+")),22)
+        self.assertEqual(len(set(POCKETS)),NUM_COMBOS)
+
         print "tests complete"
     
 if __name__ == "__main__":
@@ -155,10 +155,14 @@ def unittest_rotate_to_start_with():
     print rotated
     assert(rotated==[4,6,7,8,1])
 
-def format_handtype(handtype):
+def format_handtype(handtype,rank_class=False):
+    """ Prettyprint a handtype or pokerval.  Pass rank_class=True if it is a
+    rank class (see handeval.POKERVALS) rather than a pokerval. """
     s=''
     if handtype is None:
         return "None"
+    if rank_class:
+        handtype = _rank_class_to_pokerval(handtype)
     if type(handtype) is str:
         s+=' preset_to=%s'%handtype
     elif type(handtype) is list or type(handtype) is tuple:
@@ -187,8 +191,12 @@ def format_handtype(handtype):
         if TOPKICKER & handtype: s+=', %s kicker'%cvt_to_rankstring(TOPKICKER & handtype)
     return s[1:]
 
-def format_pokerval(pokerval):
+def format_pokerval(pokerval,rank_class=False):
+    """ Prettyprint a pokerval.  Pass rank_class=True if it is a rank class
+    (see handeval.POKERVALS) rather than a pokerval. """
     s=''
+    if rank_class:
+        pokerval = _rank_class_to_pokerval(pokerval)
     for bit in (31,30,29,28,27,26,25,24):
         s += str(int(pokerval & (2**bit)>0))
     s+=' '+hex(0x000FFFFF&pokerval)
@@ -203,6 +211,10 @@ def format_pokerval(pokerval):
 
     return s
 
+def _rank_class_to_pokerval(rank_class):
+    import handeval
+    return handeval.POKERVALS[rank_class]
+
 def cvt_to_rank(i):
     """ Convert a thing to a rank, int from 2-14. """
     if type(i) is int:
@@ -303,17 +315,7 @@ def cvt_to_cards(cardstrings):
 
     return cards
 
-try:
-	import probstat
-	xuniqueCombinations = probstat.Combination
-except:
-    def xuniqueCombinations(items, n): 
-        if n==0:
-            yield []
-        else:
-            for i in xrange(len(items)-n+1):
-                for cc in xuniqueCombinations(items[i+1:],n-1):
-                    yield [items[i]]+cc
+from combinatorics import xuniqueCombinations
 
 if __name__=='__main__':
     unittest_rotate_to_start_with()
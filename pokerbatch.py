@@ -0,0 +1,178 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+pokerbatch.py
+    Evaluate whole arrays of hands at once with numpy.  Hands are (N, k)
+    integer arrays of card codes, k = 5, 6 or 7, where a card's code is
+    pokertable.card_index(card): 0 for 2c, 1 for 2d, ... 51 for As.
+
+    getpokerval_batch gathers the values from the flat pokervals?.tbl table
+    when it has been generated, and otherwise computes them from the
+    handstate tables; both are a handful of vectorized array operations, with
+    no Python loop over the hands.
+
+    This module needs numpy; poker.py imports it only if numpy is installed.
+"""
+
+import numpy
+import handstate,handeval,pokertable,combinatorics
+from poker_globals import *
+
+_CHOOSE = numpy.array([row[:8] for row in combinatorics.CHOOSE[:52]],dtype=numpy.int64)
+_RANK_KEY = numpy.array([5**rank for rank in range(13)],dtype=numpy.int64)
+_RANK_BIT = numpy.array([1<<rank for rank in range(13)],dtype=numpy.int64)
+_POKERVALS = numpy.array(handeval.POKERVALS,dtype=numpy.uint32)
+
+_tables = {}
+_state_tables = None
+
+def cards_to_array(hands):
+    """ Convert a list of hands, each a list of (rank,suit) cards, into an
+    (N, k) array of card codes. """
+    return numpy.array([[pokertable.card_index(card) for card in hand] for hand in hands],dtype=numpy.intp)
+
+def _table_values(numcards):
+    """ The numcards-card flat table as a numpy array over the mmap (no copy),
+    and whether it holds rank classes; or (None,None) if there's no table. """
+    if numcards not in _tables:
+        table = pokertable.open_table(numcards)
+        if table is None:
+            _tables[numcards] = (None,None,None)
+        else:
+            dtype = {2:'<u2',4:'<u4'}[table.itemsize]
+            values = numpy.frombuffer(table.mm,dtype=dtype,count=table.count,offset=pokertable.HEADER_SIZE)
+            # keep the table object alive as long as the array over its mmap
+            _tables[numcards] = (table,values,table.translate is not None)
+    return _tables[numcards][1:]
+
+def _handstate_tables():
+    global _state_tables
+    if _state_tables is None:
+        if handstate.NONFLUSH is None:
+            handstate.build_tables()
+        keys = numpy.array(sorted(handstate.NONFLUSH.keys()),dtype=numpy.int64)
+        values = numpy.array([handstate.NONFLUSH[key] for key in keys],dtype=numpy.uint32)
+        flush = numpy.array(handstate.FLUSH,dtype=numpy.uint32)
+        _state_tables = (keys,values,flush)
+    return _state_tables
+
+def colex_ranks(cards):
+    """ The colex rank of each row of an (N, k) card array. """
+    cards = numpy.sort(cards,axis=1)
+    ranks = numpy.zeros(cards.shape[0],dtype=numpy.int64)
+    for i in range(cards.shape[1]):
+        ranks += _CHOOSE[cards[:,i],i+1]
+    return ranks
+
+def _computed_pokervals(cards):
+    (keys,values,flush) = _handstate_tables()
+    ranks = cards >> 2
+    suits = cards & 3
+    pokervals = values[numpy.searchsorted(keys,_RANK_KEY[ranks].sum(axis=1))]
+    rankbits = _RANK_BIT[ranks]
+    for suit in range(4):
+        insuit = (suits == suit)
+        flushed = insuit.sum(axis=1) >= 5
+        if flushed.any():
+            masks = numpy.where(insuit[flushed],rankbits[flushed],0).sum(axis=1)
+            pokervals[flushed] = flush[masks]
+    return pokervals
+
+def getpokerval_batch(cards,rank_classes=False):
+    """ The pokervals of every row of an (N, k) array of card codes, k = 5, 6
+    or 7, as an (N,) uint32 array.  With rank_classes, return the (N,) uint16
+    rank classes instead (see handeval.POKERVALS), which compare the same way
+    and take half the memory.
+
+    >>> getpokerval_batch(cards_to_array([[(14,1),(2,1),(3,1),(4,1),(5,1),(8,1),(10,2)]]))[0] == STRAIGHTFLUSH + 0x54321
+    True
+    """
+    cards = numpy.asarray(cards,dtype=numpy.intp)
+    if cards.ndim != 2 or cards.shape[1] not in (5,6,7):
+        raise ValueError("expected an (N, 5), (N, 6) or (N, 7) array of cards, not %s"%(cards.shape,))
+    (values,stores_rank_classes) = _table_values(cards.shape[1])
+    if values is not None:
+        stored = values[colex_ranks(cards)]
+        if stores_rank_classes:
+            if rank_classes:
+                return stored
+            return _POKERVALS[stored]
+        pokervals = stored
+    else:
+        pokervals = _computed_pokervals(cards)
+    if rank_classes:
+        return numpy.searchsorted(_POKERVALS,pokervals).astype(numpy.uint16)
+    return pokervals
+
+def showdown_counts(values,reference):
+    """ How many of values beat, tie and lose to reference, where either can
+    be a single value or an array (they are broadcast against each other).
+    Returns (wins, ties, losses). """
+    values = numpy.asarray(values,dtype=numpy.int64)
+    reference = numpy.asarray(reference,dtype=numpy.int64)
+    wins = int((values > reference).sum())
+    ties = int((values == reference).sum())
+    return (wins,ties,numpy.broadcast(values,reference).size-wins-ties)
+
+def hands_with_board(holes,board):
+    """ Append the same board cards to every row of a hole card array. """
+    holes = numpy.asarray(holes,dtype=numpy.intp)
+    board = numpy.asarray(board,dtype=numpy.intp).reshape(1,-1)
+    return numpy.hstack([holes,numpy.repeat(board,holes.shape[0],axis=0)])
+
+def live_holes(dead):
+    """ Every 2-card holding that doesn't use any of the dead card codes, as
+    an (N, 2) array. """
+    live = numpy.setdiff1d(numpy.arange(52),numpy.asarray(list(dead),dtype=numpy.intp))
+    first,second = numpy.triu_indices(len(live),1)
+    return numpy.column_stack([live[first],live[second]])
+
+def nhands_batch(mycards,commoncards):
+    """ poker.nhands, computed with one batch evaluation of every opponent
+    holding: (nhandshi, nhandslo, nhandsti). """
+    mine = [pokertable.card_index(card) for card in mycards]
+    board = [pokertable.card_index(card) for card in commoncards]
+    mybest = getpokerval_batch(numpy.array([mine+board]))[0]
+    theirs = getpokerval_batch(hands_with_board(live_holes(mine+board),board))
+    (hi,ti,lo) = showdown_counts(theirs,mybest)
+    return (hi,lo,ti)
+
+import unittest
+
+class Test_pokerbatch(unittest.TestCase):
+
+    def test_matches_handstate(self):
+        import random
+        rand = random.Random(3)
+        for numcards in (5,6,7):
+            hands = [rand.sample(range(52),numcards) for i in range(3000)]
+            expected = [handstate.pokerval([pokertable.index_card(c) for c in hand]) for hand in hands]
+            self.assertEqual(list(getpokerval_batch(hands)),expected)
+            self.assertEqual(list(_computed_pokervals(numpy.array(hands))),expected)
+            classes = getpokerval_batch(hands,rank_classes=True)
+            self.assertEqual(list(_POKERVALS[classes]),expected)
+
+    def test_nhands(self):
+        import poker
+        mycards = [(14,4),(13,1)]
+        commoncards = [(13,2),(7,4),(2,1)]
+        self.assertEqual(nhands_batch(mycards,commoncards),poker.nhands(mycards,commoncards))
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+    unittest.main()
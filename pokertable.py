@@ -0,0 +1,485 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+pokertable.py
+    Flat, memory-mapped pokerval tables.  A table holds one pokerval for every
+    possible n-card hand, stored as a dense array indexed by the colex rank
+    (see combinatorics.py) of the hand's card indices, so a lookup is one
+    integer index into a page-cached buffer -- no hashing, no pickles, no
+    string keys.
+
+    File layout (all little-endian):
+
+        32 byte header: magic, version, numcards, itemsize, flags, count, crc32
+        count * itemsize bytes of pokervals, ordered by colex rank
+
+    A table written with TABLE_FLAG_RANK_CLASS stores 16-bit rank classes (see
+    handeval.POKERVALS) instead of 32-bit pokervals, halving its size.  lookup()
+    translates them back, so callers see pokervals either way.
+"""
+
+import os,mmap,struct,zlib,array,logging,heapq,itertools
+import handeval
+from combinatorics import CHOOSE
+
+log = logging.getLogger("poker.pokertable")
+
+TABLE_MAGIC = 'THEBOTPV'
+TABLE_VERSION = 1
+HEADER = struct.Struct('<8sHHHHQI4x')
+HEADER_SIZE = HEADER.size
+
+TABLE_FLAG_RANK_CLASS = 1
+
+def table_filename(numcards):
+    """ The filename database_generator.py writes the numcards-card table to. """
+    return "pokervals%d.tbl"%numcards
+
+def card_index(card):
+    """ Map a (rank,suit) card to 0..51, in the same order as the decks built
+    all over poker.py (2c=0, 2d=1, ... As=51).  A suit of 0 is treated like
+    suit 4, just as normalize_suits does. """
+    return ((card[0]-2)<<2) | ((card[1]-1)&3)
+
+def index_card(index):
+    """ Inverse of card_index. """
+    return ((index>>2)+2,(index&3)+1)
+
+class TableError(Exception):
+    pass
+
+class TableWriter:
+    """ Sequentially writes a flat table: call append() with every pokerval
+    in colex rank order, then close().  The header is rewritten on close with
+    the final count and checksum. """
+
+    def __init__(self,filename,numcards,itemsize=4,flags=0,buffersize=1<<20):
+        self.filename = filename
+        self.numcards = numcards
+        self.itemsize = itemsize
+        self.flags = flags
+        self.typecode = _typecode(itemsize)
+        self.buffersize = buffersize
+        self.count = 0
+        self.crc = 0
+        self.buffer = array.array(self.typecode)
+        self.f = open(filename+".tmp",'wb')
+        self.f.write(HEADER.pack(TABLE_MAGIC,TABLE_VERSION,numcards,itemsize,flags,0,0))
+
+    def append(self,value):
+        self.buffer.append(value)
+        if len(self.buffer) >= self.buffersize:
+            self.flush()
+
+    def extend(self,values):
+        self.buffer.extend(values)
+        if len(self.buffer) >= self.buffersize:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer)==0:
+            return
+        if _byteswap_needed:
+            self.buffer.byteswap()
+        data = self.buffer.tostring()
+        self.crc = zlib.crc32(data,self.crc)
+        self.f.write(data)
+        self.count += len(self.buffer)
+        self.buffer = array.array(self.typecode)
+
+    def close(self):
+        """ Finish the file and move it into place.  Until close() succeeds
+        the table only exists as filename+'.tmp', so a killed run never
+        leaves a truncated table where readers will find it. """
+        self.flush()
+        expected = CHOOSE[52][self.numcards]
+        if self.count != expected:
+            self.f.close()
+            raise TableError("%s: wrote %d entries, expected %d"%(self.filename,self.count,expected))
+        self.f.seek(0)
+        self.f.write(HEADER.pack(TABLE_MAGIC,TABLE_VERSION,self.numcards,self.itemsize,self.flags,self.count,self.crc & 0xffffffff))
+        self.f.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(self.filename+".tmp",self.filename)
+
+RECORD_MAGIC = 'THEBOTRC'
+# version 1 record files were keyed by make_stringindex strings
+RECORD_VERSION = 2
+RECORD = struct.Struct('<QI')
+
+class RecordWriter:
+    """ Writes a keyed pokerval file: 12 byte (key, pokerval) records, sorted
+    by key, behind the same 32 byte header as a flat table (the itemsize
+    field holds the record size).  The keys are the canonical integer hand
+    keys of handstate.state_key, the same keys getpokerval caches by, so a
+    RecordTable can be passed to getpokerval as its pokerval_db.
+
+    Records are collected with add() in any order.  Every runsize of them
+    are sorted and written out as a run file next to the output, so memory
+    stays bounded however big the file gets, and close() merges the runs in
+    one sequential pass; the file is byte-for-byte deterministic.
+
+    checkpoint(done) writes out the records so far and remembers done (how
+    far the caller has got, in whatever units it likes) in filename+'.ckpt'.
+    A writer opened on the same filename after a killed run picks up the
+    checkpointed runs, and its done attribute tells the caller where to
+    resume; records added after the last checkpoint are lost. """
+
+    def __init__(self,filename,numcards,runsize=1<<20):
+        self.filename = filename
+        self.numcards = numcards
+        self.runsize = runsize
+        self.record = RECORD
+        self.records = []
+        (self.runs,self.count,self.done) = self._read_checkpoint()
+        # throw away runs written after the last checkpoint
+        run = self.runs
+        while os.path.exists(self._run_filename(run)):
+            os.remove(self._run_filename(run))
+            run += 1
+
+    def _run_filename(self,run):
+        return "%s.run%04d"%(self.filename,run)
+
+    def _read_checkpoint(self):
+        try:
+            f = open(self.filename+".ckpt")
+            try:
+                (numcards,runs,count,done) = [int(x) for x in f.read().split()]
+            finally:
+                f.close()
+        except (IOError,ValueError):
+            return (0,0,0)
+        if numcards != self.numcards:
+            return (0,0,0)
+        return (runs,count,done)
+
+    def add(self,key,value):
+        self.records.append((key,value))
+        if len(self.records) >= self.runsize:
+            self._write_run()
+
+    def __len__(self):
+        return self.count + len(self.records)
+
+    def _write_run(self):
+        if not self.records:
+            return
+        self.records.sort()
+        pack = self.record.pack
+        f = open(self._run_filename(self.runs),'wb')
+        f.write("".join([pack(key,value) for (key,value) in self.records]))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        self.runs += 1
+        self.count += len(self.records)
+        self.records = []
+
+    def checkpoint(self,done):
+        self._write_run()
+        self.done = done
+        f = open(self.filename+".ckpt.tmp",'w')
+        f.write("%d %d %d %d"%(self.numcards,self.runs,self.count,self.done))
+        f.close()
+        if os.path.exists(self.filename+".ckpt"):
+            os.remove(self.filename+".ckpt")
+        os.rename(self.filename+".ckpt.tmp",self.filename+".ckpt")
+
+    def _read_run(self,run):
+        """ Yield the records of a run file, reading it in large chunks. """
+        size = self.record.size
+        unpack_from = self.record.unpack_from
+        f = open(self._run_filename(run),'rb')
+        try:
+            while True:
+                data = f.read(size<<16)
+                if not data:
+                    break
+                for offset in xrange(0,len(data),size):
+                    yield unpack_from(data,offset)
+        finally:
+            f.close()
+
+    def close(self):
+        """ Merge the runs into the file and move it into place, then delete
+        the runs and the checkpoint. """
+        self._write_run()
+        pack = self.record.pack
+        crc = 0
+        f = open(self.filename+".tmp",'wb')
+        f.write(HEADER.pack(RECORD_MAGIC,RECORD_VERSION,self.numcards,self.record.size,0,0,0))
+        merged = heapq.merge(*[self._read_run(run) for run in range(self.runs)])
+        while True:
+            data = "".join([pack(key,value) for (key,value) in itertools.islice(merged,1<<16)])
+            if not data:
+                break
+            crc = zlib.crc32(data,crc)
+            f.write(data)
+        f.seek(0)
+        f.write(HEADER.pack(RECORD_MAGIC,RECORD_VERSION,self.numcards,self.record.size,0,self.count,crc & 0xffffffff))
+        f.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(self.filename+".tmp",self.filename)
+        for run in range(self.runs):
+            os.remove(self._run_filename(run))
+        if os.path.exists(self.filename+".ckpt"):
+            os.remove(self.filename+".ckpt")
+
+class RecordTable:
+    """ A read-only, memory-mapped keyed pokerval file written by
+    RecordWriter.  table[key] binary-searches the sorted records. """
+
+    def __init__(self,filename):
+        self.filename = filename
+        self.f = open(filename,'rb')
+        try:
+            self.mm = mmap.mmap(self.f.fileno(),0,access=mmap.ACCESS_READ)
+        except:
+            self.f.close()
+            raise
+        (magic,version,self.numcards,self.recordsize,flags,self.count,self.checksum) = HEADER.unpack_from(self.mm,0)
+        if magic != RECORD_MAGIC or version != RECORD_VERSION or len(self.mm) != HEADER_SIZE + self.count*self.recordsize:
+            self.close()
+            raise TableError("%s is not a version %d pokerval record file"%(filename,RECORD_VERSION))
+        self._unpack_from = RECORD.unpack_from
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self,key):
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo+hi)//2
+            (midkey,value) = self._unpack_from(self.mm,HEADER_SIZE+mid*self.recordsize)
+            if midkey < key:
+                lo = mid+1
+            elif midkey > key:
+                hi = mid
+            else:
+                return value
+        raise KeyError(key)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.f.close()
+
+class PokervalTable:
+    """ A read-only, memory-mapped flat table of n-card pokervals.  Several
+    processes opening the same file share one copy in the page cache. """
+
+    def __init__(self,filename):
+        self.filename = filename
+        self.f = open(filename,'rb')
+        try:
+            self.mm = mmap.mmap(self.f.fileno(),0,access=mmap.ACCESS_READ)
+        except:
+            self.f.close()
+            raise
+        (magic,version,self.numcards,self.itemsize,self.flags,self.count,self.checksum) = HEADER.unpack_from(self.mm,0)
+        if magic != TABLE_MAGIC:
+            self.close()
+            raise TableError("%s is not a pokerval table"%filename)
+        if version != TABLE_VERSION:
+            self.close()
+            raise TableError("%s is table version %d, this code reads version %d"%(filename,version,TABLE_VERSION))
+        if self.count != CHOOSE[52][self.numcards] or len(self.mm) != HEADER_SIZE + self.count*self.itemsize:
+            self.close()
+            raise TableError("%s is truncated or corrupt"%filename)
+        self._unpack_from = struct.Struct('<'+_typecode(self.itemsize)).unpack_from
+        if self.flags & TABLE_FLAG_RANK_CLASS:
+            self.translate = handeval.POKERVALS
+        else:
+            self.translate = None
+
+    def verify(self):
+        """ Recompute the payload checksum and compare it with the header's. """
+        crc = 0
+        chunk = 1<<24
+        for offset in xrange(HEADER_SIZE,len(self.mm),chunk):
+            crc = zlib.crc32(self.mm[offset:offset+chunk],crc)
+        return (crc & 0xffffffff) == self.checksum
+
+    def __len__(self):
+        return self.count
+
+    def values(self):
+        """ A copy of the whole table, as stored (pokervals or rank classes),
+        in an array.array indexed by colex rank. """
+        values = array.array(_typecode(self.itemsize))
+        values.fromstring(self.mm[HEADER_SIZE:])
+        if _byteswap_needed:
+            values.byteswap()
+        return values
+
+    def __getitem__(self,rank):
+        """ The pokerval of the hand with the given colex rank. """
+        value = self._unpack_from(self.mm,HEADER_SIZE+rank*self.itemsize)[0]
+        if self.translate is not None:
+            return self.translate[value]
+        return value
+
+    def rank_class(self,rank):
+        """ The rank class of the hand with the given colex rank. """
+        value = self._unpack_from(self.mm,HEADER_SIZE+rank*self.itemsize)[0]
+        if self.translate is None:
+            return handeval.RANK_CLASS[value]
+        return value
+
+    def lookup(self,cards):
+        """ The pokerval of a list of (rank,suit) cards. """
+        rank = 0
+        k = 1
+        for c in sorted([((card[0]-2)<<2) | ((card[1]-1)&3) for card in cards]):
+            rank += CHOOSE[c][k]
+            k += 1
+        value = self._unpack_from(self.mm,HEADER_SIZE+rank*self.itemsize)[0]
+        if self.translate is not None:
+            return self.translate[value]
+        return value
+
+    def lookup_mask(self,mask):
+        """ The pokerval of a card-index bitmask, like CardSet.mask.  The set
+        bits come out lowest first, which is already colex order. """
+        rank = 0
+        k = 1
+        while mask:
+            low = mask & -mask
+            rank += CHOOSE[low.bit_length()-1][k]
+            k += 1
+            mask ^= low
+        value = self._unpack_from(self.mm,HEADER_SIZE+rank*self.itemsize)[0]
+        if self.translate is not None:
+            return self.translate[value]
+        return value
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.f.close()
+
+def open_table(numcards,filename=None):
+    """ Open the numcards-card table, or return None if it hasn't been
+    generated.  A table that exists but fails its header checks is logged
+    and ignored, so callers fall back to the shelve databases. """
+    if filename is None:
+        filename = table_filename(numcards)
+    if not os.path.exists(filename):
+        return None
+    try:
+        table = PokervalTable(filename)
+    except (TableError,IOError,ValueError),e:
+        log.error("ignoring pokerval table: %s"%e)
+        return None
+    if table.numcards != numcards:
+        log.error("ignoring pokerval table: %s holds %d-card hands, not %d"%(filename,table.numcards,numcards))
+        table.close()
+        return None
+    return table
+
+def _typecode(itemsize):
+    for typecode in ('H','I','L'):
+        if array.array(typecode).itemsize == itemsize:
+            return typecode
+    raise TableError("unsupported table item size: %d"%itemsize)
+
+_byteswap_needed = (struct.pack('=H',1) != struct.pack('<H',1))
+
+import unittest
+
+class Test_pokertable(unittest.TestCase):
+
+    def test_card_index(self):
+        self.assertEqual(card_index((2,1)),0)
+        self.assertEqual(card_index((14,4)),51)
+        self.assertEqual(card_index((8,0)),card_index((8,4)))
+        for i in range(52):
+            self.assertEqual(card_index(index_card(i)),i)
+
+    def test_roundtrip(self):
+        import tempfile
+        filename = os.path.join(tempfile.mkdtemp(),table_filename(1))
+        writer = TableWriter(filename,1,buffersize=10)
+        for i in range(52):
+            writer.append(i*1000)
+        writer.close()
+        table = open_table(1,filename)
+        self.assertTrue(table.verify())
+        self.assertEqual(table.lookup([(14,4)]),51000)
+        self.assertEqual(table[7],7000)
+        table.close()
+
+    def test_records(self):
+        import tempfile
+        filename = os.path.join(tempfile.mkdtemp(),"pokervals2.rec")
+        writer = RecordWriter(filename,2,runsize=3)
+        for (key,value) in ((1<<60,1),(300,2),(1<<32,3),(7,4)):
+            writer.add(key,value)
+        writer.close()
+        table = RecordTable(filename)
+        self.assertEqual([table[key] for key in (7,300,1<<32,1<<60)],[4,2,3,1])
+        self.assertRaises(KeyError,table.__getitem__,8)
+        table.close()
+        self.assertEqual(sorted(os.listdir(os.path.dirname(filename))),["pokervals2.rec"])
+
+    def test_records_resume(self):
+        import tempfile
+        records = [((i*7919) % 1000,i) for i in range(100)]
+        filename = os.path.join(tempfile.mkdtemp(),"pokervals2.rec")
+        writer = RecordWriter(filename,2,runsize=8)
+        for (key,value) in records[:50]:
+            writer.add(key,value)
+            if len(writer) % 20 == 0:
+                writer.checkpoint(len(writer))
+        # killed here: the 10 records since the checkpoint at 40 are lost
+        writer = RecordWriter(filename,2,runsize=8)
+        self.assertEqual((writer.done,len(writer)),(40,40))
+        for (key,value) in records[writer.done:]:
+            writer.add(key,value)
+        writer.close()
+        contents = open(filename,'rb').read()
+        writer = RecordWriter(filename,2,runsize=1000)
+        for (key,value) in records:
+            writer.add(key,value)
+        writer.close()
+        self.assertEqual(open(filename,'rb').read(),contents)
+        table = RecordTable(filename)
+        self.assertEqual(len(table),100)
+        self.assertEqual([table[key] for (key,value) in records],[value for (key,value) in records])
+        table.close()
+
+    def test_rank_classes(self):
+        import tempfile
+        filename = os.path.join(tempfile.mkdtemp(),table_filename(1))
+        writer = TableWriter(filename,1,itemsize=2,flags=TABLE_FLAG_RANK_CLASS)
+        for i in range(52):
+            writer.append(i*100)
+        writer.close()
+        table = open_table(1,filename)
+        self.assertEqual(os.path.getsize(filename),HEADER_SIZE+52*2)
+        self.assertEqual(table.lookup([(14,4)]),handeval.POKERVALS[5100])
+        self.assertEqual(table.rank_class(51),5100)
+        table.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,367 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+preflop.py
+    All-in preflop equities of the 169 starting hand classes (AA, AKs, AKo,
+    ... 22), against a random hand and against every other class, generated
+    once into preflop.tbl and then looked up in constant time:
+
+        preflop_equity("KQo")               # vs. a random hand
+        preflop_equity(Pocket((13,1),(12,2)),"77")
+
+    Equity is the share of the pot won, ties counting half.  Against a class,
+    it's the average over every pair of hero and villain holdings that don't
+    share a card; against a random hand, over every villain holding.
+
+    Generating the table means enumerating the 1,712,304 boards of every
+    distinct heads-up matchup.  Matchups that differ only by suits are the
+    same (cardset.situation_key), and so are a matchup and its mirror image,
+    which leaves about 47,000 of them, a bit over a second each.  generate_preflop_table spreads them over a pool of
+    processes and records each result in an equitystore file as it
+    finishes, so a killed run resumes where it stopped.  Pass samples to
+    estimate each matchup by Monte Carlo instead, for a quick approximate
+    table.
+
+    The table file has the pokertable header (magic THEBOTPF) and float32
+    payload: the 169 equities vs. a random hand, then the 169x169 matrix of
+    equities vs. each class, row = hero class.
+"""
+
+import os,time,array,itertools,zlib,logging
+import handstate,pokertable,equitystore,montecarlo
+from cardset import CardSet,as_cards,situation_key
+from poker_globals import *
+
+log = logging.getLogger("poker.preflop")
+
+PREFLOP_MAGIC = 'THEBOTPF'
+PREFLOP_VERSION = 1
+PREFLOP_FLAG_SAMPLED = 1
+PREFLOP_FILENAME = "preflop.tbl"
+NUM_CLASSES = 169
+
+# Classes are numbered like the usual 13x13 grid, aces first: row r and
+# column c (rank 14-r and 14-c) is a pair on the diagonal, suited above it
+# (high rank's row) and offsuit below.
+_RANKS = range(14,1,-1)
+
+def _class_of(high,low,suited):
+    (r,c) = (14-high,14-low)
+    if suited:
+        return r*13+c
+    return c*13+r
+
+def _make_names():
+    names = [None]*NUM_CLASSES
+    for high in _RANKS:
+        for low in _RANKS:
+            if low > high:
+                continue
+            name = cvt_to_rankstring(high)+cvt_to_rankstring(low)
+            if low == high:
+                names[_class_of(high,low,False)] = name
+            else:
+                names[_class_of(high,low,True)] = name+'s'
+                names[_class_of(high,low,False)] = name+'o'
+    return names
+
+CLASS_NAMES = _make_names()
+CLASS_INDEX = dict([(name,i) for (i,name) in enumerate(CLASS_NAMES)])
+
+def hand_class(cards):
+    """ The class (0..168) of two hole cards: a list of 2 cards, a CardSet
+    or a Pocket.
+
+    >>> CLASS_NAMES[hand_class(cvt_to_cards(["Qd","Ks"]))]
+    'KQo'
+    """
+    if hasattr(cards,'cards') and not isinstance(cards,CardSet):
+        cards = cards.cards     # a Pocket
+    ((r1,s1),(r2,s2)) = as_cards(cards)
+    return _class_of(max(r1,r2),min(r1,r2),s1==s2 and r1!=r2)
+
+def _classes(hand):
+    """ [(class, weight)] for a hand: one class for hole cards or a full
+    class name, or the suited and offsuit classes weighted by their number
+    of combinations for a name like "KQ". """
+    if type(hand) is str:
+        name = hand[0].upper()+hand[1].upper()+hand[2:].lower()
+        if name in CLASS_INDEX:
+            return [(CLASS_INDEX[name],1.0)]
+        if name+'s' in CLASS_INDEX:
+            return [(CLASS_INDEX[name+'s'],4.0),(CLASS_INDEX[name+'o'],12.0)]
+        raise ValueError("not a starting hand: %s"%hand)
+    return [(hand_class(hand),1.0)]
+
+def class_combos(index):
+    """ Every pair of hole cards in a class, as (card,card) tuples. """
+    name = CLASS_NAMES[index]
+    (high,low) = (cvt_to_rank(name[0]),cvt_to_rank(name[1]))
+    combos = []
+    for s1 in range(1,5):
+        for s2 in range(1,5):
+            if high == low and s2 <= s1:
+                continue
+            if high != low and (s1 == s2) != name.endswith('s'):
+                continue
+            combos.append(((high,s1),(low,s2)))
+    return combos
+
+class PreflopTable:
+    """ A loaded preflop.tbl. """
+
+    def __init__(self,filename=PREFLOP_FILENAME):
+        f = open(filename,'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        (magic,version,nclasses,itemsize,self.flags,count,checksum) = pokertable.HEADER.unpack_from(data,0)
+        payload = data[pokertable.HEADER_SIZE:]
+        if magic != PREFLOP_MAGIC or version != PREFLOP_VERSION or nclasses != NUM_CLASSES:
+            raise pokertable.TableError("%s is not a version %d preflop table"%(filename,PREFLOP_VERSION))
+        if count != NUM_CLASSES*(NUM_CLASSES+1) or len(payload) != count*itemsize or zlib.crc32(payload) & 0xffffffff != checksum:
+            raise pokertable.TableError("%s is truncated or corrupt"%filename)
+        values = array.array('f',payload)
+        if pokertable._byteswap_needed:
+            values.byteswap()
+        self.vs_random = values[:NUM_CLASSES]
+        self.vs_class = values[NUM_CLASSES:]
+
+    def equity(self,hero,villain=None):
+        """ hero's equity vs. villain (a hand or class name), or vs. a random
+        hand if villain is None. """
+        result = weights = 0.0
+        for (mine,myweight) in _classes(hero):
+            if villain is None:
+                result += myweight*self.vs_random[mine]
+                weights += myweight
+            else:
+                for (his,hisweight) in _classes(villain):
+                    result += myweight*hisweight*self.vs_class[mine*NUM_CLASSES+his]
+                    weights += myweight*hisweight
+        return result/weights
+
+_table = None
+
+def preflop_equity(hero,villain=None):
+    """ Look up the all-in equity of hero (a Pocket, two cards, or a name
+    like "KQo", "AA" or "KQ") vs. villain, or vs. a random hand.  Loads
+    preflop.tbl on first use. """
+    global _table
+    if _table is None:
+        _table = PreflopTable()
+    return _table.equity(hero,villain)
+
+def matchup_equity(hero,villain,samples=None,seed=None):
+    """ hero's all-in equity vs. villain over every board (or samples
+    random boards). """
+    mystate = handstate.add_cards(handstate.EMPTY,hero)
+    hisstate = handstate.add_cards(handstate.EMPTY,villain)
+    deltas = [handstate.INDEX_DELTA[i] for i in CardSet.deck(hero,villain).indices()]
+    state_pokerval = handstate.state_pokerval
+    if samples:
+        def trial(board):
+            board = sum(board)
+            mine = state_pokerval(mystate+board)
+            his = state_pokerval(hisstate+board)
+            return mine > his and 1. or mine == his and .5 or 0.
+        return float(montecarlo.sample_equity(trial,deltas,5,samples,seed=seed))
+
+    if handstate.NONFLUSH is None:
+        handstate.build_tables()
+    nonflush = handstate.NONFLUSH
+    flush_check = handstate.FLUSH_CHECK
+    shift = handstate.RANKKEY_SHIFT
+    halfpoints = boards = 0
+    n = len(deltas)
+    # five nested loops over the boards, each adding one card's delta; the
+    # common no-flush case is looked up inline
+    for a in xrange(n):
+        board1 = deltas[a]
+        for b in xrange(a+1,n):
+            board2 = board1+deltas[b]
+            for c in xrange(b+1,n):
+                board3 = board2+deltas[c]
+                for d in xrange(c+1,n):
+                    board4 = board3+deltas[d]
+                    for last in deltas[d+1:]:
+                        mine = mystate+board4+last
+                        his = hisstate+board4+last
+                        if (mine|his) & flush_check:
+                            mine = state_pokerval(mine)
+                            his = state_pokerval(his)
+                        else:
+                            mine = nonflush[mine >> shift]
+                            his = nonflush[his >> shift]
+                        if mine > his:
+                            halfpoints += 2
+                        elif mine == his:
+                            halfpoints += 1
+                    boards += n-d-1
+    return halfpoints/2./boards
+
+def _matchups(classes=None):
+    """ For each hero class (all of them, or those in classes): a
+    representative holding, and [(villain class, matchup key, flipped,
+    villain holding)] for every villain holding it doesn't collide with.
+    A matchup and its mirror image (villain vs. hero) share a key; flipped
+    says the key is the villain's side of it. """
+    if classes is None:
+        classes = range(NUM_CLASSES)
+    matchups = {}
+    for mine in classes:
+        hero = list(class_combos(mine)[0])
+        rows = []
+        for villain in itertools.combinations(CardSet.deck(hero).cards(),2):
+            villain = list(villain)
+            key = situation_key(hero,[villain],[])
+            mirror = situation_key(villain,[hero],[])
+            rows.append((hand_class(villain),min(key,mirror),mirror < key,villain))
+        matchups[mine] = (hero,rows)
+    return matchups
+
+def _matchup_job(job):
+    (key,hero,villain,samples) = job
+    return key,matchup_equity(hero,villain,samples,seed=key & 0xffffffff)
+
+def generate_preflop_table(filename=PREFLOP_FILENAME,processes=1,samples=None,classes=None):
+    """ Compute every distinct matchup (using processes worker processes)
+    and write the preflop table.  Finished matchups are kept in
+    filename+'.eqs', so an interrupted run picks up where it left off; it's
+    removed once the table is written.  With samples, each matchup is
+    estimated from that many random boards instead.  classes limits the hero
+    classes computed (for testing); the other rows are left at 0 and the
+    table isn't complete. """
+    fingerprint = zlib.crc32("preflop %d %s"%(equitystore.EVALUATOR_VERSION,samples)) & 0xffffffff
+    store = equitystore.EquityStore(filename+".eqs",fingerprint)
+    matchups = _matchups(classes)
+    jobs = {}
+    for (mine,(hero,rows)) in matchups.items():
+        for (his,key,flipped,villain) in rows:
+            if key not in jobs and store.get(key,0.0) is None:
+                if flipped:
+                    jobs[key] = (key,villain,hero,samples)
+                else:
+                    jobs[key] = (key,hero,villain,samples)
+    ndistinct = len(set([key for (hero,rows) in matchups.values() for (his,key,flipped,villain) in rows]))
+    print "%d distinct preflop matchups, %d left to compute." % (ndistinct, len(jobs))
+
+    if jobs:
+        if processes > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(processes)
+            results = pool.imap_unordered(_matchup_job,jobs.values(),4)
+        else:
+            pool = None
+            results = itertools.imap(_matchup_job,jobs.values())
+        try:
+            start_time = last_report = time.time()
+            done = 0
+            for (key,equity) in results:
+                store.put(key,0.0,equity)
+                done += 1
+                now = time.time()
+                if now-last_report >= 10:
+                    rate = done/(now-start_time)
+                    print "%d of %d matchups computed, %.2f/s, ETA %.2fm." % (done, len(jobs), rate, (len(jobs)-done)/rate/60.0)
+                    last_report = now
+            if pool is not None:
+                pool.close()
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.join()
+
+    vs_random = array.array('f',[0.0]*NUM_CLASSES)
+    vs_class = array.array('f',[0.0]*(NUM_CLASSES*NUM_CLASSES))
+    for (mine,(hero,rows)) in matchups.items():
+        totals = [0.0]*NUM_CLASSES
+        counts = [0]*NUM_CLASSES
+        for (his,key,flipped,villain) in rows:
+            equity = store.get(key,0.0)
+            if flipped:
+                equity = 1.0-equity
+            totals[his] += equity
+            counts[his] += 1
+        vs_random[mine] = sum(totals)/sum(counts)
+        for his in range(NUM_CLASSES):
+            vs_class[mine*NUM_CLASSES+his] = totals[his]/counts[his]
+    store.close()
+
+    values = vs_random + vs_class
+    if pokertable._byteswap_needed:
+        values.byteswap()
+    payload = values.tostring()
+    flags = samples and PREFLOP_FLAG_SAMPLED or 0
+    f = open(filename+".tmp",'wb')
+    f.write(pokertable.HEADER.pack(PREFLOP_MAGIC,PREFLOP_VERSION,NUM_CLASSES,4,flags,len(values),zlib.crc32(payload) & 0xffffffff))
+    f.write(payload)
+    f.close()
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(filename+".tmp",filename)
+    if classes is None:
+        os.remove(filename+".eqs")
+    print "Your preflop table %s is complete." % filename
+
+import unittest
+
+class Test_preflop(unittest.TestCase):
+
+    def test_classes(self):
+        self.assertEqual(len(set(CLASS_NAMES)),NUM_CLASSES)
+        self.assertEqual(sum([len(class_combos(i)) for i in range(NUM_CLASSES)]),1326)
+        for i in range(NUM_CLASSES):
+            for combo in class_combos(i):
+                self.assertEqual(hand_class(combo),i)
+        self.assertEqual(CLASS_NAMES[:3],["AA","AKs","AQs"])
+        self.assertEqual(CLASS_NAMES[13],"AKo")
+        self.assertEqual(_classes("kq"),[(CLASS_INDEX["KQs"],4.0),(CLASS_INDEX["KQo"],12.0)])
+        self.assertRaises(ValueError,_classes,"KQx")
+
+    def test_matchup_equity(self):
+        hero = cvt_to_cards(["As","Ah"])
+        villain = cvt_to_cards(["Kd","Kc"])
+        self.assertAlmostEqual(matchup_equity(hero,villain),0.812555,6)
+        estimate = matchup_equity(hero,villain,samples=4000,seed=1)
+        self.assertTrue(abs(estimate-0.812555) < 0.03)
+
+    def test_generate(self):
+        import tempfile
+        filename = os.path.join(tempfile.mkdtemp(),PREFLOP_FILENAME)
+        (aa,kk) = (CLASS_INDEX["AA"],CLASS_INDEX["KK"])
+        generate_preflop_table(filename,samples=20,classes=[aa,kk])
+        table = PreflopTable(filename)
+        self.assertEqual(table.flags,PREFLOP_FLAG_SAMPLED)
+        self.assertTrue(0.75 < table.equity("AA") < 0.95)
+        self.assertTrue(table.equity("AA","72o") > table.equity("AA","KK") > 0.5)
+        self.assertEqual(table.equity(cvt_to_cards(["Ad","Ac"]),"KK"),table.equity("AA","KK"))
+        # mirror image matchups are computed once
+        self.assertAlmostEqual(table.equity("AA","KK")+table.equity("KK","AA"),1.0,6)
+        # resuming reuses the finished matchups
+        store = equitystore.EquityStore(filename+".eqs",zlib.crc32("preflop %d %s"%(equitystore.EVALUATOR_VERSION,20)) & 0xffffffff)
+        matchups = _matchups([aa,kk])
+        self.assertEqual(len(store),len(set([key for (hero,rows) in matchups.values() for (his,key,flipped,villain) in rows])))
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+    unittest.main()
@@ -0,0 +1,330 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+rangeequity.py
+    Equity of a range of hands against a range of hands.  A range is a set
+    of the 1,326 two-card combos, each with a weight (how likely the player
+    is to hold it); combo ids are the colex rank of the two card indices
+    (0 = 2c2d, 1325 = AhAs), see combo_id.
+
+    range_equity enumerates (or samples) the runouts once.  On each runout
+    it evaluates every live combo of both ranges once, sorts the villain
+    values with running weight totals, and finds the weight each hero combo
+    beats and ties with binary searches, the way boardindex does: the total
+    over the whole villain range, less the villain combos that share a card
+    with the hero's (card removal), plus the one that shares both, which
+    was taken away twice.  Every (hero combo, villain combo, runout) with no
+    card in common counts with weight hero weight * villain weight.
+
+        (equity, combos) = range_equity({"AsAh":1.0, "KsKh":0.5}, villain, board)
+
+    combos maps each hero combo id to its own equity against the range.
+
+    flop_equity_table does the same for every combo at once on a flop,
+    blending the turn and river equities by turn_weight as
+    poker.weightedcomparehands does, and returns a table by combo id.
+"""
+
+import random
+from bisect import bisect_left,bisect_right
+import handstate,combinatorics,cache
+from cardset import CardSet,NUMCARDS,INDEX_CARD,cards_mask,mask_indices,popcount
+from poker_globals import *
+
+NUM_COMBOS = 1326
+
+# COMBO_INDICES[id] is the (low,high) pair of card indices of a combo,
+# COMBO_MASK[id] its card mask.
+COMBO_INDICES = [None]*NUM_COMBOS
+COMBO_MASK = [0]*NUM_COMBOS
+for _high in range(NUMCARDS):
+    for _low in range(_high):
+        _id = combinatorics.rank([_low,_high])
+        COMBO_INDICES[_id] = (_low,_high)
+        COMBO_MASK[_id] = (1<<_low)|(1<<_high)
+COMBO_ID = dict([(_mask,_id) for (_id,_mask) in enumerate(COMBO_MASK)])
+
+def combo_id(combo):
+    """ The id of a combo: two cards, a CardSet or card mask of two cards, a
+    string like "AsKd", or an id.
+
+    >>> combo_id("2c2d"), combo_id(["As","Ah"])
+    (0, 1325)
+    """
+    if type(combo) in (int,long) and combo < NUM_COMBOS:
+        return combo
+    if type(combo) is str:
+        combo = [combo[:2],combo[2:]]
+    try:
+        return COMBO_ID[cards_mask(combo)]
+    except KeyError:
+        raise ValueError("not a two card combo: %s"%(combo,))
+
+def combo_cards(id):
+    """ The two (rank,suit) cards of a combo id. """
+    (low,high) = COMBO_INDICES[id]
+    return [INDEX_CARD[high],INDEX_CARD[low]]
+
+def as_range(hands):
+    """ A range as a {combo id: weight} dict, from a dict of combos (in any
+    form combo_id takes) to weights, a sequence of combos all weighted 1,
+    or a handrange notation string or bitset.  Zero weights are dropped. """
+    if type(hands) is str or type(hands) in (int,long):
+        import handrange
+        if type(hands) is str:
+            hands = handrange.compile_range(hands)
+        return dict([(id,1.0) for id in handrange.range_ids(hands)])
+    if isinstance(hands,dict):
+        items = hands.items()
+    else:
+        items = [(hand,1.0) for hand in hands]
+    result = {}
+    for (hand,weight) in items:
+        if weight:
+            id = combo_id(hand)
+            result[id] = result.get(id,0.0) + weight
+    return result
+
+class _Villains:
+    """ The villain range on one runout: its values sorted, with running
+    weight totals, overall and for the combos that use each card. """
+
+    def __init__(self,values,weights):
+        bycard = {}
+        everything = []
+        for (id,value) in values.iteritems():
+            entry = (value,weights[id])
+            everything.append(entry)
+            (low,high) = COMBO_INDICES[id]
+            bycard.setdefault(low,[]).append(entry)
+            bycard.setdefault(high,[]).append(entry)
+        self.all = self._totals(everything)
+        self.bycard = dict([(card,self._totals(entries)) for (card,entries) in bycard.iteritems()])
+        self.values = values
+        self.weights = weights
+
+    def _totals(self,entries):
+        entries.sort()
+        totals = [0.0]
+        for (value,weight) in entries:
+            totals.append(totals[-1]+weight)
+        return ([value for (value,weight) in entries],totals)
+
+    def against(self,id,value):
+        """ (weight below value, weight equal to it, total weight) of the
+        villain combos without a card of combo id. """
+        below = tied = total = 0.0
+        parts = [(self.all,1)] + [(self.bycard[card],-1) for card in COMBO_INDICES[id] if card in self.bycard]
+        for ((values,totals),sign) in parts:
+            lo = bisect_left(values,value)
+            hi = bisect_right(values,value)
+            below += sign*totals[lo]
+            tied += sign*(totals[hi]-totals[lo])
+            total += sign*totals[-1]
+        # the villain combo with both cards was taken away twice
+        if id in self.values:
+            (other,weight) = (self.values[id],self.weights[id])
+            total += weight
+            if other < value:
+                below += weight
+            elif other == value:
+                tied += weight
+        return (below,tied,total)
+
+# the state delta of each combo's two cards
+COMBO_DELTA = [handstate.INDEX_DELTA[low]+handstate.INDEX_DELTA[high] for (low,high) in COMBO_INDICES]
+
+def _score_runout(state,runoutmask,heroes,villains,wins,counts):
+    """ Add each live hero combo's wins (ties half) and villain weight on
+    one runout, the board state state with the cards runoutmask added to
+    the common cards, to wins and counts. """
+    state_pokerval = handstate.state_pokerval
+    # each live combo is evaluated once on this runout
+    values = {}
+    for id in heroes.keys()+villains.keys():
+        if id not in values and not COMBO_MASK[id] & runoutmask:
+            values[id] = state_pokerval(state+COMBO_DELTA[id])
+    villainvalues = dict([(id,values[id]) for id in villains if id in values])
+    table = _Villains(villainvalues,villains)
+    for id in heroes:
+        if id in values:
+            (below,tied,total) = table.against(id,values[id])
+            wins[id] += below+tied/2.
+            counts[id] += total
+
+def range_equity(herorange,villainrange,commoncards=None,samples=None,seed=None):
+    """ The equity of herorange against villainrange (see as_range) over
+    every runout of 0 to 5 common cards, or samples random runouts.
+    Returns (equity, {hero combo id: equity}); combos that can't meet any
+    villain combo are left out.  Ties count half. """
+    heroes = as_range(herorange)
+    villains = as_range(villainrange)
+    boardmask = cards_mask(commoncards or [])
+    if popcount(boardmask) > 5:
+        raise ValueError("too many common cards: %s"%(commoncards,))
+    # combos using a board card are dead
+    heroes = dict([(id,weight) for (id,weight) in heroes.items() if not COMBO_MASK[id] & boardmask])
+    villains = dict([(id,weight) for (id,weight) in villains.items() if not COMBO_MASK[id] & boardmask])
+    deck = CardSet.deck(boardmask).indices()
+    k = 5-popcount(boardmask)
+    if samples is None:
+        runouts = combinatorics.xuniqueCombinations(deck,k)
+    else:
+        rand = random.Random(seed)
+        runouts = (rand.sample(deck,k) for i in xrange(samples))
+
+    board = handstate.add_mask(handstate.EMPTY,boardmask)
+    delta = handstate.INDEX_DELTA
+    wins = dict([(id,0.0) for id in heroes])
+    counts = dict([(id,0.0) for id in heroes])
+    for runout in runouts:
+        runoutmask = 0
+        state = board
+        for card in runout:
+            runoutmask |= 1<<card
+            state += delta[card]
+        _score_runout(state,runoutmask,heroes,villains,wins,counts)
+    equity = sum([heroes[id]*wins[id] for id in heroes])
+    total = sum([heroes[id]*counts[id] for id in heroes])
+    if not total:
+        raise ValueError("no hero combo can meet a villain combo")
+    return (equity/total,dict([(id,wins[id]/counts[id]) for id in heroes if counts[id]]))
+
+# recent flop_equity_table results
+flop_tables = cache.LRUCache("rangeequity.flop_equity_table",maxentries=16)
+
+def flop_equity_table(commoncards,villainrange=None,turn_weight=0.75):
+    """ The equity of every hero combo on a flop against villainrange (see
+    as_range), or a random hand if it's None, blended as
+    poker.weightedcomparehands does: turn_weight * (equity when the turn is
+    the last card) + (1-turn_weight) * (equity at the river).  Each turn
+    and each river runout is enumerated once, for all the combos together.
+
+    Returns a tuple indexed by combo id, None for the combos that can't
+    play (they use a board card, or no villain combo can meet them).
+    Recent tables are cached, and shared between callers, which is why
+    the table can't be changed. """
+    boardmask = cards_mask(commoncards)
+    if popcount(boardmask) != 3:
+        raise ValueError("flop_equity_table needs the 3 flop cards, not %s"%(commoncards,))
+    live = [id for id in range(NUM_COMBOS) if not COMBO_MASK[id] & boardmask]
+    if villainrange is None:
+        villains = dict([(id,1.0) for id in live])
+    else:
+        villains = dict([(id,weight) for (id,weight) in as_range(villainrange).items() if not COMBO_MASK[id] & boardmask])
+    cachekey = (boardmask,tuple(sorted(villains.items())),turn_weight)
+    table = flop_tables.get(cachekey)
+    if table is not None:
+        return table
+    heroes = dict([(id,1.0) for id in live])
+
+    board = handstate.add_mask(handstate.EMPTY,boardmask)
+    delta = handstate.INDEX_DELTA
+    turnwins = dict([(id,0.0) for id in heroes])
+    turncounts = dict([(id,0.0) for id in heroes])
+    riverwins = dict([(id,0.0) for id in heroes])
+    rivercounts = dict([(id,0.0) for id in heroes])
+    deck = CardSet.deck(boardmask).indices()
+    for (n,turn) in enumerate(deck):
+        turnstate = board + delta[turn]
+        if turn_weight > 0.0:
+            _score_runout(turnstate,1<<turn,heroes,villains,turnwins,turncounts)
+        if turn_weight < 1.0:
+            for river in deck[n+1:]:
+                _score_runout(turnstate+delta[river],(1<<turn)|(1<<river),heroes,villains,riverwins,rivercounts)
+
+    table = [None]*NUM_COMBOS
+    for id in heroes:
+        if turn_weight > 0.0 and not turncounts[id] or turn_weight < 1.0 and not rivercounts[id]:
+            continue
+        equity = 0.0
+        if turn_weight > 0.0:
+            equity += turn_weight*turnwins[id]/turncounts[id]
+        if turn_weight < 1.0:
+            equity += (1.0-turn_weight)*riverwins[id]/rivercounts[id]
+        table[id] = equity
+    table = tuple(table)
+    flop_tables[cachekey] = table
+    return table
+
+import unittest
+
+class Test_rangeequity(unittest.TestCase):
+
+    def test_combos(self):
+        self.assertEqual(len(COMBO_ID),NUM_COMBOS)
+        for id in range(NUM_COMBOS):
+            self.assertEqual(combo_id(combo_cards(id)),id)
+        self.assertEqual(combo_id(CardSet(["Kd","Ks"])),combo_id("KsKd"))
+        self.assertRaises(ValueError,combo_id,["As","Ks","Qs"])
+        self.assertEqual(as_range({"AsAh":2,"AhAs":1,"KsKh":0}),{1325:3})
+        self.assertEqual(sorted(as_range("AA")),sorted(as_range(["AcAd","AcAh","AcAs","AdAh","AdAs","AhAs"])))
+
+    def test_matches_pairwise(self):
+        import poker
+        heroes = {"AsAh":1.0,"KsKh":0.5,"7c2d":2.0}
+        villains = {"AdAc":1.0,"QhJh":1.0,"KsQs":0.25,"2c2h":1.0}
+        board = ["Kd","7s","2s"]
+        (equity,combos) = range_equity(heroes,villains,board)
+        expected = {}
+        total = weights = 0.0
+        for (hero,weight) in heroes.items():
+            mine = mask_indices(cards_mask(combo_cards(combo_id(hero))))
+            num = den = 0.0
+            for (villain,hisweight) in villains.items():
+                his = cards_mask(combo_cards(combo_id(villain)))
+                if his & cards_mask(combo_cards(combo_id(hero))):
+                    continue
+                live = len(CardSet.deck(board,combo_cards(combo_id(hero)),his))
+                runouts = live*(live-1)/2
+                result = poker.comparehands(combo_cards(combo_id(hero)),[CardSet(his).cards()],board,force_unweighted=True)
+                num += hisweight*result*runouts
+                den += hisweight*runouts
+            expected[combo_id(hero)] = num/den
+            total += weight*num
+            weights += weight*den
+        self.assertAlmostEqual(equity,total/weights)
+        for (id,value) in expected.items():
+            self.assertAlmostEqual(combos[id],value)
+
+    def test_flop_table(self):
+        import poker
+        board = cvt_to_cards(["Kd","7s","2s"])
+        villain = "QhJh"
+        table = flop_equity_table(board,{villain:1.0})
+        self.assertEqual(flop_equity_table(board,[villain]),table)
+        self.assertEqual(type(table),tuple)
+        for hero in ("AsAh","7h7c","3s4s"):
+            self.assertAlmostEqual(table[combo_id(hero)],
+                poker.weightedcomparehands(combo_cards(combo_id(hero)),[combo_cards(combo_id(villain))],board))
+        self.assertEqual(table[combo_id("KdKs")],None)
+        self.assertEqual(table[combo_id("QhJs")],None)
+        self.assertEqual(len([equity for equity in table if equity is not None]),1176-95)
+        self.assertRaises(ValueError,flop_equity_table,board[:2])
+
+    def test_sampled(self):
+        heroes = ["AsAh","AdAc"]
+        villains = ["KsKh","QdQc","JsTs"]
+        (exact,combos) = range_equity(heroes,villains,["2c","7h","9d"])
+        (sampled,combos) = range_equity(heroes,villains,["2c","7h","9d"],samples=300,seed=5)
+        self.assertTrue(abs(sampled-exact) < 0.05)
+        self.assertRaises(ValueError,range_equity,["AsAh"],["AsKs"],["2c","7h","9d"])
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+    unittest.main()
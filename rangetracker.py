@@ -0,0 +1,256 @@
+"""
+THEbot, a Texas Hold'em poker software library.
+    Copyright (C) 2011  Scott Stafford
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+rangetracker.py
+    Keeps every seat's range up to date through a hand.  Each seat's range
+    is a row of weights over the 1,326 combos (rangeequity combo ids) in one
+    (seats, 1326) numpy array, and each action narrows it by Bayes' rule:
+    the row is multiplied by the likelihood of that action for every combo,
+    one vectorized operation per action:
+
+        tracker = RangeTracker(chairs=[0,3,5,8], known_cards=mycards)
+        tracker.observe({'chair':3, 'action':RAIS, 'assumed_hands':None})
+        tracker.set_board(flop)
+        (equity, combos) = rangeequity.range_equity(mine, tracker.range(3), flop)
+
+    The likelihoods are functions of each combo's strength, its percentile
+    among all holdings (preflop, from preflop.tbl's equities vs. a random
+    hand if it's been generated, otherwise the Chen formula; after the flop,
+    from boardindex).  ActionModel holds one function per action and can be
+    replaced.  Board and known cards zero the combos that use them, in
+    every row at once.  An action record whose assumed_hands is handrange
+    notation or a bitset also limits the seat to that range.
+
+    This module needs numpy.
+"""
+
+import numpy
+import handrange
+from rangeequity import NUM_COMBOS,COMBO_INDICES,COMBO_MASK
+from boardindex import board_index
+from cardset import cards_mask
+from poker_globals import *
+
+COMBO_LOW = numpy.array([low for (low,high) in COMBO_INDICES],dtype=numpy.intp)
+COMBO_HIGH = numpy.array([high for (low,high) in COMBO_INDICES],dtype=numpy.intp)
+
+def _percentiles(values,live):
+    """ Each live combo's percentile among the live combos' values, ties
+    counting half; dead combos get 0. """
+    ranked = numpy.sort(values[live])
+    lo = numpy.searchsorted(ranked,values,'left')
+    hi = numpy.searchsorted(ranked,values,'right')
+    return numpy.where(live,(lo+hi)/(2.0*len(ranked)),0.0)
+
+def _chen(high,low,suited):
+    """ Bill Chen's preflop score of a starting hand. """
+    points = {14:10.,13:8.,12:7.,11:6.}
+    score = points.get(high,high/2.)
+    if high == low:
+        return max(5.,score*2)
+    if suited:
+        score += 2
+    gap = high-low-1
+    score -= [0,1,2,4][min(gap,3)] + (gap >= 4 and 1 or 0)
+    if gap <= 1 and high < 12:
+        score += 1
+    return score
+
+_preflop_strengths = None
+
+def preflop_strengths():
+    """ Every combo's preflop strength, a percentile from 0 to 1. """
+    global _preflop_strengths
+    if _preflop_strengths is None:
+        import preflop,pokertable
+        try:
+            table = preflop.PreflopTable()
+            score = lambda index,cards: table.vs_random[index]
+        except (IOError,pokertable.TableError):
+            score = lambda index,cards: _chen(cards[0][0],cards[1][0],cards[0][1]==cards[1][1])
+        import rangeequity
+        values = numpy.zeros(NUM_COMBOS)
+        for id in range(NUM_COMBOS):
+            cards = rangeequity.combo_cards(id)
+            values[id] = score(preflop.hand_class(cards),cards)
+        _preflop_strengths = _percentiles(values,numpy.ones(NUM_COMBOS,dtype=bool))
+    return _preflop_strengths
+
+def board_strengths(board):
+    """ Every combo's strength on a 3 to 5 card board: its percentile among
+    the holdings that don't use a board card.  Combos that do get 0. """
+    index = board_index(board)
+    values = numpy.zeros(NUM_COMBOS)
+    live = numpy.zeros(NUM_COMBOS,dtype=bool)
+    for (id,mask) in enumerate(COMBO_MASK):
+        value = index.holdings.get(mask)
+        if value is not None:
+            values[id] = value
+            live[id] = True
+    return _percentiles(values,live)
+
+class ActionModel:
+    """ The likelihood of each action given a combo's strength s (an array
+    of percentiles); actions not listed don't change the range. """
+
+    def __init__(self,likelihoods=None):
+        self.likelihoods = {
+            BET:    lambda s: 0.05 + 0.95*s**2,
+            RAIS:   lambda s: 0.03 + 0.97*s**3,
+            ALLIN:  lambda s: 0.01 + 0.99*s**5,
+            CALL:   lambda s: 0.10 + 0.90*numpy.exp(-((s-0.6)/0.25)**2),
+            CHECK:  lambda s: 0.30 + 0.70*(1-s),
+        }
+        if likelihoods:
+            self.likelihoods.update(likelihoods)
+
+    def likelihood(self,action,strengths):
+        """ The likelihood array of action, or None if it says nothing. """
+        function = self.likelihoods.get(action)
+        if function is None:
+            return None
+        return function(strengths)
+
+class RangeTracker:
+    """ The ranges of the seats in one hand. """
+
+    def __init__(self,chairs=range(10),known_cards=None,model=None):
+        self.chairs = list(chairs)
+        self.row = dict([(chair,n) for (n,chair) in enumerate(self.chairs)])
+        self.weights = numpy.ones((len(self.chairs),NUM_COMBOS))
+        self.folded = set()
+        self.model = model or ActionModel()
+        self.deadmask = 0
+        self.board = []
+        self.strengths = preflop_strengths()
+        if known_cards:
+            self.remove_cards(known_cards)
+
+    def remove_cards(self,cards):
+        """ Nobody can hold a combo using one of these cards (the hero's, or
+        the board's). """
+        mask = cards_mask(cards) & ~self.deadmask
+        if not mask:
+            return
+        self.deadmask |= mask
+        cards = numpy.array([(mask >> i) & 1 for i in range(52)],dtype=bool)
+        dead = cards[COMBO_LOW] | cards[COMBO_HIGH]
+        self.weights[:,dead] = 0.0
+
+    def set_board(self,board):
+        """ The common cards so far: remove them and rate the combos on
+        them from now on. """
+        self.board = list(board)
+        self.remove_cards(board)
+        if len(self.board) >= 3:
+            self.strengths = board_strengths(self.board)
+
+    def observe(self,action):
+        """ Narrow the acting seat's range by an action record (a dict with
+        'chair', 'action' and optionally 'assumed_hands', as in the action
+        list). """
+        chair = action['chair']
+        if chair not in self.row:
+            return
+        if action['action'] == FOLD:
+            self.folded.add(chair)
+            return
+        row = self.weights[self.row[chair]]
+        likelihood = self.model.likelihood(action['action'],self.strengths)
+        if likelihood is not None:
+            row *= likelihood
+        assumed = action.get('assumed_hands')
+        if type(assumed) is str or type(assumed) in (int,long):
+            if type(assumed) is str:
+                assumed = handrange.compile_range(assumed)
+            row *= range_vector(assumed)
+        total = row.sum()
+        if total > 0:
+            row /= total
+
+    def distribution(self,chair):
+        """ The seat's range as probabilities over the combo ids (a numpy
+        array summing to 1, or to 0 if nothing is left). """
+        row = self.weights[self.row[chair]]
+        total = row.sum()
+        if total <= 0:
+            return row.copy()
+        return row/total
+
+    def range(self,chair,threshold=0.0):
+        """ The seat's range as a {combo id: probability} dict for
+        rangeequity, leaving out combos at or below threshold. """
+        probabilities = self.distribution(chair)
+        ids = numpy.nonzero(probabilities > threshold)[0]
+        return dict(zip(ids.tolist(),probabilities[ids].tolist()))
+
+    def active(self):
+        """ The chairs that haven't folded. """
+        return [chair for chair in self.chairs if chair not in self.folded]
+
+def range_vector(bits):
+    """ A 0/1 numpy array over the combo ids from a range bitset. """
+    vector = numpy.zeros(NUM_COMBOS)
+    vector[handrange.range_ids(bits)] = 1.0
+    return vector
+
+import unittest
+
+class Test_rangetracker(unittest.TestCase):
+
+    def test_narrowing(self):
+        import rangeequity
+        mine = cvt_to_cards(["As","Ah"])
+        tracker = RangeTracker(chairs=[1,4,7],known_cards=mine)
+        aces = rangeequity.combo_id(["Ad","Ac"])
+        trash = rangeequity.combo_id(["7d","2c"])
+        blocked = rangeequity.combo_id(["As","Kd"])
+        self.assertEqual(tracker.distribution(1)[blocked],0.0)
+        self.assertAlmostEqual(tracker.distribution(1).sum(),1.0)
+        before = tracker.distribution(4)[aces]
+        tracker.observe({'chair':4,'action':RAIS,'assumed_hands':None})
+        tracker.observe({'chair':7,'action':FOLD,'assumed_hands':None})
+        tracker.observe({'chair':1,'action':CALL,'assumed_hands':None})
+        self.assertTrue(tracker.distribution(4)[aces] > before > tracker.distribution(4)[trash])
+        self.assertEqual(tracker.active(),[1,4])
+        flop = cvt_to_cards(["Ad","7h","2s"])
+        tracker.set_board(flop)
+        self.assertEqual(tracker.distribution(4)[aces],0.0)
+        # a bet on the flop makes the set of sevens likelier than before
+        sevens = rangeequity.combo_id(["7d","7c"])
+        before = tracker.distribution(1)[sevens]
+        tracker.observe({'chair':1,'action':BET,'assumed_hands':None})
+        self.assertTrue(tracker.distribution(1)[sevens] > before)
+        # an assumed range limits the seat to it
+        tracker.observe({'chair':4,'action':CALL,'assumed_hands':"QQ+, 77"})
+        self.assertEqual(sorted(tracker.range(4).keys()),sorted(
+            [id for id in handrange.range_ids(handrange.compile_range("QQ+, 77")) if not COMBO_MASK[id] & cards_mask(mine+flop)]))
+        (equity,combos) = rangeequity.range_equity([mine],tracker.range(4),flop)
+        self.assertTrue(0 < equity < 1)
+
+    def test_strengths(self):
+        strengths = preflop_strengths()
+        import rangeequity
+        self.assertTrue(strengths[rangeequity.combo_id("AsAh")] > strengths[rangeequity.combo_id("KsQs")] > strengths[rangeequity.combo_id("7d2c")])
+        board = cvt_to_cards(["Kd","7s","2c"])
+        strengths = board_strengths(board)
+        # top set, tied with the other two sets of kings
+        self.assertAlmostEqual(strengths[rangeequity.combo_id("KsKh")],(1173+1176)/2./1176)
+        self.assertEqual(strengths[rangeequity.combo_id("KdKh")],0.0)
+
+if __name__ == '__main__':
+    unittest.main()